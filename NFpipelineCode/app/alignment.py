@@ -10,53 +10,151 @@ DESCRIPTION: This script creates the data element alignment database that is use
 scales and names to FITBIR scales and names, and vice versa. It uses the "alignment_table_first_element_test_condition.csv"
 file found in the repository. This file should be updated periodically to reflect changes to the NDA and FITBIR databases.
 
+The names of the elements, structures and forms and the operators are stripped of spaces, and the rules of each row are
+checked (with the alignment_rules module) before the database is written, so rows with a bad operator, condition or
+formula are rejected. The parsed rule of each row is stored next to it (NF_Rule/NF_Parsed and FN_Rule/FN_Parsed), and
+the application builds the rules from them instead of parsing the conditions again. The element, structure and form
+columns are indexed.
+
 """
 
+import os
 import csv
+import json
+import logging
 import sqlite3
 
-filename = "alignment_table_first_element_test_condition.csv"
-# Get column names
-with open(filename, 'r') as fin:
-    csvreader = csv.reader(fin)
-    # Get just the first row, which should hold the column names
-    columns = next(csvreader)
-
-# Create table and database if the table does not exist
-con = sqlite3.connect("aligned_first_element.db") # name the database something appropriate
-cur = con.cursor()
-
-col_tuple = tuple([col + ' TEXT' for col in columns]) #tuple(columns) #
-# Create the table, removing the previous table if it exists (done to update results)
-schema1 = '''DROP TABLE IF EXISTS alignment; '''
-schema2 = f'''CREATE TABLE IF NOT EXISTS alignment {col_tuple};'''
-# Remove quotes from schema2
-schema2 = schema2.replace("'", "")
-
-# Exceute the schemas to create the database
-cur.execute(schema1)
-cur.execute(schema2)
-
-with open(filename, 'r', encoding='utf-8-sig') as f:
-
-    reader = csv.DictReader(f)
+import alignment_rules
 
-    to_database = [tuple(map(lambda x: row[x], columns),) for row in reader]
-    #to_database = [(i['NDA Element Name'], i['FITBIR Element Name'], i['NDA Form'], i['FITBIR Form']) for i in reader]
-
-qmark_tuple = tuple(['?']*len(col_tuple))
-
-# Insert the GUID and interview_date conversions into the database
-cur.execute('''INSERT INTO alignment(NDA_Element, FITBIR_Element) VALUES(?,?)''', ('subjectkey', 'GUID'))
-cur.execute('''INSERT INTO alignment(NDA_Element, FITBIR_Element) VALUES(?,?)''', ('interview_date', 'VisitDate'))
-# Insert the other conversions
-schema_many = f"""INSERT INTO alignment{tuple(columns)} VALUES{qmark_tuple};""" # "INSERT INTO alignment (NDA_Element, FITBIR_Element, NDA_Form, FITBIR_Form) VALUES (?, ?, ?, ?);"
-schema_many = schema_many.replace("'", "")
-
-
-#for row in to_database:
-#    cur.execute(schema_many, row)
-cur.executemany(schema_many, to_database)
-
-con.commit()
-con.close()
+filename = "alignment_table_first_element_test_condition.csv"
+database = "aligned_first_element.db" # name the database something appropriate
+
+# Columns with names that are stripped of spaces
+NAME_COLUMNS = ['NDA_Element', 'FITBIR_Element', 'NDA_Structure', 'FITBIR_Form', 'NF_Operator', 'FN_Operator']
+# Columns with an index, for lookups by element, structure or form
+INDEXED_COLUMNS = ['NDA_Element', 'FITBIR_Element', 'NDA_Structure', 'FITBIR_Form']
+# Rule columns of each direction: prefix of the columns in the table and the element the rule is for
+DIRECTIONS = {'NF': (alignment_rules.NDA_TO_FITBIR, 'NDA_Element'),
+              'FN': (alignment_rules.FITBIR_TO_NDA, 'FITBIR_Element')}
+# Kind of rule and parsed conditions of each direction (see parse_rule)
+RULE_COLUMNS = [f'{prefix}_{col}' for prefix in DIRECTIONS for col in ['Rule', 'Parsed']]
+# Rows that are added before the rows of the file
+EXTRA_ROWS = [{'NDA_Element': 'subjectkey', 'FITBIR_Element': 'GUID'},
+              {'NDA_Element': 'interview_date', 'FITBIR_Element': 'VisitDate'}]
+
+
+def read_alignment_csv(filename):
+    '''
+    Reads the alignment table.
+
+    Returns
+    -----------
+    columns: a list - the column names
+    rows: a list - a dict (column name -> value) for each row
+    '''
+    with open(filename, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+
+    return reader.fieldnames, rows
+
+def normalize_row(row):
+    ''' Strips the spaces of the names and operators of a row '''
+    row = dict(row)
+    for col in NAME_COLUMNS:
+        if row.get(col) is not None:
+            row[col] = row[col].strip()
+
+    return row
+
+def parse_rule(row, prefix):
+    '''
+    Checks and parses the scaling rule of a row for a direction.
+
+    Parameters
+    -----------
+    row: a dict - a normalized row of the alignment table
+    prefix: a str - 'NF' (NDA to FITBIR) or 'FN' (FITBIR to NDA)
+
+    Returns
+    -----------
+    kind: a str - the alignment_rules.Rule that is used (MappingRule, SumRule, NoRule, ...)
+    parsed: a str - JSON of the parsed conditions (the mapping, the [column, value] conditions or the summed columns)
+
+    Raises a ValueError (or SyntaxError) if the operator, conditions or formula are bad.
+    '''
+    direction, element_col = DIRECTIONS[prefix]
+    cond1, cond2, operator = row.get(f'{prefix}_Condition1'), row.get(f'{prefix}_Condition2'), row.get(f'{prefix}_Operator')
+    rule = alignment_rules.compile_rule(row[element_col], {'FITBIR_Element': row['FITBIR_Element'],
+                                                          'Condition1': cond1,
+                                                          'Condition2': cond2,
+                                                          'Operator': operator,
+                                                          'Formula': row.get(f'{prefix}_formula')}, direction)
+
+    if isinstance(rule, alignment_rules.MappingRule):
+        parsed = rule.mapping
+    elif isinstance(rule, (alignment_rules.NewColumnsRule, alignment_rules.ConditionRule)):
+        parsed = [list(condition) for condition in rule.conditions]
+    elif isinstance(rule, (alignment_rules.SumRule, alignment_rules.ColumnSumRule)):
+        parsed = rule.columns
+    elif isinstance(rule, alignment_rules.ExceptionRule):
+        parsed = rule.value
+    else:
+        parsed = None
+
+    return type(rule).__name__, json.dumps(parsed)
+
+def build_database(filename, database):
+    '''
+    Creates the alignment database from the alignment table. The database is written to a temporary
+    file first, so it is replaced at once (the application reloads it when the file changes).
+
+    Parameters
+    -----------
+    filename: a str - the alignment table (CSV)
+    database: a str - the database to create
+
+    Returns
+    -----------
+    rejected: a list - (line number, element, error) of the rows that were not added
+    '''
+    columns, rows = read_alignment_csv(filename)
+
+    to_database = []
+    rejected = []
+    for line, row in [(None, row) for row in EXTRA_ROWS] + list(enumerate(rows, start = 2)):
+        row = normalize_row(row)
+        try:
+            parsed = [value for prefix in DIRECTIONS for value in parse_rule(row, prefix)]
+        except (ValueError, SyntaxError, IndexError, AttributeError) as e:
+            logging.warning(f"Rejected line {line} of {filename} ({row.get('NDA_Element')}): {e}")
+            rejected.append((line, row.get('NDA_Element'), str(e)))
+            continue
+        to_database.append(tuple(row.get(col) for col in columns) + tuple(parsed))
+
+    temp_database = f'{database}.tmp'
+    if os.path.exists(temp_database):
+        os.remove(temp_database)
+    con = sqlite3.connect(temp_database)
+    try:
+        cur = con.cursor()
+        all_columns = columns + RULE_COLUMNS
+        # The id keeps the order of the rows (the first row of an element is used)
+        cur.execute(f'''CREATE TABLE alignment (id INTEGER PRIMARY KEY, {', '.join(col + ' TEXT' for col in all_columns)});''')
+        for col in INDEXED_COLUMNS:
+            cur.execute(f'''CREATE INDEX idx_alignment_{col} ON alignment ({col});''')
+        cur.executemany(f'''INSERT INTO alignment ({', '.join(all_columns)}) VALUES ({', '.join('?' * len(all_columns))});''',
+                        to_database)
+        con.commit()
+    finally:
+        con.close()
+    os.replace(temp_database, database)
+    logging.info(f"Created {database} with {len(to_database)} rows ({len(rejected)} rejected)")
+
+    return rejected
+
+
+if __name__ == '__main__':
+    rejected = build_database(filename, database)
+    for line, element, error in rejected:
+        print(f"Rejected line {line} ({element}): {error}")
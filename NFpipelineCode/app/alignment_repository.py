@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module keeps the alignment table of the database in memory, so the preprocessing pages don't
+query the database every time they are loaded. The table is read once for both directions (NDA to FITBIR and
+FITBIR to NDA) and read again when the database file changes (its modification time or size). The rules parsed when
+the database was built (alignment.build_database) are passed on with the scaling rules, so they aren't parsed again.
+"""
+import os
+import logging
+import sqlite3
+import threading
+
+import alignment
+import alignment_rules
+
+
+class AlignmentTable:
+    '''
+    The alignment table for one direction: the column name mapping, the scaling rules
+    (the column_scaling dict of the preprocessors) and the compiled AlignmentPlan of the rules.
+    '''
+
+    def __init__(self, direction, column_mapping, column_scaling):
+
+        self.direction = direction
+        self.column_mapping = column_mapping
+        self.column_scaling = column_scaling
+        self._plan = None
+
+    @property
+    def plan(self):
+        ''' The compiled scaling rules (compiled the first time they are used) '''
+        if self._plan is None:
+            self._plan = alignment_rules.AlignmentPlan(self.column_scaling, self.direction)
+
+        return self._plan
+
+
+def load_tables(database_path):
+    '''
+    Reads the alignment table of the database.
+
+    Parameters
+    -----------
+    database_path: a str - path of the alignment database
+
+    Returns
+    -----------
+    tables: a dict - direction (alignment_rules.NDA_TO_FITBIR or FITBIR_TO_NDA) -> AlignmentTable
+    '''
+    con = sqlite3.connect(database_path)
+    try:
+        con.row_factory = sqlite3.Row
+        cur = con.cursor()
+        # Databases made before the rules were parsed by the alignment script don't have the rule columns
+        table_columns = [row['name'] for row in cur.execute('PRAGMA table_info(alignment)')]
+        parsed = all(col in table_columns for col in alignment.RULE_COLUMNS)
+        rule_columns = ', ' + ', '.join(alignment.RULE_COLUMNS) if parsed else ''
+        cur.execute(f'SELECT NDA_Element, FITBIR_Element, NF_Condition1, NF_Condition2, NF_Operator, NF_formula, \
+                    FN_Condition1, FN_Condition2, FN_Operator, FN_formula{rule_columns} FROM alignment ORDER BY rowid')
+        rows = cur.fetchall()
+    finally:
+        con.close()
+
+    nda_mapping, nda_scaling = dict(), dict()
+    fitbir_mapping, fitbir_scaling = dict(), dict()
+    for row in rows:
+        nda_element = row['NDA_Element'].strip()
+        fitbir_element = row['FITBIR_Element'].strip()
+        # The first row of an element is used
+        if nda_element not in nda_mapping:
+            nda_mapping[nda_element] = fitbir_element
+            # The conditions are based on the FITBIR names
+            nda_scaling[nda_element] = {'FITBIR_Element': fitbir_element,
+                                        'Condition1': row['NF_Condition1'],
+                                        'Condition2': row['NF_Condition2'],
+                                        'Operator': row['NF_Operator'],
+                                        'Formula': row['NF_formula']}
+            if parsed:
+                nda_scaling[nda_element].update({'Rule': row['NF_Rule'], 'Parsed': row['NF_Parsed']})
+        if fitbir_element not in fitbir_mapping:
+            fitbir_mapping[fitbir_element] = nda_element
+            fitbir_scaling[fitbir_element] = {'Condition1': row['FN_Condition1'],
+                                              'Condition2': row['FN_Condition2'],
+                                              'Operator': row['FN_Operator'],
+                                              'Formula': row['FN_formula']}
+            if parsed:
+                fitbir_scaling[fitbir_element].update({'Rule': row['FN_Rule'], 'Parsed': row['FN_Parsed']})
+    logging.info(f"Loaded {len(rows)} alignment rows from {database_path}")
+
+    return {alignment_rules.NDA_TO_FITBIR: AlignmentTable(alignment_rules.NDA_TO_FITBIR, nda_mapping, nda_scaling),
+            alignment_rules.FITBIR_TO_NDA: AlignmentTable(alignment_rules.FITBIR_TO_NDA, fitbir_mapping, fitbir_scaling)}
+
+
+class AlignmentRepository:
+    '''
+    The alignment tables of a database, read when first needed and again when the file changes.
+
+    Example
+    -----------
+    alignment = AlignmentRepository(database_path)
+    table = alignment.get(alignment_rules.NDA_TO_FITBIR)
+    table.column_mapping, table.column_scaling, table.plan
+    '''
+
+    def __init__(self, database_path):
+
+        self.database_path = database_path
+        self._version = None
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def _file_version(self):
+        stat = os.stat(self.database_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, direction):
+        ''' Returns the AlignmentTable of a direction (alignment_rules.NDA_TO_FITBIR or FITBIR_TO_NDA) '''
+        with self._lock:
+            version = self._file_version()
+            if self._tables is None or version != self._version:
+                self._tables = load_tables(self.database_path)
+                self._version = version
+
+            return self._tables[direction]
+
+    def find(self, column, value):
+        '''
+        Returns the rows of the database for an element, structure or form (an index seek of the database).
+
+        Parameters
+        -----------
+        column: a str - one of alignment.INDEXED_COLUMNS (NDA_Element, FITBIR_Element, NDA_Structure, FITBIR_Form)
+        value: a str - the name to find
+
+        Returns
+        -----------
+        rows: a list - a dict (column name -> value) for each row, in the order of the alignment table
+        '''
+        if column not in alignment.INDEXED_COLUMNS:
+            raise ValueError(f"{column} is not an indexed column of the alignment table")
+
+        con = sqlite3.connect(self.database_path)
+        try:
+            con.row_factory = sqlite3.Row
+            rows = con.execute(f'SELECT * FROM alignment WHERE {column} = ? ORDER BY rowid', (value.strip(),)).fetchall()
+        finally:
+            con.close()
+
+        return [dict(row) for row in rows]
+
+    def clear(self):
+        ''' Forgets the tables, so they are read again the next time '''
+        with self._lock:
+            self._tables = None
+            self._version = None
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module compiles the scaling rules of the alignment table (the column_scaling dict built from
+the alignment database) into a plan that converts a dataset from NDA to FITBIR scales or from FITBIR to NDA scales.
+The rules are parsed once (dictionary mappings, formulas, condition columns and values) and each rule is applied
+to a whole column at a time: the values are converted to numbers with numpy and the formula is evaluated on the
+array. The results are the same as NDAdataset._convert and FITBIRdataset._convert, which apply the rules one
+value at a time. The rules of a database built by the alignment script are already parsed (Rule and Parsed),
+so only their formulas are compiled.
+"""
+import re
+import ast
+import json
+import logging
+
+import numpy as np
+from dateutil.parser import parse
+
+NDA_TO_FITBIR = 'NDA to FITBIR'
+FITBIR_TO_NDA = 'FITBIR to NDA'
+
+# Elements holding dates, which are converted to MM/DD/YYYY
+DATE_ELEMENTS = ['AdvrsEvntStartDateTime', 'AdverseEvntEndDateTime']
+
+# Functions the formulas can call (evaluated one value at a time)
+FORMULA_FUNCTIONS = {'abs': abs, 'round': round, 'int': int, 'float': float, 'min': min, 'max': max}
+
+# Operators evaluated on whole arrays. They give the same results as the Python operators on floats.
+# Powers are left to Python (numpy's power can differ in the last digit).
+ARRAY_OPERATORS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+                   ast.FloorDiv: np.floor_divide, ast.Mod: np.mod}
+ARRAY_UNARY = {ast.USub: np.negative, ast.UAdd: np.positive}
+
+# The parts of Python a formula can use
+FORMULA_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load, ast.Call,
+                 ast.IfExp, ast.Compare, ast.BoolOp, ast.operator, ast.unaryop, ast.cmpop, ast.boolop)
+
+# Operators that make numbers grow fast (like 9**9**9). Their right side must be a number up to MAX_EXPONENT,
+# and their left side can't use them again.
+GROWING_OPERATORS = (ast.Pow, ast.LShift)
+MAX_EXPONENT = 100
+
+
+def check_formula(tree, formula):
+    ''' Raises a ValueError if the formula uses anything other than numbers, x, operators and FORMULA_FUNCTIONS '''
+    for node in ast.walk(tree):
+        if not isinstance(node, FORMULA_NODES):
+            raise ValueError(f"Formula {formula!r} can't use {type(node).__name__}")
+        if isinstance(node, ast.Constant) and (type(node.value) not in (int, float)):
+            raise ValueError(f"Formula {formula!r} can only use numbers, not {node.value!r}")
+        if isinstance(node, ast.Name) and node.id != 'x' and node.id not in FORMULA_FUNCTIONS:
+            raise ValueError(f"Formula {formula!r} can't use the name {node.id}")
+        if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords):
+            raise ValueError(f"Formula {formula!r} can only call {', '.join(FORMULA_FUNCTIONS)}")
+        if isinstance(node, ast.BinOp) and isinstance(node.op, GROWING_OPERATORS):
+            if not small_number(node.right) or any(isinstance(n, ast.BinOp) and isinstance(n.op, GROWING_OPERATORS)
+                                                   for n in ast.walk(node.left)):
+                raise ValueError(f"Formula {formula!r} can only raise (or shift) once by a number up to {MAX_EXPONENT}")
+
+    return tree
+
+def small_number(node):
+    ''' True if the node is a number (or minus a number) no larger than MAX_EXPONENT '''
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        node = node.operand
+    return isinstance(node, ast.Constant) and type(node.value) in (int, float) and abs(node.value) <= MAX_EXPONENT
+
+def uses_x(node):
+    return any(isinstance(n, ast.Name) and n.id == 'x' for n in ast.walk(node))
+
+def array_function(node, one):
+    '''
+    Returns a function of an array of floats that evaluates the formula node with numpy,
+    or None if the node can't be evaluated on arrays. Parts without x are calculated once by one.
+    '''
+    if not uses_x(node):
+        try:
+            value = one(ast.Expression(body = node))
+        except Exception:
+            # The error is raised when the formula is evaluated on the values
+            return None
+        return lambda x: value
+    if isinstance(node, ast.Name):
+        return lambda x: x
+    if isinstance(node, ast.BinOp) and type(node.op) in ARRAY_OPERATORS:
+        left, right = array_function(node.left, one), array_function(node.right, one)
+        if left is None or right is None:
+            return None
+        op = ARRAY_OPERATORS[type(node.op)]
+        return lambda x: op(left(x), right(x))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in ARRAY_UNARY:
+        operand = array_function(node.operand, one)
+        if operand is None:
+            return None
+        op = ARRAY_UNARY[type(node.op)]
+        return lambda x: op(operand(x))
+    if isinstance(node, ast.Call) and node.func.id == 'abs' and len(node.args) == 1:
+        operand = array_function(node.args[0], one)
+        if operand is None:
+            return None
+        return lambda x: np.abs(operand(x))
+
+    return None
+
+
+class Formula:
+    '''
+    A formula of the alignment table, like 'x+1'. Only numbers, x, operators and
+    FORMULA_FUNCTIONS are allowed (anything else is a ValueError), so the table can't run other code.
+
+    Calling it on an array of floats (NaN for the blanks) evaluates the formula on the whole array with numpy.
+    The formulas numpy can't evaluate, and the arrays that give numpy errors (like a division by zero),
+    are evaluated one value at a time, so the results and errors are the same as with Python floats.
+    '''
+
+    def __init__(self, formula):
+
+        self.formula = formula
+        tree = check_formula(ast.parse(formula.strip(), mode = 'eval'), formula)
+        self.compiled = compile(tree, '<formula>', 'eval')
+        self.array = array_function(tree.body, self._evaluate)
+
+    def _evaluate(self, expression, x = None):
+        code = compile(ast.fix_missing_locations(expression), '<formula>', 'eval')
+        return eval(code, {'__builtins__': {}, **FORMULA_FUNCTIONS}, {'x': x})
+
+    def one(self, x):
+        ''' Evaluates the formula on one value '''
+        return eval(self.compiled, {'__builtins__': {}, **FORMULA_FUNCTIONS}, {'x': x})
+
+    def __call__(self, values):
+        if self.array is not None:
+            try:
+                with np.errstate(all = 'raise'):
+                    result = self.array(values)
+                return np.broadcast_to(result, values.shape).tolist()
+            except ArithmeticError:
+                pass
+
+        names = {'__builtins__': {}, **FORMULA_FUNCTIONS}
+        return [eval(self.compiled, names, {'x': x}) for x in values.tolist()]
+
+def identity(values):
+    return values.tolist()
+
+def compile_formula(formula):
+    ''' Returns a function of an array of floats that returns a list with the formula applied to each value '''
+    if (formula != '') and (formula is not None):
+        return Formula(formula)
+
+    return identity
+
+def parse_mapping(cond1):
+    ''' Parses a dictionary mapping like '0=0,6=1;1=1' '''
+    mapping = dict()
+    for pair in re.split(',|;', cond1):
+        k = pair.split('=')
+        mapping[k[0].strip()] = k[1].strip()
+
+    return mapping
+
+def parse_condition(cond):
+    ''' Parses a condition like 'TrialNumber = 2' into the column and the value '''
+    col, val = [v.strip() for v in cond.split('=')]
+
+    return col, val
+
+def to_floats(values):
+    ''' Converts strings to a float array, with NaN for '' (like float(v if v != '' else 'nan')) '''
+    array = np.array(values, dtype = object)
+    array[array == ''] = 'nan'
+
+    return array.astype(np.float64)
+
+def convert_values(values, formula, keep_blanks = False):
+    '''
+    Returns str(formula(float(v))) for each value ('' is NaN, or stays '' if keep_blanks).
+    Columns have few different values, so each different value is converted once.
+    '''
+    uniques = list(dict.fromkeys(values))
+    if keep_blanks:
+        uniques = [v for v in uniques if v != '']
+    converted = dict(zip(uniques, [str(v) for v in formula(to_floats(uniques))]))
+    if keep_blanks:
+        converted[''] = ''
+
+    return list(map(converted.__getitem__, values))
+
+
+class Rule:
+    ''' A compiled scaling rule for one data element '''
+
+    def apply(self, dataset, element):
+        raise NotImplementedError
+
+
+class DateRule(Rule):
+    ''' Converts dates to MM/DD/YYYY (each different date is parsed once) '''
+
+    def apply(self, dataset, element):
+        logging.info("Fixing data...")
+        dates = dataset[element]
+        converted = {}
+        for date in dates:
+            if date not in converted:
+                converted[date] = parse(date).strftime('%m/%d/%Y') if date != '' else ''
+        dataset[element] = [converted[date] for date in dates]
+
+
+class MappingRule(Rule):
+    ''' Replaces the values found in a dictionary mapping '''
+
+    def __init__(self, mapping):
+
+        self.mapping = mapping
+
+    def apply(self, dataset, element):
+        logging.info("Dictionary mapping...")
+        get = self.mapping.get
+        dataset[element] = [get(v, v) for v in dataset[element]]
+
+
+class ExceptionRule(Rule):
+    ''' Blanks the values equal to a value (==) '''
+
+    def __init__(self, value):
+
+        self.value = value
+
+    def apply(self, dataset, element):
+        logging.info("Exception modeling == ...")
+        array = np.array(dataset[element], dtype = object)
+        array[array == self.value] = ''
+        dataset[element] = array.tolist()
+
+
+class NewColumnsRule(Rule):
+    '''
+    NDA to FITBIR conditions: the values are saved (with the formula applied) to the FITBIR element,
+    and the condition columns, which are created if needed, get the condition values where there is a value.
+    '''
+
+    def __init__(self, felement, conditions, formula):
+
+        self.felement = felement
+        self.conditions = conditions
+        self.formula = formula
+
+    def apply(self, dataset, element):
+        logging.info("Two conditions to modify..." if len(self.conditions) == 2 else "Only one condition to modify...")
+        values = dataset[element]
+        n = len(values)
+        for col, _ in self.conditions:
+            if col not in dataset.keys():
+                dataset[col] = [''] * n
+        if self.felement not in dataset.keys():
+            dataset[self.felement] = [''] * n
+
+        converted = convert_values(values, self.formula, keep_blanks = True)
+        for col, val in self.conditions:
+            dataset[col] = ['' if v == '' else val for v in values]
+        dataset[self.felement] = converted
+
+
+class ConditionRule(Rule):
+    '''
+    FITBIR to NDA conditions: the values are kept where the condition columns have the condition values
+    (and the formula applied to them), the others are blanked ('nan' if there is a formula).
+    '''
+
+    def __init__(self, conditions, formula):
+
+        self.conditions = conditions
+        self.formula = formula
+
+    def apply(self, dataset, element):
+        two = len(self.conditions) == 2
+        logging.info("Two conditions to modify..." if two else "Only one condition to modify...")
+        columns = [dataset[col] for col, _ in self.conditions]
+        # Like zip, stop at the shortest column
+        n = min(len(c) for c in columns + [dataset[element]])
+        mask = np.ones(n, dtype = bool)
+        for (col, val), values in zip(self.conditions, columns):
+            mask &= np.array(values[:n], dtype = object) == val
+
+        array = np.array(dataset[element][:n], dtype = object)
+        array[~mask] = ''
+        if self.formula is not identity:
+            logging.info("Apply formula after two conditions..." if two else "Apply formula after one condition...")
+            dataset[element] = convert_values(array.tolist(), self.formula)
+        else:
+            logging.info("No formula after two conditions..." if two else "No formula after one condition...")
+            dataset[element] = array.tolist()
+
+
+class SumRule(Rule):
+    ''' NDA to FITBIR: saves the sum of the columns (skipping blanks) to the FITBIR element '''
+
+    def __init__(self, felement, columns):
+
+        self.felement = felement
+        self.columns = columns
+
+    def apply(self, dataset, element):
+        logging.info("Sum of data elements...")
+        matrix = np.array(list(map(dataset.get, self.columns)), dtype = 'object').T
+        matrix[matrix == ''] = 'nan'
+        matrix = matrix.astype(float)
+        final_sums = np.nansum(matrix, axis = 1)
+        dataset[self.felement] = list(map(str, final_sums))
+
+
+class ColumnSumRule(Rule):
+    ''' FITBIR to NDA: the sum of each of the columns (as FITBIRdataset._convert does) '''
+
+    def __init__(self, columns):
+
+        self.columns = columns
+
+    def apply(self, dataset, element):
+        logging.info("Sum of data elements...")
+        matrix = np.array(list(map(dataset.get, self.columns)), dtype = float)
+        final_sums = matrix.sum(axis = 1)
+        dataset[element] = list(map(str, final_sums))
+
+
+class FormulaRule(Rule):
+    ''' Applies the formula to every value ('' becomes NaN) '''
+
+    def __init__(self, formula):
+
+        self.formula = formula
+
+    def apply(self, dataset, element):
+        logging.info("Apply formula only...")
+        dataset[element] = convert_values(dataset[element], self.formula)
+
+
+class NoRule(Rule):
+
+    def apply(self, dataset, element):
+        logging.info("Do nothing to scale...")
+
+
+class InvalidRule(Rule):
+    ''' A rule that could not be compiled: the error is raised if the element is in a dataset '''
+
+    def __init__(self, error):
+
+        self.error = error
+
+    def apply(self, dataset, element):
+        raise self.error
+
+
+def parsed_rule(rule, direction):
+    '''
+    Builds a Rule from the kind of rule and the parsed conditions saved in the database (alignment.parse_rule):
+    the mapping, the [column, value] conditions, the summed columns or the exception value.
+    '''
+    kind, parsed, formula = rule['Rule'], json.loads(rule['Parsed']), rule['Formula']
+    nda = direction == NDA_TO_FITBIR
+
+    if kind == 'DateRule':
+        return DateRule()
+    if kind == 'MappingRule':
+        return MappingRule(parsed)
+    if kind == 'ExceptionRule':
+        return ExceptionRule(parsed)
+    if kind == 'NewColumnsRule' and nda:
+        return NewColumnsRule(rule['FITBIR_Element'], [tuple(c) for c in parsed], compile_formula(formula))
+    if kind == 'ConditionRule' and not nda:
+        return ConditionRule([tuple(c) for c in parsed], compile_formula(formula) if formula != '' else identity)
+    if kind == 'SumRule' and nda:
+        return SumRule(rule['FITBIR_Element'], parsed)
+    if kind == 'ColumnSumRule' and not nda:
+        return ColumnSumRule(parsed)
+    if kind == 'FormulaRule':
+        return FormulaRule(compile_formula(formula))
+    if kind == 'NoRule':
+        return NoRule()
+
+    raise ValueError(f"Unknown rule {kind} ({direction})")
+
+def compile_rule(element, rule, direction):
+    '''
+    Compiles the scaling rule of one element.
+
+    Parameters
+    -----------
+    element: a str - the data element
+    rule: a dict - Condition1, Condition2, Operator and Formula (and FITBIR_Element from NDA to FITBIR),
+                   and the Rule and Parsed columns if the database has them
+    direction: a str - NDA_TO_FITBIR or FITBIR_TO_NDA
+
+    Returns
+    -----------
+    a Rule
+    '''
+    # Parsed when the database was built
+    if rule.get('Rule'):
+        return parsed_rule(rule, direction)
+
+    cond1, cond2, operator, formula = rule['Condition1'], rule['Condition2'], rule['Operator'], rule['Formula']
+    nda = direction == NDA_TO_FITBIR
+
+    if element in DATE_ELEMENTS:
+        return DateRule()
+    if operator == 'dict':
+        return MappingRule(parse_mapping(cond1))
+    if operator == '==':
+        return ExceptionRule(cond1)
+    if operator == '&':
+        conditions = [parse_condition(cond1), parse_condition(cond2)]
+        if nda:
+            return NewColumnsRule(rule['FITBIR_Element'], conditions, compile_formula(formula))
+        return ConditionRule(conditions, compile_formula(formula) if formula != '' else identity)
+    if operator == 'sum':
+        if nda:
+            return SumRule(rule['FITBIR_Element'], cond1.split(','))
+        return ColumnSumRule(cond1.split(','))
+    if (operator == '') or (operator is None):
+        if (cond1 != '') and (cond1 is not None):
+            conditions = [parse_condition(cond1)]
+            if nda:
+                return NewColumnsRule(rule['FITBIR_Element'], conditions, compile_formula(formula))
+            return ConditionRule(conditions, compile_formula(formula) if formula != '' else identity)
+        if (formula != '') and (formula is not None):
+            return FormulaRule(compile_formula(formula))
+        return NoRule()
+
+    raise ValueError(f"Invalid operator for element: {element}. Please check and correct.")
+
+
+class AlignmentPlan:
+    '''
+    The compiled scaling rules of an alignment table, for one direction.
+    Compile the table once and apply the plan to each dataset.
+
+    Example
+    -----------
+    plan = AlignmentPlan(column_scaling, NDA_TO_FITBIR)
+    plan.apply(pnda.dataset)
+    '''
+
+    def __init__(self, column_scaling, direction):
+
+        self.direction = direction
+        self.rules = {}
+        for element, rule in column_scaling.items():
+            try:
+                self.rules[element] = compile_rule(element, rule, direction)
+            except Exception as e:
+                # Only a problem if the element is in a dataset (like the preprocessors)
+                self.rules[element] = InvalidRule(e)
+
+    def __contains__(self, element):
+        return element in self.rules
+
+    def __len__(self):
+        return len(self.rules)
+
+    def apply(self, dataset):
+        '''
+        Converts the matched columns of the dataset, in the order of its columns.
+        The columns added by the rules (from NDA to FITBIR) are not converted.
+        '''
+        for element in list(dataset):
+            if element in self.rules:
+                logging.info(element)
+                self.rules[element].apply(dataset, element)
+
+        return dataset
+
+def compile_plan(converter, direction):
+    ''' Returns the plan of a column_scaling dict (or the plan, if it is already compiled) '''
+    if isinstance(converter, AlignmentPlan):
+        return converter
+
+    return AlignmentPlan(converter, direction)
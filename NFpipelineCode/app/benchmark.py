@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This script measures the speed of the pipeline on synthetic NDA and FITBIR data sets. It generates
+the input files at the chosen scale (subjects, visits, columns, missing values), times the preprocessors, the merge,
+the long to wide conversion and the stats, and appends the results to a JSON lines file so that runs of different
+versions can be compared.
+
+    python benchmark.py --scale small
+    python benchmark.py --subjects 2000 --visits 4 --columns 50 --compare
+"""
+import os
+import csv
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import date, timedelta
+from pathlib import Path
+
+import merge_csvs as mcsvs
+import long2wide as lw
+import stats_pipeline as pstats
+import pipeline_tasks as tasks
+from profiling import peak_rss_mb, reset_peak_rss
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Where the results are appended by default
+RESULTS_FILE = Path(__file__).resolve().parent.parent / 'benchmarks' / 'results.jsonl'
+
+# Number of subjects, visits per subject, columns per file, files per data set,
+# share of missing values and rows per visit of the FITBIR repeatable groups
+SCALES = {'small':  {'subjects': 100,   'visits': 3, 'columns': 20,  'files': 3, 'sparsity': 0.3, 'repeats': 2},
+          'medium': {'subjects': 1000,  'visits': 4, 'columns': 50,  'files': 5, 'sparsity': 0.3, 'repeats': 2},
+          'large':  {'subjects': 10000, 'visits': 6, 'columns': 100, 'files': 8, 'sparsity': 0.5, 'repeats': 3}}
+
+# Benchmarks that can be run
+CASES = ['preprocess_nda', 'preprocess_fitbir', 'merge', 'merge_transform', 'long2wide', 'stats']
+
+# Values of the categorical columns
+CATEGORIES = ['Yes', 'No', 'Unknown', 'Not applicable']
+
+
+def make_value(rng, col, sparsity):
+    ''' Returns a random value of the column (numeric, categorical or empty) '''
+    if rng.random() < sparsity:
+        return ''
+    if col % 3 == 2:
+        return rng.choice(CATEGORIES)
+    if col % 3 == 1:
+        return f"{rng.gauss(50, 15):.2f}"
+
+    return str(rng.randint(0, 10))
+
+def visit_dates(rng, visits):
+    ''' Returns the dates of the visits of a subject, about a month apart '''
+    day = date(2015, 1, 1) + timedelta(days = rng.randint(0, 1500))
+    dates = []
+    for _ in range(visits):
+        dates.append(day)
+        day += timedelta(days = rng.randint(20, 200))
+
+    return dates
+
+def make_nda_files(folder, subjects, visits, columns, files = 1, sparsity = 0.3, seed = 0, **kwargs):
+    '''
+    Writes NDA style files: the column names, then the description row,
+    then one row per subject and visit.
+
+    Parameters
+    -----------
+    folder: a str - where the files are written
+    subjects: an int - number of subjects (each file has all of them)
+    visits: an int - number of visits per subject
+    columns: an int - number of data columns per file (besides the subject and visit columns)
+    files: an int - number of files (one per questionnaire)
+    sparsity: a float - share of the values that are missing
+    seed: an int - seed of the random values, the same seed gives the same files
+
+    Returns
+    -----------
+    paths: a list - paths of the files
+    '''
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok = True)
+    subject_dates = {f"NDAR_INV{s:08d}": visit_dates(rng, visits) for s in range(subjects)}
+    # The same subject has the same sex and age at a visit in every file
+    sexes = {guid: rng.choice('FM') for guid in subject_dates}
+    first_ages = {guid: rng.randint(216, 600) for guid in subject_dates}
+
+    paths = []
+    for f in range(files):
+        short_name = f"quest{f:02d}"
+        lead = ['subjectkey', 'src_subject_id', 'interview_date', 'interview_age', 'sex']
+        items = [f"{short_name}_{c}" for c in range(columns)]
+        descriptions = ['The NDAR Global Unique Identifier (GUID) for research subject',
+                        'Subject ID how it\'s defined in lab/project',
+                        'Date on which the interview/genetic test/sampling/imaging/biospecimen was completed. MM/DD/YYYY',
+                        'Age in months at the time of the interview/test/sampling/imaging.',
+                        'Sex of subject at birth'] + [f"Question {c} of {short_name}" for c in range(columns)]
+
+        path = os.path.join(folder, f"{short_name}01.csv")
+        with open(path, 'w', newline = '') as fout:
+            writer = csv.writer(fout, lineterminator = '\n')
+            writer.writerow(lead + items)
+            writer.writerow(descriptions)
+            for s, (guid, dates) in enumerate(subject_dates.items()):
+                for day in dates:
+                    age = first_ages[guid] + (day - dates[0]).days // 30
+                    row = [guid, f"S{s}", day.strftime('%m/%d/%Y'), str(age), sexes[guid]]
+                    writer.writerow(row + [make_value(rng, c, sparsity) for c in range(columns)])
+        paths.append(path)
+
+    return paths
+
+def make_fitbir_files(folder, subjects, visits, columns, files = 1, sparsity = 0.3, repeats = 2, seed = 0, **kwargs):
+    '''
+    Writes FITBIR style files with Form.Group.Element column names. Each visit has one row with
+    the Main group (GUID, visit date, age) and repeats - 1 more rows with only the values of
+    the repeatable group, like the files downloaded from FITBIR.
+
+    Parameters
+    -----------
+    folder: a str - where the files are written
+    subjects: an int - number of subjects (each file has all of them)
+    visits: an int - number of visits per subject
+    columns: an int - number of data columns per file (half in the repeatable group)
+    files: an int - number of files (one per form)
+    sparsity: a float - share of the values that are missing
+    repeats: an int - number of rows per visit
+    seed: an int - seed of the random values, the same seed gives the same files
+
+    Returns
+    -----------
+    paths: a list - paths of the files
+    '''
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok = True)
+    subject_dates = {f"TBI{s:07d}": visit_dates(rng, visits) for s in range(subjects)}
+    first_ages = {guid: rng.randint(18, 50) for guid in subject_dates}
+
+    paths = []
+    for f in range(files):
+        form = f"Form{f:02d}"
+        main = [f"{form}.Main.GUID", f"{form}.Main.VisitDate", f"{form}.Main.AgeYrs"]
+        n_single = columns - columns // 2
+        single = [f"{form}.Assessment.Element{c}" for c in range(n_single)]
+        repeated = [f"{form}.Repeatable.Element{c}" for c in range(n_single, columns)]
+
+        path = os.path.join(folder, f"query_result_{form}.csv")
+        with open(path, 'w', newline = '') as fout:
+            writer = csv.writer(fout, lineterminator = '\n')
+            writer.writerow(main + single + repeated)
+            for guid, dates in subject_dates.items():
+                for day in dates:
+                    age = first_ages[guid] + (day - dates[0]).days // 365
+                    row = [guid, day.strftime('%Y-%m-%dT00:00:00Z'), str(age)]
+                    row += [make_value(rng, c, sparsity) for c in range(n_single)]
+                    row += [make_value(rng, c, sparsity) for c in range(n_single, columns)]
+                    writer.writerow(row)
+                    for _ in range(repeats - 1):
+                        blank = [''] * (len(main) + len(single))
+                        writer.writerow(blank + [make_value(rng, c, sparsity) for c in range(n_single, columns)])
+        paths.append(path)
+
+    return paths
+
+def children_cpu():
+    ''' CPU seconds used by the child processes that finished (0 if unknown) '''
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return usage.ru_utime + usage.ru_stime
+
+def measure(func, *args, **kwargs):
+    '''
+    Runs func(*args, **kwargs) and returns its result and the wall time, CPU time
+    and peak memory. Errors are caught so that the other benchmarks still run.
+
+    The peak memory is reset first, so it is the peak of this case only (if peak_rss_reset is True).
+    The CPU time of the worker processes the case started is children_cpu_s; their memory isn't
+    included, so the cases are run with one process.
+    '''
+    peak_was_reset = reset_peak_rss()
+    start, cpu_start, children_start = time.perf_counter(), time.process_time(), children_cpu()
+    result, error = None, None
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        logging.exception(e)
+        error = repr(e)
+
+    timing = {'wall_s': time.perf_counter() - start, 'cpu_s': time.process_time() - cpu_start,
+              'children_cpu_s': children_cpu() - children_start, 'peak_rss_mb': peak_rss_mb(),
+              'peak_rss_reset': peak_was_reset}
+    if error is not None:
+        timing['error'] = error
+
+    return result, timing
+
+def count_file(filename):
+    ''' Returns the number of rows (without the header) and columns of a CSV file '''
+    with open(filename, 'r', newline = '') as fin:
+        reader = csv.reader(fin)
+        columns = len(next(reader, []))
+        rows = sum(1 for _ in reader)
+
+    return {'rows': rows, 'columns': columns}
+
+def run_benchmarks(folder, scale, cases = CASES, seed = 0):
+    '''
+    Generates the data sets in folder and times each case.
+
+    Parameters
+    -----------
+    folder: a str - working folder (the inputs and outputs are written to it)
+    scale: a dict - subjects, visits, columns, files, sparsity and repeats (see SCALES)
+    cases: a list - the benchmarks to run (see CASES)
+    seed: an int - seed of the synthetic data
+
+    Returns
+    -----------
+    results: a dict - case -> wall time, CPU time, peak memory and size of the output
+    '''
+    folder = os.path.abspath(folder)
+    outputs = os.path.join(folder, 'Outputs')
+    os.makedirs(outputs, exist_ok = True)
+    nda_files = make_nda_files(os.path.join(folder, 'NDA'), seed = seed, **scale)
+    fitbir_files = make_fitbir_files(os.path.join(folder, 'FITBIR'), seed = seed, **scale)
+
+    # The pipeline writes its stats file to the Outputs folder of the working directory
+    cwd = os.getcwd()
+    os.chdir(folder)
+    results = {}
+    try:
+        if 'preprocess_nda' in cases or set(cases) & {'merge', 'merge_transform', 'long2wide', 'stats'}:
+            processed, results['preprocess_nda'] = measure(tasks.preprocess_nda, nda_files, outputs, {}, {},
+                                                           workers = None)
+        if 'preprocess_fitbir' in cases:
+            _, results['preprocess_fitbir'] = measure(tasks.preprocess_fitbir, fitbir_files, outputs, {}, {},
+                                                      split_all = True, workers = None)
+
+        merged = os.path.join(outputs, 'merged_file.csv')
+        if set(cases) & {'merge', 'long2wide', 'stats'}:
+            _, results['merge'] = measure(mcsvs.main, processed, merged, 'subjectkey', '', 'column',
+                                          date_col = 'interview_date')
+            results['merge'].update(count_file(merged))
+        if 'merge_transform' in cases:
+            savename = os.path.join(outputs, 'merged_and_transformed_file.csv')
+            _, results['merge_transform'] = measure(mcsvs.main, processed, savename, 'subjectkey', '', 'column',
+                                                    date_col = 'interview_date', l2w = True, suffix = 'TP',
+                                                    ti = 30, aggfunc = ['first'])
+            results['merge_transform'].update(count_file(savename))
+        if 'long2wide' in cases:
+            dd = lw.read_csv(merged, 'subjectkey', 'interview_date')
+            (_, cols), results['long2wide'] = measure(lw.convert_long_to_wide, dd, 30, 'TP', False, '',
+                                                      aggfunc = ['first'])
+            results['long2wide']['columns'] = len(cols)
+        if 'stats' in cases:
+            sd = pstats.read_csv(merged)
+            _, results['stats'] = measure(pstats.make_stats_dict_from_file, sd)
+            results['stats']['columns'] = len(sd)
+    finally:
+        os.chdir(cwd)
+
+    # Only the cases that were asked for
+    return {case: results[case] for case in CASES if case in cases and case in results}
+
+def git_version():
+    ''' Returns the commit of the code being measured, or None if it is not known '''
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                             cwd = os.path.dirname(os.path.abspath(__file__)), timeout = 10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    return out.stdout.strip() or None
+
+def save_results(results, scale, results_file = RESULTS_FILE, label = None):
+    ''' Appends the results of a run to the results file and returns the saved record '''
+    record = {'time': time.time(), 'version': git_version(), 'label': label,
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'scale': scale, 'results': results}
+    results_file = Path(results_file)
+    results_file.parent.mkdir(parents = True, exist_ok = True)
+    with open(results_file, 'a') as fout:
+        fout.write(json.dumps(record) + '\n')
+
+    return record
+
+def load_results(results_file = RESULTS_FILE):
+    ''' Returns the saved runs, oldest first '''
+    records = []
+    try:
+        with open(results_file, 'r') as fin:
+            for line in fin:
+                if line.strip():
+                    records.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+
+    return records
+
+def compare(record, previous):
+    ''' Returns a table of the wall times of a run next to those of a previous run at the same scale '''
+    lines = [f"{'case':<20}{'before (s)':>12}{'now (s)':>12}{'ratio':>8}"]
+    for case, timing in record['results'].items():
+        before = previous['results'].get(case, {}).get('wall_s')
+        now = timing['wall_s']
+        if before:
+            lines.append(f"{case:<20}{before:>12.3f}{now:>12.3f}{now/before:>8.2f}")
+        else:
+            lines.append(f"{case:<20}{'':>12}{now:>12.3f}{'':>8}")
+
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Times the pipeline on synthetic NDA and FITBIR data sets.")
+    parser.add_argument('--scale', choices = list(SCALES), default = 'small')
+    for name in ['subjects', 'visits', 'columns', 'files', 'repeats']:
+        parser.add_argument(f'--{name}', type = int, help = f"overrides the {name} of the scale")
+    parser.add_argument('--sparsity', type = float, help = "overrides the share of missing values of the scale")
+    parser.add_argument('--cases', nargs = '+', choices = CASES, default = CASES)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--folder', help = "working folder (a temporary folder by default)")
+    parser.add_argument('--results', default = str(RESULTS_FILE), help = "JSON lines file the results are added to")
+    parser.add_argument('--label', help = "name saved with the results (for example, a release)")
+    parser.add_argument('--compare', action = 'store_true', help = "compare with the last run at the same scale")
+    args = parser.parse_args(argv)
+
+    scale = dict(SCALES[args.scale])
+    for name in ['subjects', 'visits', 'columns', 'files', 'repeats', 'sparsity']:
+        if getattr(args, name) is not None:
+            scale[name] = getattr(args, name)
+
+    previous = [r for r in load_results(args.results) if r['scale'] == scale]
+    if args.folder:
+        results = run_benchmarks(args.folder, scale, args.cases, args.seed)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            results = run_benchmarks(folder, scale, args.cases, args.seed)
+    record = save_results(results, scale, args.results, args.label)
+
+    print(json.dumps(record['results'], indent = 2))
+    if args.compare and previous:
+        print(compare(record, previous[-1]))
+
+    return record
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.WARNING)
+    main(sys.argv[1:])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module keeps track of the unique column names seen across files, in the order they were first seen.
+"""
+
+
+class ColumnRegistry:
+    '''
+    Insertion-ordered set of column names.
+
+    Checking if a column was already seen is a dictionary lookup instead of a scan
+    of a list. If a mapping is given, the new name of each column is looked up once,
+    when the column is first added.
+    '''
+
+    def __init__(self, columns = (), mapping = None):
+
+        self.mapping = mapping
+        # column -> mapped name
+        self._columns = {}
+        self.update(columns)
+
+    def __contains__(self, col):
+        return col in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def add(self, col):
+        ''' Adds a column if it has not been seen. Returns True if it was added. '''
+        if col in self._columns:
+            return False
+
+        if self.mapping is not None:
+            self._columns[col] = self.mapping.get(col, col)
+        else:
+            self._columns[col] = col
+
+        return True
+
+    def update(self, cols):
+        for col in cols:
+            self.add(col)
+
+        return self
+
+    def names(self):
+        ''' Returns the columns in the order they were first seen '''
+        return list(self._columns)
+
+    def mapped_names(self):
+        ''' Returns the mapped names of the columns in the order they were first seen '''
+        return list(self._columns.values())
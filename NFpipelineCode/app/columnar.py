@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module contains a compact, column-oriented table used to hold merged data in memory.
+Every column stores integer codes into its own pool of unique strings, and every key (ID or (ID, Date))
+stores the numbers of the rows that belong to it.
+"""
+from array import array
+
+
+class ColumnarTable:
+    '''
+    Stores the rows of a column-binding merge.
+
+    Instead of a dictionary of lists of strings for every key, each column holds an
+    array of codes (one per row) and a pool of the unique values in that column.
+    Code 0 is always the empty string. The rows of a key are kept as an array of
+    row numbers, in the order they were added.
+    '''
+
+    def __init__(self, columns):
+
+        self.columns = list(columns)
+        # One array of codes per column, indexed by row number
+        self._codes = [array('I') for _ in self.columns]
+        # code -> value and value -> code, for each column
+        self._values = [[''] for _ in self.columns]
+        self._lookup = [{'': 0} for _ in self.columns]
+        # key -> array of row numbers
+        self._keys = {}
+        self.nrows = 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return self._keys.keys()
+
+    def rows(self, key):
+        ''' Returns the row numbers that belong to a key '''
+        return self._keys[key]
+
+    def _encode(self, j, value):
+
+        lookup = self._lookup[j]
+        code = lookup.get(value)
+        if code is None:
+            code = len(self._values[j])
+            lookup[value] = code
+            self._values[j].append(value)
+
+        return code
+
+    def append(self, key, values):
+        '''
+        Adds a row to a key. values are ordered like self.columns.
+        Returns the row number.
+        '''
+        rnum = self.nrows
+        for j, value in enumerate(values):
+            self._codes[j].append(self._encode(j, value))
+
+        if key not in self._keys:
+            self._keys[key] = array('I')
+        self._keys[key].append(rnum)
+        self.nrows += 1
+
+        return rnum
+
+    def row(self, rnum):
+        ''' Returns the values of a row as a list of strings '''
+        return [vals[codes[rnum]] for vals, codes in zip(self._values, self._codes)]
+
+    def set_row(self, rnum, values):
+        ''' Replaces the values of a row '''
+        for j, value in enumerate(values):
+            self._codes[j][rnum] = self._encode(j, value)
+
+        return self
+
+    def column_values(self, col):
+        ''' Returns the values of a column for every row, grouped by key in key order '''
+        j = self.columns.index(col)
+        vals, codes = self._values[j], self._codes[j]
+
+        return [vals[codes[r]] for rows in self._keys.values() for r in rows]
+
+    def key_dict(self, key):
+        '''
+        Returns the data of a key in the dictionary of lists format used
+        by the rest of the pipeline ({column: [values]})
+        '''
+        rows = self._keys[key]
+        dd = {}
+        for col, vals, codes in zip(self.columns, self._values, self._codes):
+            dd[col] = [vals[codes[r]] for r in rows]
+
+        return dd
+
+    def items(self):
+        ''' Yields (key, {column: [values]}) one key at a time '''
+        for key in self._keys:
+            yield key, self.key_dict(key)
+
+    def to_dict(self):
+        return {key: dd for key, dd in self.items()}
+
+    def is_empty(self, col, chunk_size = 65536):
+        '''
+        Checks if every value in the column is the empty string. The codes are
+        checked chunk_size rows at a time and the scan stops at the first chunk
+        that has a value.
+        '''
+        j = self.columns.index(col)
+        # Only the empty string was ever stored in the column
+        if len(self._values[j]) == 1:
+            return True
+
+        codes = self._codes[j]
+        for start in range(0, len(codes), chunk_size):
+            chunk = codes[start:start + chunk_size]
+            if chunk.count(0) != len(chunk):
+                return False
+
+        return True
+
+    def drop_columns(self, cols):
+        ''' Removes the columns (and their values) from the table '''
+        keep = [j for j, col in enumerate(self.columns) if col not in cols]
+
+        self.columns = [self.columns[j] for j in keep]
+        self._codes = [self._codes[j] for j in keep]
+        self._values = [self._values[j] for j in keep]
+        self._lookup = [self._lookup[j] for j in keep]
+
+        return self
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module reads a CSV/TXT file into lists of values by column, the way the pipeline did by adding
+each row of csv.DictReader to a dictionary of lists. Files where every row has the same number of fields as the
+header are parsed by the C parser of pandas (every value as a string). A scan of the bytes of the file checks this
+first, and the other files (rows with missing or extra values, ...) are read with csv.DictReader.
+
+The processed data sets are written back from the columns row by row, without a transposed copy of the data,
+as CSV (optionally compressed with gzip or zstd) or Parquet.
+"""
+import os
+import csv
+import gzip
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    # Only needed for zstd output
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Only needed for Parquet output
+    pyarrow = None
+
+# Bytes of the file scanned at a time
+BLOCK_SIZE = 1 << 22
+
+QUOTE = ord('"')
+NEWLINE = ord('\n')
+BOM = b'\xef\xbb\xbf'
+
+# Bytes buffered before they are written to the output file
+WRITE_BUFFER = 1 << 20
+# Rows written at a time
+WRITE_ROWS = 10000
+# Rows in each row group of a Parquet file
+PARQUET_ROWS = 100000
+# Output formats: file extension added to the name of the output
+OUTPUT_FORMATS = {'csv': '', 'gzip': '.gz', 'zstd': '.zst', 'parquet': '.parquet'}
+
+
+def count_fields(file, delimiter, block_size = BLOCK_SIZE):
+    '''
+    Scans a file for the number of records (rows) and of delimiters between the values, like csv.reader
+    splits it: delimiters and line ends between quotes are part of a value, and blank lines are skipped.
+
+    Parameters
+    -----------
+    file: a str - the file
+    delimiter: a str - the delimiter of the file
+    block_size: an int - bytes read at a time
+
+    Returns
+    -----------
+    records: an int - the number of records (with the header)
+    delimiters: an int - the number of delimiters that separate values
+
+    None if the scan can't tell how csv.reader would split the file: a quote that doesn't start a value
+    (like a"b), a quote that isn't closed, a byte order mark, line ends that are only a carriage return, a blank
+    first line (csv.DictReader takes it as an empty header) or a delimiter that isn't one byte.
+    '''
+    if len(delimiter.encode()) != 1:
+        return None
+    delim = ord(delimiter)
+
+    records, delimiters = 0, 0
+    quoted = 0          # 1 if the block starts between quotes
+    prev = NEWLINE      # last byte of the previous block
+    carry = b''
+    with open(file, 'rb') as fin:
+        if fin.read(len(BOM)) == BOM:
+            return None
+        fin.seek(0)
+        while True:
+            block = fin.read(block_size)
+            if not block:
+                break
+            # Line ends like the text mode of open (\r\n -> \n)
+            block = carry + block
+            carry = b''
+            if block.endswith(b'\r'):
+                block, carry = block[:-1], b'\r'
+            if b'\r' in block:
+                block = block.replace(b'\r\n', b'\n')
+                if b'\r' in block:
+                    return None
+            if not block:
+                continue
+
+            data = np.frombuffer(block, dtype = np.uint8)
+            if records == 0 and prev == NEWLINE and data[0] == NEWLINE and not quoted:
+                # The file starts with a blank line
+                return None
+            previous = np.empty_like(data)
+            previous[0] = prev
+            previous[1:] = data[:-1]
+            ends = data == NEWLINE
+            delims = data == delim
+            if quoted or b'"' in block:
+                is_quote = data == QUOTE
+                # Odd number of quotes before a byte: it is between quotes
+                parity = np.bitwise_xor.accumulate(is_quote.view(np.uint8))
+                inside = (parity ^ is_quote.view(np.uint8) ^ quoted).view(bool)
+                # A quote that opens a value must follow a delimiter, a line end or a closing quote ("")
+                opening = is_quote & ~inside
+                if (opening & (previous != delim) & (previous != NEWLINE) & (previous != QUOTE)).any():
+                    return None
+                ends &= ~inside
+                delims &= ~inside
+                quoted = int(parity[-1]) ^ quoted
+
+            # A line end right after another one is a blank line (a line end after a quoted one is between quotes too)
+            records += np.count_nonzero(ends) - np.count_nonzero(ends & (previous == NEWLINE))
+            delimiters += np.count_nonzero(delims)
+            prev = data[-1]
+
+    if carry or quoted:
+        # A carriage return at the end, or a quote open at the end of the file
+        return None
+    if prev != NEWLINE:
+        # The last record has no line end
+        records += 1
+
+    return records, delimiters
+
+def read_with_pandas(file, delimiter):
+    ''' Parses every row of the file into a 2-D array of str (the header is the first row) '''
+    with open(file, 'r') as fin:
+        df = pd.read_csv(fin, sep = delimiter, header = None, dtype = object, keep_default_na = False,
+                         na_filter = False, skip_blank_lines = True, quotechar = '"', doublequote = True,
+                         engine = 'c')
+
+    return df.to_numpy()
+
+def read_with_csv(file, delimiter):
+    ''' Reads the file with csv.DictReader (missing values are None and extra values are under the None key) '''
+    data = defaultdict(list)
+    with open(file, 'r') as fin:
+
+        reader = csv.DictReader(fin, delimiter = delimiter)
+
+        for row in reader:
+
+            for key, value in row.items():
+                # Keys are the columns in the data
+                data[key].append(value)
+
+    return data
+
+def read_columns(file, delimiter):
+    '''
+    Reads a file into lists of values by column.
+
+    Parameters
+    -----------
+    file: a str - the file
+    delimiter: a str - the delimiter of the file (from csv_detect)
+
+    Returns
+    -----------
+    data: a defaultdict(list) - column name -> list of values (str), the same as adding each row of csv.DictReader.
+    If a column name is repeated, the column keeps the place of the first one and the values of the last one.
+    '''
+    scan = count_fields(file, delimiter)
+    if scan is not None:
+        records, delimiters = scan
+        if records <= 1:
+            # No rows (or no header)
+            return defaultdict(list)
+        try:
+            values = read_with_pandas(file, delimiter)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError):
+            # A row has more values than the header
+            values = None
+        # pandas fills missing values with '' (None for csv.DictReader), so every row must have all the values.
+        # It fails if a row has more values than the header, so the total number of delimiters tells.
+        # A file with one column is read with csv, which doesn't skip lines with only spaces.
+        if values is not None and len(values) == records and values.shape[1] > 1 \
+                and delimiters == (values.shape[1] - 1) * records:
+            positions = {}
+            for i, col in enumerate(values[0]):
+                positions[col] = i
+
+            return defaultdict(list, {col: values[1:, i].tolist() for col, i in positions.items()})
+
+    return read_with_csv(file, delimiter)
+
+def python_values(values):
+    ''' Returns numpy arrays (like the uint8 missing data indicators) as lists, so each value isn't a numpy scalar '''
+    if isinstance(values, np.ndarray):
+        return values.tolist()
+
+    return values
+
+def open_output(savefile, output_format):
+    ''' Opens a text file to write CSV to (compressed with gzip or zstd) '''
+    if output_format == 'gzip':
+        return gzip.open(savefile, 'wt')
+    if output_format == 'zstd':
+        if zstandard is None:
+            raise ValueError("Writing zstd files needs the zstandard package")
+        return zstandard.open(savefile, 'wt')
+
+    return open(savefile, 'w', buffering = WRITE_BUFFER)
+
+def write_parquet(savefile, names, columns, nrows, row_group = PARQUET_ROWS):
+    ''' Writes the columns to a Parquet file (every column as strings, like the CSV), a row group at a time '''
+    if pyarrow is None:
+        raise ValueError("Writing Parquet files needs the pyarrow package")
+
+    schema = pyarrow.schema([(str(name), pyarrow.string()) for name in names])
+    with pyarrow.parquet.ParquetWriter(savefile, schema) as writer:
+        for start in range(0, nrows, row_group):
+            block = [['' if v is None else str(v) for v in python_values(col[start:start + row_group])]
+                     for col in columns]
+            writer.write_table(pyarrow.Table.from_arrays([pyarrow.array(values, pyarrow.string()) for values in block],
+                                                         schema = schema))
+
+def write_columns(savefile, data, output_format = 'csv'):
+    '''
+    Writes lists of values by column to a file, one row at a time. Like csv.writer of the rows of
+    zip(*columns), the rows stop at the end of the shortest column, and the column names are
+    only written if there is a row.
+
+    Parameters
+    -----------
+    savefile: a str - the output file
+    data: a dict - column name -> list of values
+    output_format: a str - one of OUTPUT_FORMATS (csv, gzip, zstd or parquet)
+
+    Returns
+    -----------
+    savefile: a str - the file that was written (with .gz, .zst or .parquet for the other formats)
+    '''
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if output_format == 'parquet':
+        savefile = os.path.splitext(savefile)[0]
+    savefile += OUTPUT_FORMATS[output_format]
+
+    names = list(data.keys())
+    columns = [data[col] for col in names]
+    nrows = min(map(len, columns)) if columns else 0
+
+    if output_format == 'parquet':
+        write_parquet(savefile, names, columns, nrows)
+        return savefile
+
+    with open_output(savefile, output_format) as fout:
+
+        writer = csv.writer(fout, lineterminator = '\n')
+
+        # Write column names
+        if nrows != 0:
+            writer.writerow(names)
+
+        # A block of rows at a time (zip makes the rows one at a time)
+        for start in range(0, nrows, WRITE_ROWS):
+            writer.writerows(zip(*[python_values(col[start:start + WRITE_ROWS]) for col in columns]))
+
+    return savefile
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module detects the encoding, delimiter and column names of the CSV/TXT files read by the pipeline.
+The results are saved in a cache file so files that have not changed since the last run are not sniffed again.
+"""
+import csv
+import os
+import json
+import hashlib
+import logging
+from collections import namedtuple
+from pathlib import Path
+
+import chardet
+from appdirs import user_cache_dir
+
+# Number of bytes used to detect the encoding and to fingerprint the file
+HEAD_SIZE = 10000
+
+# Cache shared by every run of the application
+CACHE_FILE = Path(user_cache_dir("NFP", "tkirsh"), 'csv_detect.json')
+
+FileInfo = namedtuple('FileInfo', ['encoding', 'delimiter', 'dialect', 'headers'])
+
+# Dialect attributes saved in the cache
+DIALECT_ATTRS = ['delimiter', 'quotechar', 'doublequote', 'skipinitialspace', 'quoting', 'escapechar']
+
+_cache = None
+
+# Paths this process detected since it loaded the cache (they are saved over the entries of other processes)
+_detected = set()
+
+
+def read_cache_file():
+    ''' Returns the entries of the cache file, or {} if it is missing or corrupt '''
+    try:
+        with open(CACHE_FILE, 'r') as fin:
+            entries = json.load(fin)
+    except (OSError, ValueError):
+        return {}
+
+    return entries if isinstance(entries, dict) else {}
+
+def load_cache():
+    ''' Loads the cache file into memory (once per process) '''
+    global _cache
+
+    if _cache is None:
+        _cache = read_cache_file()
+
+    return _cache
+
+def save_cache():
+    '''
+    Writes the in-memory cache to the cache file. The file is read again first, so the entries
+    saved by other processes since it was loaded are kept (the files this process detected win).
+    '''
+    global _cache
+
+    cache = read_cache_file()
+    cache.update({path: entry for path, entry in load_cache().items() if path in _detected or path not in cache})
+    _cache = cache
+    try:
+        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so other processes never read a partial file
+        temp_name = f"{CACHE_FILE}.{os.getpid()}.tmp"
+        with open(temp_name, 'w') as fout:
+            json.dump(cache, fout)
+        os.replace(temp_name, CACHE_FILE)
+    except OSError as e:
+        logging.info(f"Could not save the CSV detection cache: {e}")
+
+    return
+
+def fingerprint(file, head):
+    ''' Returns the (size, mtime, head hash) that identifies the current version of a file '''
+    st = os.stat(file)
+    return [st.st_size, st.st_mtime_ns, hashlib.sha1(head).hexdigest()]
+
+def sniff(file, head):
+    ''' Detects the encoding, dialect and column names of a file '''
+
+    encod = chardet.detect(head)['encoding']
+
+    with open(file, 'r', encoding = encod, newline = "") as f:
+        dialect = csv.Sniffer().sniff(f.readline())
+        f.seek(0)
+        csvreader = csv.reader(f, dialect)
+        # Get just the first row, which should hold the column names
+        headers = next(csvreader, [])
+
+    params = {attr: getattr(dialect, attr) for attr in DIALECT_ATTRS}
+
+    return {'encoding': encod, 'dialect': params, 'headers': headers}
+
+def detect(file):
+    '''
+    Returns the FileInfo (encoding, delimiter, dialect and column names) of a file.
+    The dialect is a dict that can be passed to csv.reader as keyword arguments.
+
+    The results are looked up in the cache by the file's path, size, modification
+    time and a hash of its first bytes, and only sniffed if the file changed.
+    '''
+    path = os.path.abspath(file)
+    with open(path, 'rb') as rawdata:
+        head = rawdata.read(HEAD_SIZE)
+    fp = fingerprint(path, head)
+
+    cache = load_cache()
+    entry = cache.get(path)
+    if not isinstance(entry, dict) or entry.get('fingerprint') != fp:
+        logging.info(f"Detecting the format of {path}")
+        entry = sniff(path, head)
+        entry['fingerprint'] = fp
+        cache[path] = entry
+        _detected.add(path)
+        save_cache()
+
+    return FileInfo(entry['encoding'], entry['dialect']['delimiter'], entry['dialect'], entry['headers'])
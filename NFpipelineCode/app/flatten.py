@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module flattens the repeated rows of the FITBIR forms (the rows after the first row of a
+GUID, which have no GUID). It finds the columns with more than one value in a group of rows with one count
+of the values of each group, and joins the values of these columns with ';' a group at a time. The columns
+stay arrays of the data set, and empty values ('' or NaN) are handled like a DataFrame with '' replaced by NaN.
+"""
+import re
+import numpy as np
+import pandas as pd
+
+
+def as_array(values):
+    ''' Returns the values of a column as an array (lists become object arrays of the same values) '''
+    if isinstance(values, np.ndarray):
+        return values
+    array = np.empty(len(values), dtype = object)
+    array[:] = values
+
+    return array
+
+def missing(values):
+    ''' Finds the empty values ('' or NaN) of an array '''
+    empty = pd.isna(values)
+    if values.dtype == object:
+        empty |= values == ''
+
+    return empty
+
+def with_nan(values, empty):
+    ''' The values with NaN in place of the empty values '''
+    if not empty.any():
+        return values
+    values = values.astype(object)
+    values[empty] = np.nan
+
+    return values
+
+def find_repeated_columns(dataset, fill_cols):
+    '''
+    Finds the columns with more than one value in a group of rows.
+
+    Parameters
+    -----------
+    dataset: a dict - column name -> list or array of values
+    fill_cols: a list - the columns are grouped by the columns ending with these names, after filling
+                        the empty values of the fill_cols forward
+
+    Returns
+    -----------
+    cols: a list - the columns (not in fill_cols) with more than one value in a group, in the order they are
+                   found going through the groups (sorted by their values) and then the columns
+    use_cols: a list - the columns grouped by
+    '''
+    use_cols = [dcol for f in fill_cols for dcol in dataset if dcol.endswith(f)]
+    columns = {col: as_array(values) for col, values in dataset.items()}
+    empty = {col: missing(values) for col, values in columns.items()}
+
+    keys = []
+    for col in use_cols:
+        key = pd.Series(with_nan(columns[col], empty[col]), name = col)
+        keys.append(key.ffill() if col in fill_cols else key)
+
+    # 1 where a column has a value, NaN where it is empty, so count() is the number of values in each group
+    check_cols = [col for col in columns if col not in fill_cols]
+    values = pd.DataFrame({i: np.where(empty[col], np.float32(np.nan), np.float32(1))
+                           for i, col in enumerate(check_cols)})
+    counts = values.groupby(keys).count().to_numpy()
+    if counts.size == 0:
+        return [], use_cols
+
+    repeated = counts > 1
+    found = np.flatnonzero(repeated.any(axis = 0))
+    first = repeated.argmax(axis = 0)
+    cols = [check_cols[i] for i in sorted(found, key = lambda i: (first[i], i))]
+
+    return cols, use_cols
+
+def join_groups(values, codes, ngroups):
+    ''' Joins the str values of each group of rows (codes: the group of each row, -1 for no group) with ';' '''
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[np.argsort(codes[rows], kind = 'stable')]
+    ends = np.searchsorted(codes[rows], np.arange(1, ngroups + 1)).tolist()
+    strings = values[rows].tolist()
+    starts = [0] + ends[:-1]
+
+    joined = np.empty(ngroups, dtype = object)
+    joined[:] = [';'.join(strings[start:end]) for start, end in zip(starts, ends)]
+
+    return joined
+
+def flatten_rows(dataset, bad_cols, make_list = False, list_file = None):
+    '''
+    Keeps one row for each value of the GUID column (the first column with any of the letters of GUID), when
+    some rows have no GUID. The rows without a GUID belong to the GUID above them.
+
+    Parameters
+    -----------
+    dataset: a dict - column name -> list or array of values
+    bad_cols: a list - the columns with more than one value in a group (find_repeated_columns)
+    make_list: a bool - if True, the bad columns are saved to list_file with the GUID and removed,
+                        otherwise the values of each GUID are joined with ';' ('nan' for the empty values)
+                        and the repeated rows are removed
+    list_file: a str - path of the file of the bad columns
+
+    Returns
+    -----------
+    dataset: a dict - the flattened data set (the empty values are NaN), or the same dict if every row has a GUID
+    '''
+    guid_col = [col for col in dataset if re.search('[gGuUiIdD]', col)][0]
+    guid = as_array(dataset[guid_col])
+    guid_empty = missing(guid)
+    if not guid_empty.any():
+        return dataset
+
+    columns = {col: as_array(values) for col, values in dataset.items()}
+    empty = {col: missing(values) for col, values in columns.items()}
+    if make_list:
+        pd.DataFrame({col: columns[col] for col in [guid_col] + bad_cols})[[guid_col] + bad_cols] \
+            .to_csv(list_file, index = False)
+        for col in bad_cols:
+            del columns[col]
+    else:
+        # The rows before the first GUID are in no group
+        codes, uniques = pd.factorize(pd.Series(with_nan(guid, guid_empty)).ffill())
+        for col in bad_cols:
+            strings = np.array(['nan' if e else str(v) for v, e in zip(columns[col].tolist(), empty[col])],
+                               dtype = object)
+            columns[col] = join_groups(strings, codes, len(uniques))[np.maximum(codes, 0)]
+            empty[col] = np.zeros(len(codes), dtype = bool)
+
+    keep = ~guid_empty
+    columns = {col: with_nan(values[keep], empty[col][keep]) for col, values in columns.items()}
+    if not make_list and keep.any():
+        # Remove the rows that are the same in every column (the empty values are equal)
+        codes = np.column_stack([pd.factorize(values)[0] for values in columns.values()])
+        _, first = np.unique(codes, axis = 0, return_index = True)
+        rows = np.sort(first)
+        columns = {col: values[rows] for col, values in columns.items()}
+
+    return {col: values.tolist() for col, values in columns.items()}
@@ -48,6 +48,7 @@ class MergeTransForm(Form):
     int_indc      = RadioField("Usevals", choices = [("value1", "Yes"), ("value2","No")])
     prefix        = StringField("prefix", default = "TP")
     savename      = StringField("savename", default = "merged_and_transformed_file.csv")
+    incremental   = RadioField("incremental", choices = [("value1", "Yes"), ("value2", "No")], default = 'value2')
     execute       = SubmitField("Merge & Transform")
 
 class MergeForm(Form):
@@ -57,6 +58,7 @@ class MergeForm(Form):
     id_col        = StringField("guids")
     date_col      = StringField("times", default = "NA")
     savename      = StringField("savename", default = "merged_file.csv")
+    incremental   = RadioField("incremental", choices = [("value1", "Yes"), ("value2", "No")], default = 'value2')
     execute       = SubmitField("Merge Files")
 
 class TransForm(Form):
@@ -88,6 +90,7 @@ class StatsForm(Form):
     #file = FileField(validators=[validators.regexp(r'.csv$|.txt$')])
 
     savename      = StringField("savename", default = "stats_file.csv")
+    streaming     = RadioField("streaming", choices = [("value1", "Yes"), ("value2", "No"), ("value3", "Only for large files")], default = 'value3')
     execute       = SubmitField("Get Stats")
 
 class processNDA(Form):
@@ -99,6 +102,7 @@ class processNDA(Form):
     indic_cols    = StringField("icols", default = 'ALL')
     miss_val      = StringField("missing_value", default = '')
     drop_na_cols  = RadioField("dropnacols", choices = [("value1", "Yes"), ("value2", "No")], default = 'value1')
+    output_format = RadioField("output_format", choices = [("value1", "CSV"), ("value2", "CSV (gzip)"), ("value3", "CSV (zstd)"), ("value4", "Parquet")], default = 'value1')
     execute       = SubmitField("Process NDA files")
 
 class processFITBIR(Form):
@@ -118,6 +122,7 @@ class processFITBIR(Form):
     make_list     = RadioField("list", choices = [("value1", "Yes"), ("value2", "No")], default = 'value2')
     group_cols    = StringField("group_cols")
     drop_na_cols  = RadioField("dropnacols", choices = [("value1", "Yes"), ("value2", "No")], default = 'value1')
+    output_format = RadioField("output_format", choices = [("value1", "CSV"), ("value2", "CSV (gzip)"), ("value3", "CSV (zstd)"), ("value4", "Parquet")], default = 'value1')
     execute       = SubmitField("Process FITBIR files")
 
 class NDAscrapeForm(Form):
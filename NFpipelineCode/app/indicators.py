@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module makes the missing data indicator columns of the preprocessors: a {column}_{value}_indic
+column for each column and missing value, 1 where the column has the value and 0 elsewhere. The columns are put in
+one 2-D array that is compared with each missing value, and the indicators are kept as uint8 arrays (written as 1
+and 0 like the '1' and '0' strings made before).
+"""
+import numpy as np
+
+
+def indicator_name(col, val):
+    return f"{col}_{str(val)}_indic"
+
+def missing_indicators(dataset, cols, vals):
+    '''
+    Finds where each column has each missing value.
+
+    Parameters
+    -----------
+    dataset: a dict - column name -> list of values
+    cols: a list - the columns to make indicators for
+    vals: a list - the missing values
+
+    Returns
+    -----------
+    indicators: a dict - indicator_name(col, val) -> uint8 array, for each column and then each value
+    '''
+    columns = [dataset[col] for col in cols]
+    vals = list(dict.fromkeys(vals))
+
+    masks = {}
+    lengths = set(map(len, columns))
+    if len(lengths) == 1:
+        # One array for all the columns (a row for each column)
+        table = np.empty((len(columns), lengths.pop()), dtype = object)
+        for i, values in enumerate(columns):
+            table[i] = values
+        for val in vals:
+            masks[val] = (table == val).view(np.uint8)
+    else:
+        for val in vals:
+            masks[val] = [(np.array(values, dtype = object) == val).view(np.uint8) for values in columns]
+
+    indicators = {}
+    for i, col in enumerate(cols):
+        for val in vals:
+            indicators[indicator_name(col, val)] = masks[val][i]
+
+    return indicators
+
+def add_missing_indicators(dataset, cols, vals, handle_missing_data):
+    '''
+    Adds the indicator columns of every column and missing value to the dataset, the same as calling
+    handle_missing_data(col, val) for each column and then each value.
+
+    If an indicator has the name of one of the columns (it replaces the column before the indicators of
+    the column are made) or a value isn't a str, the columns are done one at a time with handle_missing_data.
+    '''
+    if not cols or not vals:
+        return
+    if (set(indicator_name(col, val) for col in cols for val in vals) & set(cols)) or \
+            not all(isinstance(val, str) for val in vals):
+        for col in cols:
+            for val in vals:
+                handle_missing_data(col, val)
+        return
+
+    for name, values in missing_indicators(dataset, cols, vals).items():
+        dataset[name] = values
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module runs the long pipeline steps as background jobs in a pool of worker processes, so the
+web server can answer other requests while they run. Each job writes its messages to an events file that the
+server reads to report the status and progress of the job.
+"""
+import json
+import time
+import uuid
+import logging
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from appdirs import user_cache_dir
+
+import progress
+
+# Number of jobs that run at the same time. The pipeline steps write to the
+# same Outputs folder, so by default jobs run one after another.
+JOB_WORKERS = 1
+
+# Where the events files of the jobs are kept
+JOBS_FOLDER = Path(user_cache_dir("NFP", "tkirsh"), 'jobs')
+
+# Seconds a finished job (and its events file) is kept, and the most finished jobs kept
+JOB_RETENTION = 24 * 60 * 60
+MAX_FINISHED_JOBS = 100
+
+# Seconds between two reads of the events file when streaming the events of a job
+STREAM_INTERVAL = 0.5
+
+# Seconds without events after which a comment is sent to keep the stream open
+KEEPALIVE_INTERVAL = 15
+
+
+def write_event(events_file, event, **fields):
+    ''' Appends an event (a JSON line) to the events file of a job '''
+    fields.update({'event': event, 'time': time.time()})
+    with open(events_file, 'a') as fout:
+        fout.write(json.dumps(fields) + '\n')
+
+    return
+
+def read_events(events_file, offset = 0):
+    '''
+    Returns the events written by a job after the offset (in bytes) of the events
+    file, and the offset to read the next events from.
+    '''
+    events = []
+    try:
+        with open(events_file, 'rb') as fin:
+            fin.seek(offset)
+            for line in fin:
+                # Stop at a line that is still being written
+                if not line.endswith(b'\n'):
+                    break
+                events.append(json.loads(line))
+                offset += len(line)
+    except FileNotFoundError:
+        pass
+
+    return events, offset
+
+def format_sse(event, offset = None):
+    '''
+    Formats an event as a server-sent event. The offset (if given) is sent as the event id, so a
+    browser that reconnects (with the Last-Event-ID header) continues where it stopped.
+    '''
+    message = f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+    if offset is not None:
+        message = f"id: {offset}\n" + message
+
+    return message
+
+def stream_events(job, offset = 0, interval = STREAM_INTERVAL, sleep = time.sleep):
+    '''
+    Yields the events of a job as server-sent events, as they are written, until the job is done.
+
+    Parameters
+    -----------
+    job: a Job - the job to follow
+    offset: an int - offset in the events file to start from (0 for all the events)
+    interval: a float - seconds to wait between two reads of the events file
+    sleep: a function - used to wait (gevent.sleep under the gevent server, so other requests are answered)
+
+    Returns
+    -----------
+    a generator of str - the server-sent events, ending with an 'end' event with the state of the job
+    '''
+    last = time.time()
+    while True:
+        # Get the state first, a finished job has written all its events
+        state = job.state()
+        events, offset = job.follow(offset)
+        for i, event in enumerate(events):
+            # The offset is the end of the last event read
+            yield format_sse(event, offset if i == len(events) - 1 else None)
+        if events:
+            last = time.time()
+
+        if state in ('finished', 'failed', 'cancelled'):
+            yield format_sse({'event': 'end', 'state': state}, offset)
+            return
+        if time.time() - last >= KEEPALIVE_INTERVAL:
+            last = time.time()
+            yield ": keepalive\n\n"
+
+        sleep(interval)
+
+def run_job(events_file, func, args, kwargs):
+    '''
+    Runs func(*args, **kwargs) in a worker process. The messages flashed by the
+    pipeline and its progress events are written to the events file.
+    '''
+    progress.set_listener(lambda event, **fields: write_event(events_file, event, **fields))
+    write_event(events_file, 'started')
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        logging.exception(e)
+        write_event(events_file, 'failed', error = repr(e), traceback = traceback.format_exc())
+        raise
+    finally:
+        progress.set_listener(None)
+
+    write_event(events_file, 'finished')
+
+    return result
+
+
+class Job:
+    ''' A pipeline step submitted to the JobQueue '''
+
+    def __init__(self, job_id, name, events_file, future):
+
+        self.id = job_id
+        self.name = name
+        self.events_file = events_file
+        self.future = future
+        self.submitted = time.time()
+        # Time the job was done (None until then)
+        self.done_time = None
+        future.add_done_callback(self._done)
+        self._has_events = False
+
+    def _done(self, future):
+        self.done_time = time.time()
+
+        return
+
+    def events(self):
+        return read_events(self.events_file)[0]
+
+    def follow(self, offset = 0):
+        ''' Returns the events written after offset and the next offset (see read_events) '''
+        events, offset = read_events(self.events_file, offset)
+        if events:
+            self._has_events = True
+
+        return events, offset
+
+    def has_events(self):
+        ''' True once the job has written an event (without reading the events file) '''
+        if not self._has_events:
+            try:
+                self._has_events = Path(self.events_file).stat().st_size > 0
+            except OSError:
+                pass
+
+        return self._has_events
+
+    def latest_progress(self, events = None):
+        ''' Returns the last progress event of each stage '''
+        if events is None:
+            events = self.events()
+
+        return {e['stage']: e for e in events if e['event'] == 'progress'}
+
+    def state(self, events = None):
+        ''' One of queued, running, finished, failed or cancelled '''
+        if self.future.cancelled():
+            return 'cancelled'
+        if self.future.done():
+            return 'failed' if self.future.exception() is not None else 'finished'
+        if events is None:
+            return 'running' if self.has_events() else 'queued'
+
+        return 'running' if events else 'queued'
+
+    def messages(self, events = None):
+        if events is None:
+            events = self.events()
+
+        return [e['message'] for e in events if e['event'] == 'message']
+
+    def result(self):
+        ''' Returns the result of a finished job, or None if it is not finished '''
+        if self.state() != 'finished':
+            return None
+
+        return self.future.result()
+
+    def status(self):
+        ''' Returns a JSON serializable summary of the job '''
+        events = self.events()
+        state = self.state(events)
+        status = {'id': self.id, 'name': self.name, 'state': state,
+                  'submitted': self.submitted, 'messages': self.messages(events),
+                  'progress': self.latest_progress(events)}
+        if state == 'failed':
+            status['error'] = repr(self.future.exception())
+
+        return status
+
+
+class JobQueue:
+    '''
+    Pool of worker processes that run the submitted jobs in order.
+    The worker processes are only started when the first job is submitted.
+    Finished jobs and their events files are removed after retention seconds, or when
+    there are more than max_finished of them (the oldest first).
+    '''
+
+    def __init__(self, max_workers = JOB_WORKERS, folder = JOBS_FOLDER, retention = JOB_RETENTION,
+                 max_finished = MAX_FINISHED_JOBS):
+
+        self.max_workers = max_workers
+        self.folder = Path(folder)
+        self.retention = retention
+        self.max_finished = max_finished
+        self.jobs = {}
+        self._executor = None
+
+    def submit(self, name, func, *args, **kwargs):
+        '''
+        Adds func(*args, **kwargs) to the queue. func and its arguments must be
+        picklable (func must be defined at the top level of a module).
+
+        Returns
+        -----------
+        job_id: a str - identifies the job in the status, progress and result endpoints
+        '''
+        self.prune()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers = self.max_workers)
+
+        self.folder.mkdir(parents = True, exist_ok = True)
+        job_id = uuid.uuid4().hex
+        events_file = str(self.folder / f"{job_id}.jsonl")
+        future = self._executor.submit(run_job, events_file, func, args, kwargs)
+        self.jobs[job_id] = Job(job_id, name, events_file, future)
+        logging.info(f"Submitted job {job_id} ({name})")
+
+        return job_id
+
+    def get(self, job_id):
+        ''' Returns the Job with job_id, or None (also for the jobs that were removed) '''
+        return self.jobs.get(job_id)
+
+    def remove(self, job_id):
+        ''' Forgets a job and deletes its events file '''
+        job = self.jobs.pop(job_id)
+        Path(job.events_file).unlink(missing_ok = True)
+        logging.info(f"Removed job {job_id} ({job.name})")
+
+        return
+
+    def prune(self):
+        '''
+        Removes the finished jobs older than the retention period and the oldest ones above max_finished,
+        and the events files left by earlier runs of the server that are older than the retention period.
+        '''
+        now = time.time()
+        done = sorted((job for job in self.jobs.values() if job.done_time is not None), key = lambda job: job.done_time)
+        for i, job in enumerate(done):
+            if now - job.done_time > self.retention or len(done) - i > self.max_finished:
+                self.remove(job.id)
+
+        if self.folder.is_dir():
+            for events_file in self.folder.glob('*.jsonl'):
+                try:
+                    if events_file.stem not in self.jobs and now - events_file.stat().st_mtime > self.retention:
+                        events_file.unlink()
+                except OSError:
+                    pass
+
+        return
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait = False, cancel_futures = True)
+            self._executor = None
+
+        return
@@ -24,8 +24,13 @@ import re
 import time
 import glob
 import csv
+import os
 import pprint
 import logging
+from columnar import ColumnarTable
+from column_registry import ColumnRegistry
+from progress import Tracker
+import csv_detect
 
 def convert_to_time(s, intindc, indicator):
 
@@ -77,10 +82,9 @@ def read_csv(file, id_col, date_col):
         csvreader = csv.reader(fin)
         columns = next(csvreader)
 
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(fin.readline())
+        # Delimiter is cached between runs
+        delim = csv_detect.detect(file).delimiter
         fin.seek(0)
-        delim = str(dialect.delimiter)
         reader = csv.DictReader(fin, delimiter = delim)
 
         data = {}
@@ -110,6 +114,29 @@ def read_csv(file, id_col, date_col):
 
     return data
 
+def rows_to_dict(dd, columns, id_col, date_col):
+    '''
+    Same as read_csv, but for row-binding data that is still in memory
+    (a dict of column -> list of values, as returned by merge_csvs.merge_all).
+    Missing values (None) become empty strings, like they would in the file.
+    '''
+    ids = dd[id_col]
+    dates = dd[date_col]
+    use_cols = [col for col in columns if col not in [id_col, date_col]]
+
+    data = {}
+    for i in range(len(ids)):
+        key = (ids[i] or '', dates[i] or '')
+
+        if key not in data:
+            data[key] = defaultdict(list)
+
+        for col in use_cols:
+            value = dd[col][i]
+            data[key][col].append(value if value is not None else '')
+
+    return data
+
 def aggregate_data(dd, aggfunc, *args, **kwargs): # src,
 
     #if aggfunc == 'mean':
@@ -266,16 +293,30 @@ def make_time_keys(dd, time_int, suffix, intindc, indc): # remove source,
 def convert_long_to_wide(dd, ti, suff, intindc, savecols, indicator=False, aggfunc=False):
 
     '''
-    This function takes a dictionary and converts it from longitudinal format
-    to wide format.
+    This function takes a dictionary (or the ColumnarTable from a merge) and
+    converts it from longitudinal format to wide format.
     '''
 
     start = time.time()
+    tracker = Tracker('long to wide', total = len(dd), unit = 'keys')
     logging.info(f"Loaded aggfunc in long2wide: {aggfunc}")
     if aggfunc:
 
         aggfunc = aggfunc[0]
         logging.info(f"AGGFUNC in long2wide True: {aggfunc}")
+
+    if isinstance(dd, ColumnarTable):
+        # Build the dictionary for one key at a time from the merged table,
+        # aggregating it right away so the lists don't all exist at once
+        table = dd
+        dd = {}
+        for key in table.keys():
+            dd[key] = table.key_dict(key)
+            if aggfunc:
+                aggregate_data({key: dd[key]}, aggfunc)
+            tracker.update()
+
+    elif aggfunc:
         dd = aggregate_data(dd, aggfunc) # source,
     # Split the original (ID, Date) key into nested keys
     new_dict = split_keys(dd, indicator)
@@ -319,7 +360,7 @@ def convert_long_to_wide(dd, ti, suff, intindc, savecols, indicator=False, aggfu
                             for k in set().union(*new_DD[key][tkey])}
 
     # Combine month keys with column Keys
-    columns = []
+    columns = ColumnRegistry()
     final_dict = defaultdict(dict)
     for KEY, VAL in new_DD.items():
         IDKEY = KEY
@@ -328,8 +369,7 @@ def convert_long_to_wide(dd, ti, suff, intindc, savecols, indicator=False, aggfu
             for kk, vv in v.items():
                 new_key = f"{kk}_{TKEY}"
                 final_dict[IDKEY][new_key] = vv[0]
-                if new_key not in columns:
-                    columns.append(new_key)
+                columns.add(new_key)
 
     # Merge columns we didn't transform with the final dictionary
     for ID, sub_dd in safe_dict.items():
@@ -339,7 +379,8 @@ def convert_long_to_wide(dd, ti, suff, intindc, savecols, indicator=False, aggfu
             #print(save_col)
             final_dict[ID][save_col] = save_val
 
-    columns = save_cols + columns
+    columns = save_cols + columns.names()
+    tracker.finish(len(dd) - tracker.done, ids = len(final_dict), columns = len(columns))
     return final_dict, columns
 
 
@@ -360,76 +401,89 @@ def write_to_csv(dd, columns, filename, id_col):
         writer = csv.DictWriter(fout, fieldnames = columns, lineterminator = '\n')
         # Write column names
         writer.writeheader()
+        tracker = Tracker('write', unit = 'rows')
         # Write dictionary row by row, duplicating keys as necessary
-        for k in dd:
-            '''
-            tcols = list(dd[k].keys())
+        for temp in iter_rows(dd, columns, id_col):
+            writer.writerow(temp)
+            tracker.update()
+
+    tracker.finish(bytes = os.path.getsize(filename))
+    return
 
-            for tcol in tcols:
-                t = dd[k][tcol]
+def iter_rows(dd, columns, id_col):
+    '''
+    Yields the rows of the wide data as dicts of column -> value, duplicating
+    keys as necessary. columns are the columns of the file (including id_col).
+    '''
+    for k in dd:
+        '''
+        tcols = list(dd[k].keys())
 
-                if isinstance(t, list):
-                    n = len(t)
+        for tcol in tcols:
+            t = dd[k][tcol]
+
+            if isinstance(t, list):
+                n = len(t)
+            else:
+                n = 1
+
+            for i in range(n):
+                temp = {}
+                if n <= 1:
+                    temp[tcol] = dd[k].get(tcol, ['']*(i+1))[i]
                 else:
-                    n = 1
+                    temp[tcol] = dd[k].get(tcol, '')
 
-                for i in range(n):
-                    temp = {}
-                    if n <= 1:
-                        temp[tcol] = dd[k].get(tcol, ['']*(i+1))[i]
-                    else:
-                        temp[tcol] = dd[k].get(tcol, '')
+        temp[id_col] = k
+        writer.writerow(temp)
 
-            temp[id_col] = k
-            writer.writerow(temp)
+        '''
+        # The number of rows in the merged data
+        tcols = list(dd[k].keys())
+        #print(sorted(tcols))
+        #print(sorted(columns))
+        t = dd[k][tcols[0]]
+        #print(t) # Last column
+        #disparate_cols = list(set(columns) - set(tcols))
+        #print(f"Columns missing for {k} are: ", disparate_cols)
+        if isinstance(t, list):
 
-            '''
-            # The number of rows in the merged data
-            tcols = list(dd[k].keys())
-            #print(sorted(tcols))
-            #print(sorted(columns))
-            t = dd[k][tcols[0]]
-            #print(t) # Last column
-            #disparate_cols = list(set(columns) - set(tcols))
-            #print(f"Columns missing for {k} are: ", disparate_cols)
-            if isinstance(t, list):
+            n = max(list(map(lambda x: len(dd[k][x]), dd[k]))) #len(t)
 
-                n = max(list(map(lambda x: len(dd[k][x]), dd[k]))) #len(t)
+        else:
+            n = -1
 
-            else:
-                n = -1
+        # Values in dictionary are strings and only one per column / key
+        if n == -1:
+            temp = {}
+
+            for col in columns:
+                temp[col] = dd[k].get(col, '')
+
+            temp[id_col] = k
+            yield temp
 
-            # Values in dictionary are strings and only one per column / key
-            if n == -1:
+        else:
+            for i in range(n):
+                # Create a temporary dictionary that contains the column
+                # and corresponding row value. Col names are keys in temp
                 temp = {}
 
-                for col in columns:
-                    temp[col] = dd[k].get(col, '')
+                for col in tcols: #columns:
+                    #if n != 1: # Changed from != to == on Sep 10 2021
+                    if len(dd[k][col]) != n:
+                        extended_vals = dd[k].get(col, [''])*n
+                        temp[col] = extended_vals[i] #dd[k].get(col, ['']*(i+1))[i]
+
+                    else:
+                        temp[col] = dd[k].get(col, [''])[i]
 
+                # To write the key, we need to add it as a column.
                 temp[id_col] = k
-                writer.writerow(temp)
 
-            else:
-                for i in range(n):
-                    # Create a temporary dictionary that contains the column
-                    # and corresponding row value. Col names are keys in temp
-                    temp = {}
-
-                    for col in tcols: #columns:
-                        #if n != 1: # Changed from != to == on Sep 10 2021
-                        if len(dd[k][col]) != n:
-                            extended_vals = dd[k].get(col, [''])*n
-                            temp[col] = extended_vals[i] #dd[k].get(col, ['']*(i+1))[i]
-
-                        else:
-                            temp[col] = dd[k].get(col, [''])[i]
-
-                    # To write the key, we need to add it as a column.
-                    temp[id_col] = k
-
-                    # Write row to the csv file
-                    writer.writerow(temp)
-                #'''
+                # Row to write to the csv file
+                yield temp
+            #'''
 
     return
 
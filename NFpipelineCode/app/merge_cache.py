@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module saves the parsed contents of each input file between merges, so an incremental
+merge only has to read the files that were added or changed since the last run.
+"""
+import os
+import json
+import pickle
+import hashlib
+import logging
+from pathlib import Path
+
+# Number of bytes read at a time when hashing a file
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    ''' Returns the SHA-1 of the whole file '''
+    h = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(HASH_BLOCK_SIZE), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+class MergeCache:
+    '''
+    Folder holding one pickled partial result (the output of merge_csvs.parse_file)
+    per input file, and a manifest with the path, size, modification time and
+    hash of the file each partial was made from.
+
+    A partial is reused if the file has the same size and modification time, or
+    the same size and hash (for example, if the file was copied again unchanged).
+    '''
+
+    def __init__(self, folder):
+
+        self.folder = Path(folder)
+        self.manifest_file = self.folder / 'manifest.json'
+        try:
+            with open(self.manifest_file, 'r') as fin:
+                self.manifest = json.load(fin)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+        self.reused = 0
+        self.parsed = 0
+
+    def _name(self, file, encoding, newline):
+        ''' Name of the entry for a file read with the given encoding and newline '''
+        path = os.path.abspath(file)
+        return hashlib.sha1(json.dumps([path, encoding, newline]).encode()).hexdigest()
+
+    def is_current(self, file, encoding = None, newline = None):
+        ''' Checks if there is a saved partial for the current version of file '''
+
+        entry = self.manifest.get(self._name(file, encoding, newline))
+        if entry is None or not (self.folder / entry['partial']).exists():
+            return False
+
+        st = os.stat(file)
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime_ns != entry['mtime_ns']:
+            # Only the modification time changed, check the contents
+            if file_hash(file) != entry['sha1']:
+                return False
+            entry['mtime_ns'] = st.st_mtime_ns
+
+        return True
+
+    def load(self, file, encoding = None, newline = None):
+        ''' Returns the saved partial of file '''
+        entry = self.manifest[self._name(file, encoding, newline)]
+        with open(self.folder / entry['partial'], 'rb') as fin:
+            partial = pickle.load(fin)
+        self.reused += 1
+
+        return partial
+
+    def store(self, file, partial, encoding = None, newline = None):
+        ''' Saves the partial of file and adds it to the manifest '''
+        name = self._name(file, encoding, newline)
+        self.folder.mkdir(parents = True, exist_ok = True)
+        with open(self.folder / f"{name}.pkl", 'wb') as fout:
+            pickle.dump(partial, fout, protocol = pickle.HIGHEST_PROTOCOL)
+
+        st = os.stat(file)
+        self.manifest[name] = {'path': os.path.abspath(file), 'encoding': encoding, 'newline': newline,
+                               'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                               'sha1': file_hash(file), 'partial': f"{name}.pkl"}
+        self.parsed += 1
+
+        return self
+
+    def prune(self):
+        ''' Removes the partials of files that no longer exist '''
+        for name, entry in list(self.manifest.items()):
+            if not os.path.exists(entry['path']):
+                try:
+                    os.remove(self.folder / entry['partial'])
+                except OSError:
+                    pass
+                del self.manifest[name]
+
+        return self
+
+    def save(self):
+        ''' Writes the manifest '''
+        self.prune()
+        try:
+            self.folder.mkdir(parents = True, exist_ok = True)
+            temp_name = f"{self.manifest_file}.{os.getpid()}.tmp"
+            with open(temp_name, 'w') as fout:
+                json.dump(self.manifest, fout)
+            os.replace(temp_name, self.manifest_file)
+        except OSError as e:
+            logging.info(f"Could not save the merge cache manifest: {e}")
+
+        return self
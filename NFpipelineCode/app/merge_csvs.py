@@ -19,17 +19,23 @@ import copy
 import numpy as np
 import pandas as pd
 import glob
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import time
 import long2wide
 import stats_pipeline as statsp
-from flask import flash
+from progress import flash, Tracker
+from profiling import timed
 import scrape_FITBIR_data_dictionary as sfitbir
 import scrape_NDA_data_dictionary as snda
 import os
 import logging
-import chardet
+import csv_detect
 import re
+from merge_index import RowIndex
+from columnar import ColumnarTable
+from column_registry import ColumnRegistry
+from merge_cache import MergeCache
 
 import sys
 from pathlib import Path
@@ -52,6 +58,16 @@ else:
 
 #For testing
 import pprint
+
+# Number of values checked at a time when looking for empty columns
+EMPTY_CHUNK_SIZE = 65536
+
+# Merged data with more values than this is passed to long2wide and the stats
+# through a CSV file. Smaller merges are passed along in memory.
+HANDOFF_MAX_CELLS = 50000000
+
+# Where incremental merges keep the contents of the files they have read
+MERGE_CACHE_FOLDER = Path(new_path, 'Outputs', '.merge_cache')
 ########### NOTE ###############
 # NDA doesn't merge properly because of the redundant columns in the datasets - IGNORED - that's how Jessica wants it for now.
 # FITBIR doesn't merge properly because of the comp_df - FIXED - removed `sorted()` in lines 99 and 120
@@ -66,184 +82,416 @@ import pprint
 
 
 
-def merge_all(files, id_col, date_col, bind, mapping): # sep
-    ### Best idea as of April 16th, 2019
+MergePlan = namedtuple('MergePlan', ['columns', 'out_columns', 'id_col', 'date_col',
+                                     'merge_files', 'missing_files', 'encoding'])
 
-    ## Collect all the unique columns across files
-    columns = []
-#    flash("***** Collecting the names of the columns across all files *****")
+def read_headers(files, id_col, date_col, bind, mapping = None):
+    '''
+    Collects all the unique columns across files, in the order they are first seen.
+    Only the column names are read (they are cached by csv_detect).
+
+    Returns
+    -----------
+    columns: a ColumnRegistry - names of the columns in all the files
+    missing_files: a list - files that are missing the id_col or date_col (column binding only)
+    encod: a str - encoding detected for the last file
+    '''
+    columns = ColumnRegistry(mapping = mapping)
     missing_files = []
+    encod = None
+    tracker = Tracker('header scan', total = len(files), unit = 'files')
     for file in files:
         logging.info(file.split(os.sep)[-1])
-        with open(file, 'rb') as rawdata:
-            result = chardet.detect(rawdata.read(10000))
-            encod = result['encoding']
-
-        with open(file, 'r', encoding = encod, newline = "") as f:
-            sniffer = csv.Sniffer()
-            dialect = sniffer.sniff(f.readline())
-            f.seek(0)
-            #delim = str(dialect.delimiter)
-            csvreader = csv.reader(f, dialect)
-            # Get just the first row, which should hold the column names
-            headers = next(csvreader)
-            # Only execute if column binding
-            if bind == 'column':
-                # Check if the merge columns are in the file
-                if date_col:
-                    if id_col not in headers or date_col not in headers:
-                        missing_files.append(file)
-                else:
-                    if id_col not in headers:
-                        missing_files.append(file)
-            # Loop over all the columns in the file
-            for h in headers:
-                # If the column has not already been seen, add it to our list
-                if h not in columns:
-                    columns.append(h)
+        # Encoding, delimiter and column names (cached between runs)
+        info = csv_detect.detect(file)
+        encod = info.encoding
+        # Get just the first row, which should hold the column names
+        headers = info.headers
+        # Only execute if column binding
+        if bind == 'column':
+            # Check if the merge columns are in the file
+            if date_col:
+                if id_col not in headers or date_col not in headers:
+                    missing_files.append(file)
+            else:
+                if id_col not in headers:
+                    missing_files.append(file)
+        # Add the columns that have not been seen yet
+        columns.update(headers)
+        tracker.update()
+
+    tracker.finish(columns = len(columns), skipped = len(missing_files))
+    return columns, missing_files, encod
+
+def plan_merge(files, id_col, date_col, bind, mapping = None):
+    '''
+    Works out the layout of a merge from the column names of the files, before
+    any data is read.
+
+    Parameters
+    -----------
+    files: a list - paths of the files to merge
+    id_col: a str - column to join on (column binding only)
+    date_col: a str or False - second column to join on (column binding only)
+    bind: a str - 'row' or 'column'
+    mapping: a dict or None - new names for the columns
 
+    Returns
+    -----------
+    plan: a MergePlan with
+        columns: the columns read from the files, in the order they are first seen
+        out_columns: the (mapped) names of the columns stored by merge_all, in the same order
+        id_col, date_col: the (mapped) merge columns
+        merge_files: the files that will be merged
+        missing_files: the files skipped because they are missing the id_col or date_col
+        encoding: the encoding detected for the last file
+    '''
+    registry, missing_files, encod = read_headers(files, id_col, date_col, bind, mapping)
     merge_files = [f for f in files if f not in missing_files]
+
+    if bind == 'row':
+        columns = registry.names()
+        out_columns = registry.mapped_names()
+    else:
+        # Check that the date and id columns are mapped correctly
+        if mapping is not None:
+            if date_col and date_col in mapping.keys():
+                date_col = mapping[date_col]
+            if id_col in mapping.keys():
+                id_col = mapping[id_col]
+        # Columns stored for each key (everything except the merge columns)
+        merge_cols = {id_col, date_col}
+        columns, out_columns = [], []
+        for col, out_col in zip(registry, registry.mapped_names()):
+            if col not in merge_cols:
+                columns.append(col)
+                out_columns.append(out_col)
+
+    return MergePlan(columns, out_columns, id_col, date_col, merge_files, missing_files, encod)
+
+def iter_file(file, encoding = None, newline = None):
+    '''
+    Reads a CSV file with csv.DictReader. Yields the (unique) column names of the
+    file first, then each row as a list of values aligned to those columns.
+    Short rows have None for the missing values, like csv.DictReader.
+    '''
+    delim = csv_detect.detect(file).delimiter
+    with open(file, 'r', encoding = encoding, newline = newline) as fin:
+        reader = csv.DictReader(fin, delimiter = delim)
+
+        # Repeated column names hold the last value in the row, like csv.DictReader
+        file_cols = list(dict.fromkeys(reader.fieldnames or []))
+        yield file_cols
+
+        for row in reader:
+            yield [row[col] for col in file_cols]
+
+def parse_file(file, encoding = None, newline = None):
+    '''
+    Reads a whole file into a partial result for merge_all: a list whose first
+    element is the column names and the rest are the rows. This is run by the
+    worker processes when merging in parallel.
+    '''
+    return list(iter_file(file, encoding, newline))
+
+def parse_files(files, encoding = None, newline = None, workers = None):
+    '''
+    Parses the files in a pool of worker processes. The partial results are
+    returned in the same order as files, so the merge does not depend on which
+    worker finishes first.
+    '''
+    n = len(files)
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        for partial in executor.map(parse_file, files, [encoding]*n, [newline]*n):
+            yield partial
+
+def read_partials(files, encoding = None, newline = None, workers = None, cache = None):
+    '''
+    Yields the partial result of each file (its column names followed by its rows),
+    in the same order as files.
+
+    If a MergeCache is given, the saved partials of the files that did not change
+    are reused and only the new or changed files are read (and then saved).
+    The cache manifest is written by cache.save() once the merge is done.
+
+    The time spent reading the files is recorded as the 'parse' stage of the run report.
+    '''
+    if cache is None:
+        if workers:
+            logging.info(f"Reading {len(files)} files with {workers} processes")
+            yield from timed('parse', parse_files(files, encoding, newline, workers))
+        else:
+            for file in files:
+                yield timed('parse', iter_file(file, encoding, newline))
+        return
+
+    stale = [f for f in files if not cache.is_current(f, encoding, newline)]
+    logging.info(f"Reusing {len(files) - len(stale)} files, reading {len(stale)} new or changed files")
+    if workers:
+        fresh = parse_files(stale, encoding, newline, workers)
+    else:
+        fresh = (parse_file(file, encoding, newline) for file in stale)
+    fresh = timed('parse', fresh)
+
+    stale = set(stale)
+    for file in files:
+        if file in stale:
+            partial = next(fresh)
+            cache.store(file, partial, encoding, newline)
+        else:
+            partial = cache.load(file, encoding, newline)
+        yield partial
+
+def merge_all(files, id_col, date_col, bind, mapping, workers = None, cache = None): # sep
+    '''
+    Merges the files by stacking them (bind='row') or by joining rows on the
+    id_col and date_col (bind='column').
+
+    If workers is given, the files are read in parallel by that many processes
+    and then merged in file order, which gives the same result as reading them
+    one after another. If a MergeCache is given, only the files that changed
+    since the last merge are read again.
+    '''
+    ### Best idea as of April 16th, 2019
+
+    ## Collect all the unique columns across files
+#    flash("***** Collecting the names of the columns across all files *****")
+    plan = plan_merge(files, id_col, date_col, bind, mapping)
+    columns, merge_files = plan.columns, plan.merge_files
 #    flash("***** The following list of files could not be merged because they are missing one or more of the columns you tried merging on *****")
-#    for mf in missing_files:
+#    for mf in plan.missing_files:
 #        flash(mf.split(os.sep)[-1])
 #    flash("***** Finished collecting the column names from all files *****")
+    # Row-binding reads every file with the encoding found for the last file
+    if bind == 'row':
+        encoding, newline = plan.encoding, ""
+    else:
+        encoding, newline = None, None
+
+    # Each element is the column names of a file followed by its rows
+    parsed = read_partials(merge_files, encoding, newline, workers, cache)
+
     # Initialize the dictionary we will store the merged data in
     data = {}
+    tracker = Tracker('merge', total = len(merge_files), unit = 'files')
 
     # Check if row binding or column binding
     if bind == 'row':
         data = defaultdict(list)
+        out_cols = plan.out_columns
         # Read all files, add each row to the dictionary to concatentate files (similar to pandas.concat)
-        for file in merge_files:
+        for file, file_rows in zip(merge_files, parsed):
             logging.info("Reading in file {} ...".format(file.split(os.sep)[-1]))
-            with open(file, 'r', encoding = encod, newline = "") as f:
+            file_rows = iter(file_rows)
+            file_cols = next(file_rows)
+            # Position of each column in the file, None if the file doesn't have it
+            pos = {col: i for i, col in enumerate(file_cols)}
+            take = [pos.get(col) for col in columns]
+
+            nrows = 0
+            for vals in file_rows:
+                for col, i in zip(out_cols, take):
+                    # If the column is not in the file, add an empty string
+                    if i is None:
+                        data[col].append('')
+                    else:
+                        data[col].append(vals[i])
+                nrows += 1
+            tracker.update(rows = nrows)
 
-                sniffer = csv.Sniffer()
-                dialect = sniffer.sniff(f.readline())
-                f.seek(0)
-                delim = str(dialect.delimiter)
-                reader = csv.DictReader(f, delimiter = delim)
+    else:
+        id_col, date_col = plan.id_col, plan.date_col
+        # Columns stored for each key (everything except the merge columns)
+        use_cols = columns
+        data = ColumnarTable(plan.out_columns)
+        # Row indexes for keys that hold more than one row, so new rows can be
+        # matched without comparing them to every existing row
+        indexes = {}
+        # Read all the files, add rows to the table if haven't been added, or
+        # merge if they can be merged
+        for file_rows in parsed:
+#            flash("Reading in file {} ...".format(file.split(os.sep)[-1])) #.split('/')[-1]))
+            file_rows = iter(file_rows)
+            file_cols = next(file_rows)
+            # Position of each column in the file, None if the file doesn't have it
+            pos = {col: i for i, col in enumerate(file_cols)}
+            take = [pos.get(col) for col in use_cols]
+            id_pos = pos[id_col]
+            if date_col:
+                date_pos = pos[date_col]
+            nrows = nmerged = 0
+            # Loop over all the rows in the file
+            for vals in file_rows:
+                nrows += 1
+                # If the user wants to include a date column (or a second column to join on)
+                if date_col:
+                    # Make the key a tuple with the values of the id_col and date_col in the row
+                    key = (vals[id_pos], vals[date_pos])
 
-                for row in reader:
+                # Otherwise, for a single column join (i.e. FITBIR)
+                else:
+                    key = vals[id_pos]
 
-                    for col in columns:
+                # Get list of the row values, replacing missing cols with '' if the column is not in the row
+                r_vals = [vals[i] if i is not None else '' for i in take]
 
-                        value = row.get(col, '')
-                        # Insert mapping here
+                # Check if the key is not already in the table
+                if key not in data:
+                    data.append(key, r_vals)
 
-                        if mapping is not None:
-                            if col in mapping:
-                                new_col = mapping[col]
-                                data[new_col].append(value)
-                            else:
-                                data[col].append(value)
+                # The key is already in the table
+                else:
+                    # Compare the new row to the existing rows, merging if possible
+                    get_row = compare_table_rows(data, key, r_vals, indexes.get(key))
+                    # get_row is either True or False. Indicates whether the
+                    # new row needs to be added to the table, i.e. the
+                    # new row could not be merged, or was not a duplicate of
+                    # an existing row
+                    if get_row:
+                        data.append(key, r_vals)
+                        # Start indexing the key once it holds more than one row
+                        if key in indexes:
+                            indexes[key].add(r_vals)
                         else:
-                            data[col].append(value)
+                            indexes[key] = RowIndex([data.row(r) for r in data.rows(key)])
+                    else:
+                        nmerged += 1
+            tracker.update(rows = nrows, merged = nmerged)
+
+
+    # Done reading (this also records the time spent parsing the files)
+    parsed.close()
+    tracker.finish()
+    return data#, columns
+
+def stream_row_bind(files, filename, mapping, lead_cols = (), column_values = None, cache = None, workers = None):
+    '''
+    Row-binds the files straight into a CSV file without holding the data in memory.
+    Each row is written as soon as it is read (missing columns are left blank), and
+    the columns that turn out to be empty are removed with a second pass over the
+    written file. The result is the same as merge_all, remove_empty_columns and
+    write_to_csv with bind='row'.
+
+    Parameters
+    -----------
+    files: a list - paths of the files to stack
+    filename: a str - path to name of the merged file
+    mapping: a dict or None - new names for the columns
+    lead_cols: a list - columns repeated at the start of the file (main adds the id_col and date_col here)
+    column_values: a dict or None - if given, filled with the values of each final column while
+                   the file is rewritten, so stats can be computed without reading the file back
+    cache: a MergeCache or None - reuse the saved contents of the files that did not change
+    workers: an int or None - number of processes reading the files in parallel (still written in the
+             order of files). The processes read whole files, so more than one file can be in memory.
+
+    Returns
+    -----------
+    final_columns: a list - merged columns that were not empty (without lead_cols)
+    '''
+
+    plan = plan_merge(files, None, False, 'row', mapping)
+    columns, out_cols, encod = plan.columns, plan.out_columns, plan.encoding
 
-                    '''# Check all columns
-                    for col in columns:
+    # Track which columns have a non-empty value
+    filled = [False]*len(columns)
+    nrows = 0
 
-                        if col not in data:
-                            data[col] = []
-                        #else: # Not necessar otherwise the first row of data is excluded
+    temp_name = filename + '.tmp'
+    tracker = Tracker('merge', total = len(files), unit = 'files')
+    with open(temp_name, 'w', newline = "") as fout:
+        writer = csv.writer(fout, lineterminator = '\n')
+        writer.writerow(out_cols)
 
-                        # Get the value from the column, if the column is
-                        # not in the file, return an empty string
-                        value = row.get(col, '')
+        for file, file_rows in zip(files, read_partials(files, encod, "", workers, cache)):
+            logging.info("Reading in file {} ...".format(file.split(os.sep)[-1]))
+            file_rows = iter(file_rows)
+            file_cols = next(file_rows)
+            # Position of each column in the file, None if the file doesn't have it
+            pos = {col: i for i, col in enumerate(file_cols)}
+            take = [pos.get(col) for col in columns]
+
+            file_nrows = nrows
+            for vals in file_rows:
+                values = [vals[i] if i is not None else '' for i in take]
+                for j, value in enumerate(values):
+                    if value != '':
+                        filled[j] = True
+                writer.writerow(values)
+                nrows += 1
+            tracker.update(rows = nrows - file_nrows)
+    tracker.finish()
+
+    # Columns without any values are dropped (all of them if there are no rows, which leaves the lead columns)
+    keep = [j for j in range(len(columns)) if filled[j]]
+    final_columns = [out_cols[j] for j in keep]
+    dropped = [out_cols[j] for j in range(len(columns)) if j not in keep]
+    logging.info(f"Removed {len(dropped)} empty columns: {dropped}")
+    Tracker('remove empty columns', total = len(columns), unit = 'columns').finish(len(columns), dropped = len(dropped))
+
+    # Lead columns that aren't in the data are written as blanks
+    lead = [keep[final_columns.index(col)] if col in final_columns else None for col in lead_cols]
+
+    # Rewrite the file with only the columns to keep
+    tracker = Tracker('write', total = nrows, unit = 'rows')
+    with open(temp_name, 'r', newline = "") as fin, open(filename, 'w') as fout:
+        reader = csv.reader(fin)
+        writer = csv.writer(fout, lineterminator = '\n')
+        writer.writerow(list(lead_cols) + final_columns)
+        next(reader)
+        if column_values is not None:
+            kept_values = [column_values.setdefault(col, []) for col in final_columns]
+        for row in reader:
+            writer.writerow([row[j] if j is not None else '' for j in lead] + [row[j] for j in keep])
+            if column_values is not None:
+                for col_values, j in zip(kept_values, keep):
+                    col_values.append(row[j])
+            tracker.update()
+
+    os.remove(temp_name)
+    tracker.finish(bytes = os.path.getsize(filename))
+
+    return final_columns
+
+def compare_table_rows(table, key, row_vals, index = None):
+    '''
+    Same as compare_lists, but for the rows of a key in a ColumnarTable. If the
+    key has a RowIndex, only the rows that the index reports as possible matches
+    are tried. The result is identical to compare_lists.
+
+    Parameters
+    -----------
+    table: a ColumnarTable - where the merged data is stored
+    key: a str or tuple - the key the incoming row belongs to
+    row_vals: a list - the incoming row that we should compare values to
+    index: a RowIndex or None - index of the rows already stored for key
+
+    Returns
+    -----------
+    get_values: a boolean - tells the main script whether or not it needs to add the row_vals as a new row
+    '''
 
-                        data[col].append(value)
-                        '''
+    rows = table.rows(key)
+    if index is not None:
+        positions = index.candidates(row_vals)
     else:
-        # Read all the files, add rows to dictionary if haven't been added, or
-        # merge if they can be merged
-        for file in merge_files:
-#            flash("Reading in file {} ...".format(file.split(os.sep)[-1])) #.split('/')[-1]))
-            with open(file, 'r') as fin:
-                # Use DictReader so we can add empty strings if a column is not
-                # in that file
-                sniffer = csv.Sniffer()
-                dialect = sniffer.sniff(fin.readline())
-                fin.seek(0)
-                delim = str(dialect.delimiter)
-                reader = csv.DictReader(fin, delimiter = delim) #sep)
-                # Loop over all the rows in the file
-                for row in reader:
-                    # If the user wants to include a date column (or a second column to join on)
-                    if date_col:
-                        # Check that the date and id columns are mapped correctly
-                        if mapping is not None:
-                            if date_col in mapping.keys():
-                                date_col = mapping[date_col]
-                            if id_col in mapping.keys():
-                                id_col = mapping[id_col]
-                        # Make the key a tuple with the values of the id_col and date_col in the row
-                        key = (row[id_col], row[date_col])
-
-                    # Otherwise, for a single column join (i.e. FITBIR)
-                    else:
-                        # Check that the date and id columns are mapped correctly
-                        if mapping is not None:
-                            if id_col in mapping.keys():
-                                id_col = mapping[id_col]
-
-                        key = row[id_col]
-
-                    # Check if the key is not already in the dictionary
-                    if key not in data:
-                        # Initialize a dictionary of lists as the values for each key
-                        # Each key in this dictionary represents a column, each element
-                        # in the list is a row
-                        data[key] = defaultdict(list)
-                        # Check all columns
-                        for col in columns:
-                            # Check that column being tested is not the id_col or date_col
-                            if col not in [id_col, date_col]:
-                                # Get the value from the column, if the column is
-                                # not in the file, return an empty string
-                                value = row.get(col, '')
-                                # Insert mapping here
-                                if mapping is not None:
-                                    if col in mapping:
-                                        new_col = mapping[col]
-                                        data[key][new_col].append(value)
-                                    else:
-                                        data[key][col].append(value)
-                                else:
-                                    data[key][col].append(value)
-                                ## Add the value to the list
-                                #data[key][col].append(value)
-
-                    # The key is already in the dictionary
-                    else:
-                        # Get list of the new row values, replacing missing cols with '' if the column is not in the row
-                        r_vals = [row.get(col, '') for col in columns if col not in [id_col, date_col]]
-                        # Compare the two rows, merging if possible
-                        data[key], get_row = compare_lists(data[key], r_vals)
-                        # get_row is either True or False. Indicates whether the
-                        # new row needs to be added to the dictionary, i.e. the
-                        # new row could not be merged, or was not a duplicate of
-                        # an existing row
-                        if get_row:
-                            for col in columns:
-                                # Do not get the values for ID and Date cols again
-                                if col not in [id_col, date_col]:
-                                    # Get the value from the column, if the column is
-                                    # not in the file, return an empty string
-                                    value = row.get(col, '')
-                                    # Insert mapping here
-                                    if mapping is not None:
-                                        if col in mapping:
-                                            new_col = mapping[col]
-                                            data[key][new_col].append(value)
-                                        else:
-                                            data[key][col].append(value)
-                                    else:
-                                        data[key][col].append(value)
-                                    ## Add the value to the list
-                                    #data[key][col].append(value)
+        positions = range(len(rows))
 
+    for i in positions:
+        old_vals = table.row(rows[i])
+        # Try merging the lists
+        new_vals = merge_lists(row_vals, old_vals)
+        # The lists couldn't be merged
+        if len(new_vals) == 2:
+            continue
+        # Replace the values in the ith row with the values in the merged/original row
+        table.set_row(rows[i], new_vals)
+        if index is not None:
+            index.update(i, old_vals, new_vals)
 
-    return data#, columns
+        return False
+
+    # The new row can't be merged with any existing row
+    return True
 
 def compare_lists(dd, row_vals):
     '''
@@ -408,102 +656,104 @@ def dd_to_df(dd, l):
     rdf = pd.DataFrame(dd).T.stack().unstack(level=[l])
     return rdf
 
-def remove_empty_columns(dd, binding):
+def all_empty(values, chunk_size = EMPTY_CHUNK_SIZE):
     '''
-    Removes the columns that have all empty strings in them
+    Checks if a list holds only empty strings (and at least one). The list is
+    counted chunk_size values at a time so a column with data stops early.
+    '''
+    if not values:
+        return False
+
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        if chunk.count('') != len(chunk):
+            return False
+
+    return True
+
+def find_empty_columns(dd, binding, chunk_size = EMPTY_CHUNK_SIZE):
+    '''
+    Finds the columns that have all empty strings in them. Each column is
+    scanned until its first non-empty value.
 
     Parameters
     -----------
-    dd: a dict of dicts of lists - where the merged data is stored
+    dd: a dict of lists (row binding), a dict of dicts of lists or a ColumnarTable (column binding) - where the merged data is stored
+    binding: a str - 'row' or 'column'
+    chunk_size: an int - number of values checked at a time
 
     Returns
     -----------
-    dd: a dict of dicts of lists - modified dd without empty columns
+    columns: a list - all the columns in dd
+    drop_cols: a list - columns in dd that are empty
     '''
 
-    # Get all the columns in the file. Could be faster
-    # Can do it this way because I know each subject will have the same columns,
-    # which is faster than the section commented out below because I'm only
-    # getting the columns from a single subject
-
-    ### Figure out which columns are empty
-    drop_cols = []
-
     # Row-binding dictionary is formatted differently
     if binding.lower() == 'row':
-        # Get columns
-        columns = list(dd.keys())
         # Each key is a column
-        for col, val in dd.items():
-            # Check if all values in the column are ''
-            all_vals = list(set(val))
-            if (len(all_vals) == 1) and (all_vals[0] == ''):
-                drop_cols.append(col)
+        columns = list(dd.keys())
+        drop_cols = [col for col, val in dd.items() if all_empty(val, chunk_size)]
+
+    # Column-binding results are stored in a ColumnarTable
+    elif isinstance(dd, ColumnarTable):
+        columns = list(dd.columns)
+        drop_cols = [col for col in columns if dd.is_empty(col, chunk_size)]
 
     else:
-        # Get columns
+        # Can do it this way because I know each subject will have the same columns
         columns = [k for k in dd[list(dd.keys())[0]]]
+        drop_cols = []
         # Column-binding dictionary is formatted as a dictionary of dictionaries of lists
         for col in columns:
-            # Initialize list to store all values in column
-            test_col_vals = []
-            # Keep track of the row we're on, solely because NDA makes the metdata
-            # the second row in the csv file. When determining if a column is empty,
-            # the metadata gets in the way, so we need to ignore it.
-            # rnum = 0
-            for sub, dt in dd.items():
-                # # Check if files are from NDA, just because of the metadata check
-                # if src.strip().upper() == 'NDA':
-                #     # Ignore the metadata
-                #     if rnum == 0:
-                #         pass
-                #     else:
-                #         # Get values in the column for this subject
-                #         val = dt[col]
-                #         # Loop over values (could be more than one per row)
-                #         for v in val:
-                #             # Add to test_col_vals if not already in there. Empty
-                #             # columns will have test_col_vals = ['']
-                #             if v not in test_col_vals:
-                #                 test_col_vals.append(v)
-                #     rnum += 1
-                # Files are not from NDA
-                # else:
-                # Get values in the columns for this subject
+            seen = False
+            for dt in dd.values():
+                # Values in the column for this subject (could be more than one per row)
                 val = dt[col]
-                # Loop over values (could be more than one per row)
-                for v in val:
-                    # Add to test_col_vals if not already in there. Empty
-                    # columns will have test_col_vals = ['']
-                    if v not in test_col_vals:
-                        test_col_vals.append(v)
-
-            # Check if the values in col are the same.
-            if len(test_col_vals) == 1:
-                # Check if the only value in the column is '' whichs means the column is empty
-                if test_col_vals[0] == '':
-                    # Add the column to the list of empty columns
+                if val:
+                    if not all_empty(val, chunk_size):
+                        break
+                    seen = True
+            else:
+                # Only empty strings were found
+                if seen:
                     drop_cols.append(col)
 
+    return columns, drop_cols
+
+def remove_empty_columns(dd, binding):
+    '''
+    Removes the columns that have all empty strings in them
+
+    Parameters
+    -----------
+    dd: a dict of dicts of lists or a ColumnarTable - where the merged data is stored
+
+    Returns
+    -----------
+    dd: a dict of dicts of lists or a ColumnarTable - modified dd without empty columns
+    final_columns: a list - the remaining columns
+    '''
+
+    ### Figure out which columns are empty
+    columns, drop_cols = find_empty_columns(dd, binding)
+    logging.info(f"Removed {len(drop_cols)} empty columns: {drop_cols}")
+    Tracker('remove empty columns', total = len(columns), unit = 'columns').finish(len(columns), dropped = len(drop_cols))
+    drop_set = set(drop_cols)
+
     ### Remove empty columns from the dataset, by removing for each subject
     if binding.lower() == 'row':
-        # Loop over columns in the row
-        for c, v in list(dd.items()):
-            # Check if c is in drop_cols, so we can drop it
-            if c in drop_cols:
-                # Remove c from the dictionary
-                dd.pop(c, None)
+        for c in drop_cols:
+            # Remove c from the dictionary
+            dd.pop(c, None)
+    elif isinstance(dd, ColumnarTable):
+        dd.drop_columns(drop_set)
     else: # Column binding has more complex keys
-        for ID, dty in list(dd.items()):
-            # Loop over columns in the row
-            for c, v in list(dty.items()):
-                # Check if c is in drop_cols, so we can drop it
-                if c in drop_cols:
-                    # Remove c from the dictionary
-                    dty.pop(c, None)
+        for ID, dty in dd.items():
+            for c in drop_cols:
+                dty.pop(c, None)
 
     # Save and return the remaining columns
-    final_columns = [col for col in columns if col not in drop_cols]
+    final_columns = [col for col in columns if col not in drop_set]
     return dd, final_columns
 
 def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
@@ -513,7 +763,7 @@ def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
 
     Parameters
     -----------
-    dd: a dict of dict of lists - where the merged data is stored
+    dd: a dict of dict of lists or a ColumnarTable - where the merged data is stored
     columns: a list - names of columns in all datasets
     filename: a str - path to name of file
     id_col: a str - ID key to join datasets on
@@ -530,10 +780,12 @@ def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
     # if date_col not in dd:
     #     raise ValueError(f"The date column '{date_col}' is has not been added to the dictionary prior to saving.")
 
+    tracker = Tracker('write', unit = 'rows')
     # Row-binding save to csv
     if (binding.lower() == 'row') and not l2w: # merge only after row-binding
         # Open file to write
 
+        tracker.total = len(dd[columns[0]]) if columns else 0
         with open(filename, 'w') as fout:
             # Use fieldnames as columns
             writer = csv.DictWriter(fout, fieldnames = columns, lineterminator = '\n')
@@ -546,6 +798,7 @@ def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
                 #if i == 0:
                 #    print(temp_dd)
                 writer.writerow(temp_dd)
+                tracker.update()
 
 
     else:
@@ -557,6 +810,8 @@ def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
         #pp = pprint.PrettyPrinter(indent=4)
         #pp.pprint(dd)
         print("INSIDE THE RIGHT ELSE STATMENT")
+        if isinstance(dd, ColumnarTable):
+            tracker.total = dd.nrows
         with open(filename, 'w') as fout:
             # print(columns)
             # Need fieldnames to be all the columns
@@ -564,11 +819,15 @@ def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
             # Write column names
             writer.writeheader()
             # Write dictionary row by row, duplicating keys as necessary
-            for k, col_dict in dd.items():
+            for k in dd:
+
+                if isinstance(dd, ColumnarTable):
+                    row_vals = [dict(zip(dd.columns, dd.row(r))) for r in dd.rows(k)]
+                else:
+                    n = len(dd[k][columns[-1]])
+                    row_vals = [{c: v[i] for c, v in dd[k].items()} for i in range(n)]
 
-                n = len(dd[k][columns[-1]])
-                for i in range(n):
-                    temp = {c: v[i] for c, v in col_dict.items()}
+                for temp in row_vals:
                     # Add the GUID and Date depending on existence and data type
                     if isinstance(k, str):
                         temp[id_col] = k
@@ -581,22 +840,114 @@ def write_to_csv(dd, columns, filename, id_col, date_col, l2w, binding):
                         temp[date_col] = k[1]
 
                     writer.writerow(temp)
+                tracker.update(len(row_vals))
+
+    tracker.finish(bytes = os.path.getsize(filename))
     return
 
-def main(files, filename, id_col, savecols, bind, mapping = None, date_col=False, l2w = False, suffix = False, ti = False, aggfunc = False, intindc = False, *args, **kwargs):#, sep = ','):
+def count_cells(dd, binding):
+    ''' Returns the number of values held by the output of merge_all '''
+    if isinstance(dd, ColumnarTable):
+        return dd.nrows * len(dd.columns)
+    elif binding.lower() == 'row':
+        return sum(len(v) for v in dd.values())
+    else:
+        return sum(len(v) for dt in dd.values() for v in dt.values())
+
+def table_columns(table, columns, id_col, date_col):
+    '''
+    Yields (column, values) for the column-binding output, with the values as
+    strings exactly like they are written by write_to_csv. This lets the stats
+    be computed without reading the merged file back.
+
+    Parameters
+    -----------
+    table: a ColumnarTable - the merged data
+    columns: a list - the columns written to the file, including id_col and date_col
+
+    Returns
+    -----------
+    A generator of (column, list of str) pairs
+    '''
+    for col in columns:
+        if col == id_col:
+            values = [k if isinstance(k, str) else k[0] for k in table for r in table.rows(k)]
+        elif date_col and col == date_col:
+            values = [k[1] for k in table for r in table.rows(k)]
+        else:
+            values = [statsp.csv_str(v) for v in table.column_values(col)]
+        yield col, values
+
+def report_cache(cache):
+    ''' Saves the incremental merge cache and tells the user how many files were reused '''
+    cache.save()
+    logging.info(f"Reused {cache.reused} unchanged files, read {cache.parsed} new or changed files")
+    flash(f"Reused {cache.reused} unchanged files, read {cache.parsed} new or changed files")
+
+    return
+
+def main(files, filename, id_col, savecols, bind, mapping = None, date_col=False, l2w = False, suffix = False, ti = False, aggfunc = False, intindc = False, stream = True, workers = None, handoff_max_cells = HANDOFF_MAX_CELLS, incremental = False, *args, **kwargs):#, sep = ','):
     # Read and merge all files, store in dictionary, get set of all columns
     s = time.time()
     logging.info(f"\n{filename}")
-    dd = merge_all(files, id_col, date_col, bind, mapping) # sep 2n
+
+    # Reuse the files read by the last merge that have not changed since
+    if incremental:
+        cache = MergeCache(MERGE_CACHE_FOLDER)
+    else:
+        cache = None
+
+    # Row-binding that isn't transformed is written straight to the file
+    if stream and (bind.lower() == 'row') and not l2w:
+        if not filename.endswith(('.csv', '.xlsx', '.txt')):
+            flash(f"Support for files that end in {filename.split('.')[-1]} is not available right now. Please contact us about adding it.")
+            return
+        if filename.endswith('.xlsx'):
+            flash("File is saved as a CSV that can be opend with Excel.")
+
+        logging.info("***** Stacking files and removing empty columns *****")
+        flash("***** Stacking files and removing empty columns *****")
+        if date_col:
+            lead_cols = [id_col, date_col]
+        else:
+            lead_cols = [id_col]
+        column_values = {}
+        cols = stream_row_bind(files, filename, mapping, lead_cols, column_values, cache, workers)
+        if cache is not None:
+            report_cache(cache)
+
+        logging.info("***** Finished writing dataset to CSV file *****")
+        flash("***** Finished writing dataset to CSV file *****")
+        logging.info("Time to save file is {:.2f} minutes...".format((time.time()-s)/60))
+        flash("Time to save file is {:.2f} minutes...".format((time.time()-s)/60))
+        logging.info("***** Collecting stats for columns in dataset *****")
+        flash("***** Collecting stats for columns in dataset *****")
+        # Only the merged columns, in order (the lead columns repeat some of them)
+        stats_dd = statsp.make_stats_dict_from_file(column_values)
+        statsp.dict_to_csv(stats_dd, "Outputs{0}stats_file.csv".format(os.sep))
+        logging.info("***** Saved stats to dictionary *****")
+        flash("***** Saved stats to dictionary *****")
+        return
+
+    dd = merge_all(files, id_col, date_col, bind, mapping, workers, cache) # sep 2n
+    if cache is not None:
+        report_cache(cache)
     # pp = pprint.PrettyPrinter(indent=4)
     # pp.pprint(dd)
 
+    # Large merges are handed to the next stage through a CSV file instead of memory
+    spill = (handoff_max_cells is not None) and (count_cells(dd, bind) > handoff_max_cells)
+    if spill:
+        logging.info(f"Merged data has more than {handoff_max_cells} values, handing it over through files")
+
     logging.info("***** Removing empty columns from dataset *****")
     flash("***** Removing empty columns from dataset *****")
+    n_cols = len(dd.columns) if isinstance(dd, ColumnarTable) else len(dd)
     dd, cols = remove_empty_columns(dd, bind)
 
     logging.info("***** Finished removing empty columns from dataset *****")
     flash("***** Finished removing empty columns from dataset *****")
+    flash(f"Removed {n_cols - len(cols)} empty columns")
     # Copy the original copy names for web scraping the data dictionaries
     og_cols = copy.deepcopy(cols)
     ### THESE STATEMENTS ARE ONLY NECESSARY IF YOU WANT TO RETURN A DATAFRAME
@@ -649,14 +1000,18 @@ def main(files, filename, id_col, savecols, bind, mapping = None, date_col=False
                         new_data[key][col].append(value)
 
             '''
-            # Save to CSV file then reload
-            temp_name = str(new_path) + '{0}Outputs{0}'.format(os.sep) + "merged_file.csv"
-            logging.info(temp_name)
-            # Save the merged dataset to a CSV (works well)
-            write_to_csv(dd, cols, temp_name, id_col, date_col, False, bind) # Input as False because the write_to_csv function here needs further debugging
-
-            # load data
-            new_data = long2wide.read_csv(temp_name, id_col, date_col)
+            if spill:
+                # Save to CSV file then reload
+                temp_name = str(new_path) + '{0}Outputs{0}'.format(os.sep) + "merged_file.csv"
+                logging.info(temp_name)
+                # Save the merged dataset to a CSV (works well)
+                write_to_csv(dd, cols, temp_name, id_col, date_col, False, bind) # Input as False because the write_to_csv function here needs further debugging
+
+                # load data
+                new_data = long2wide.read_csv(temp_name, id_col, date_col)
+            else:
+                # Group the stacked rows by (id_col, date_col) without going through a file
+                new_data = long2wide.rows_to_dict(dd, cols, id_col, date_col)
             logging.info(f"AGGFUNC in Merge: {aggfunc}")
             dd, cols = long2wide.convert_long_to_wide(new_data, ti, suffix, intindc, savecols, indicator=False, aggfunc=aggfunc, *args, **kwargs)
 
@@ -723,9 +1078,16 @@ def main(files, filename, id_col, savecols, bind, mapping = None, date_col=False
     ### Formatting depends on the binding
     if (bind.lower() == 'row') and not l2w:
         stats_dd = statsp.make_stats_dict_from_file(dd)
-    else:
+    elif spill:
         ndd = statsp.read_csv(filename)
         stats_dd = statsp.make_stats_dict_from_file(ndd)
+    elif l2w:
+        # Same rows as the ones written by long2wide.write_to_csv
+        rows = long2wide.iter_rows(dd, [id_col] + cols, id_col)
+        stats_dd = statsp.make_stats_dict_from_file(statsp.rows_to_columns(rows, [id_col] + cols))
+    else:
+        # One column at a time, in the order they were written
+        stats_dd = statsp.make_stats_dict_from_file(table_columns(dd, cols, id_col, date_col))
         #stats_dd = statsp.make_stats_dict_in_pipeline(dd)
     # Save stats file
     statsp.dict_to_csv(stats_dd, "Outputs{0}stats_file.csv".format(os.sep))
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module indexes the rows stored under a single merge key so that an incoming row
+can be matched against them without comparing it to every existing row.
+"""
+from collections import defaultdict, Counter
+
+
+def row_signature(row):
+    ''' Order-independent signature of a row. Rows that `merge_lists` considers identical share a signature. '''
+    return hash(frozenset(Counter(row).items()))
+
+
+class RowIndex:
+    '''
+    Index of the rows that share one (id, date) key.
+
+    Each non-empty cell is indexed by its (position, value) pair, which lets us find
+    the rows that conflict with an incoming row using set operations instead of
+    rebuilding and comparing every existing row. The empty cells are indexed too, so the
+    rows that agree with an incoming row are found without going through every row.
+    '''
+
+    def __init__(self, rows = ()):
+
+        # (position, value) -> rows that have that non-empty value
+        self.cells = defaultdict(set)
+        # position -> rows that have any non-empty value there
+        self.filled = defaultdict(set)
+        # position -> rows that have '' there
+        self.empty = defaultdict(set)
+        # length -> rows of that length (a row has no value at the positions after its end)
+        self.lengths = defaultdict(set)
+        self.row_lengths = []
+        # signature -> rows with that signature
+        self.signatures = defaultdict(set)
+        self.row_signatures = []
+
+        for row in rows:
+            self.add(row)
+
+    def __len__(self):
+        return len(self.row_signatures)
+
+    def add(self, row):
+        ''' Index a row appended after the rows already indexed '''
+
+        i = len(self.row_signatures)
+        for j, v in enumerate(row):
+            if v != '':
+                self.cells[(j, v)].add(i)
+                self.filled[j].add(i)
+            else:
+                self.empty[j].add(i)
+        self.lengths[len(row)].add(i)
+        self.row_lengths.append(len(row))
+
+        sig = row_signature(row)
+        self.signatures[sig].add(i)
+        self.row_signatures.append(sig)
+
+        return i
+
+    def update(self, i, old_row, new_row):
+        ''' Re-index row i after its values changed from old_row to new_row '''
+
+        for j, (old, new) in enumerate(zip(old_row, new_row)):
+            if old == new:
+                continue
+            if old != '':
+                self.cells[(j, old)].discard(i)
+                self.filled[j].discard(i)
+            else:
+                self.empty[j].discard(i)
+            if new != '':
+                self.cells[(j, new)].add(i)
+                self.filled[j].add(i)
+            else:
+                self.empty[j].add(i)
+
+        sig = row_signature(new_row)
+        if sig != self.row_signatures[i]:
+            self.signatures[self.row_signatures[i]].discard(i)
+            self.signatures[sig].add(i)
+            self.row_signatures[i] = sig
+
+        return self
+
+    def candidates(self, row):
+        '''
+        Returns the indices (ascending) of the rows that could be merged with row:
+        rows whose non-empty values agree with row, plus rows with the same signature.
+        Every row that `merge_lists` can merge with row is included.
+        '''
+
+        # Rows that agree at a position: the rows with the same value, with '' or too short to have a value there
+        agree = []
+        for j, v in enumerate(row):
+            if v != '' and j in self.filled:
+                same = self.cells.get((j, v), set())
+                short = [self.lengths[length] for length in self.lengths if length <= j]
+                size = len(same) + len(self.empty.get(j, ())) + sum(len(rows) for rows in short)
+                agree.append((size, j, same, short))
+
+        if agree:
+            # Start from the position with the fewest rows, then keep the rows that agree at the others
+            agree.sort(key = lambda a: a[0])
+            _, j, same, short = agree[0]
+            matches = same.union(self.empty.get(j, ()), *short)
+            for _, j, same, _ in agree[1:]:
+                if not matches:
+                    break
+                empty = self.empty.get(j, ())
+                matches = {i for i in matches if i in same or i in empty or self.row_lengths[i] <= j}
+        else:
+            matches = set(range(len(self.row_signatures)))
+        matches |= self.signatures.get(row_signature(row), set())
+
+        return sorted(matches)
@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module contains the pipeline steps run by the web pages (preprocess, merge, transform and stats).
+They only take plain arguments (no forms or requests), so they can run in the background job processes.
+Each step saves a run report (time and memory of each stage) next to its output as <output name>_profile.json.
+
+The preprocessing can also be run from the command line, for example:
+    python pipeline_tasks.py nda Inputs/*.txt --output Outputs --scale --workers 8
+"""
+import os
+import sys
+import csv
+import time
+import logging
+import argparse
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import merge_csvs as mcsvs
+import long2wide as lw
+import stats_pipeline as pstats
+import stats_stream
+import alignment_rules
+import csv_detect
+import csv_columns
+import progress
+import profiling
+from alignment_repository import AlignmentRepository
+from preprocessNDA import NDAdataset
+from preprocessFITBIR import FITBIRdataset
+from progress import flash, Tracker
+from profiling import profile_run, report_name
+
+# Values that mean "no columns" when choosing the columns to create indicators for
+NO_COLS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', \
+           '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null', 'none']
+
+# Files larger than this (in bytes) get their stats read in chunks, unless the user chose otherwise
+STREAM_STATS_BYTES = 1024 ** 3
+
+# Number of processes calculating the stats of the columns (the jobs run one at a time, so the other cores are free).
+# Small files are calculated in the job process (see stats_engine.PARALLEL_MIN_CELLS).
+STATS_WORKERS = os.cpu_count()
+
+# Most processes preprocessing the files (each one holds a whole file, its indicators and its output in memory),
+# also limited by the memory available (see preprocess_workers)
+PREPROCESS_WORKERS = min(4, os.cpu_count() or 1)
+
+# Memory a preprocessing process needs: this many times the size of its file (about 3 times was measured with
+# the indicators of every column), plus the memory of the process itself
+PREPROCESS_MEMORY_FACTOR = 5
+PROCESS_MEMORY = 200 * 1024 ** 2
+
+# Result of preprocessing one file: the processed file and its number of columns, or the error, with the messages
+# and the stages of the run report of a worker process (sent to the user and recorded by the parent process)
+FileResult = namedtuple('FileResult', ['file', 'output', 'columns', 'error', 'messages', 'stages'])
+
+# Alignment (column names and scaling rules) of the files preprocessed by this process
+_alignment = {}
+
+
+def report_time(action, start):
+    ''' Tells the user how long an action took '''
+    total_time = time.time() - start
+    if total_time/60 > 60:
+        message = "Total time to {}: {:.5f} hours".format(action, total_time/3600)
+    elif (total_time/60 < 60) & (total_time > 60):
+        message = "Total time to {}: {:.5f} minutes".format(action, total_time/60)
+    else:
+        message = "Total time to {}: {:.5f} seconds".format(action, total_time)
+
+    logging.info(message)
+    flash(message)
+
+    return
+
+def get_indicator_cols(indic_cols, dataset):
+    ''' Returns the columns to create indicators for from the ';' separated names the user entered '''
+    no_cols = list(map(lambda x: x.lower(), NO_COLS))
+
+    if indic_cols.lower() != 'all':
+        if indic_cols.lower() in no_cols:
+            indicator_cols = []
+        else:
+            indicator_cols = indic_cols.split(';')
+    else:
+        indicator_cols = list(dataset.keys())
+
+    return indicator_cols
+
+def preprocess_nda_file(file, column_mapping, column_scaling, output_folder, drop_cols = None, drop_na_cols = True,
+                        scale_cols = False, change_cols = False, indic_cols = 'ALL', miss_val = '', output_format = 'csv'):
+    '''
+    Preprocesses one NDA file (see preprocess_nda).
+
+    Returns
+    -----------
+    savename: a str - path of the processed file
+    columns: an int - number of columns of the processed file
+    '''
+    pnda = NDAdataset()
+    logging.info("Initialized dataset")
+    # Read csv file
+    pnda.read_csv(file)
+    logging.info("Read file")
+    # Remove certain columns
+    if drop_cols is not None:
+        pnda.remove_cols(drop_cols)
+        logging.info("removed some columns")
+
+    # Collect the metadata
+    metadata = pnda.collect_metadata()
+    logging.info("collected metadata")
+    # Write metadata to file
+    with open(f'{output_folder}{os.sep}metadata_{file.split(os.sep)[-1]}', 'w') as fout:
+        writer = csv.DictWriter(fout, fieldnames = ['Variable', 'Description'])
+        writer.writeheader()
+        for key, value in metadata.items():
+            writer.writerow({'Variable': key, 'Description': value})
+
+    logging.info("wrote metadata to file")
+    # Remove empty columns
+    if drop_na_cols:
+        logging.info("Dropped empty columns")
+        pnda.remove_empty_cols()
+
+    # Scale to match values in FITBIR
+    if scale_cols:
+        logging.info("Scaling to match FITBIR...")
+        pnda.convert_scaling_to_fitbir(column_scaling)
+
+    # Change column names to match FITBIR's (do AFTER scaling!)
+    if change_cols:
+        pnda.change_cols_to_fitbir(column_mapping)
+        logging.info("Using FITBIR column names!")
+
+    # Create indicator columns
+    indicator_cols = get_indicator_cols(indic_cols, pnda.dataset)
+    logging.info(indicator_cols)
+
+    # Handle missing data
+    use_vals = miss_val.split(';')
+    if indicator_cols != []:
+        pnda.handle_missing_values(indicator_cols, use_vals)
+
+    # Save the processed data set
+    savename = output_folder + os.sep + 'processed_' + file.split(os.sep)[-1]
+
+    return pnda.to_csv(savename, output_format), len(pnda.dataset)
+
+def preprocess_fitbir_file(file, column_mapping, column_scaling, output_folder, split_cols = None, split_all = False,
+                           num_suffixes = 1, drop_cols = None, drop_na_cols = True, scale_cols = False,
+                           change_cols = False, indic_cols = 'ALL', miss_val = '', group_cols = None, make_list = False,
+                           output_format = 'csv'):
+    '''
+    Preprocesses one FITBIR file (see preprocess_fitbir).
+
+    Returns
+    -----------
+    savename: a str - path of the processed file
+    columns: an int - number of columns of the processed file
+    '''
+    sprefix = os.path.dirname(output_folder)
+    logging.info(file)
+    # IMPORTANT: we create a new object for each file because each
+    # file is processed separately.
+    # Create dataset object
+    pfitbir = FITBIRdataset()
+    # Read in CSV file
+    pfitbir.read_csv(file)
+
+    # Split cols based on periods
+    if split_cols is not None:
+        # Keep certain parts of the column names
+        logging.info("Split cols yes")
+        pfitbir.split_cols(split_cols, False, num_suffixes)
+        logging.info("Splitted columns")
+
+    # Split all the columns
+    if split_all:
+        use_columns = list(pfitbir.dataset.keys())
+        pfitbir.split_cols(use_columns, True, num_suffixes)
+
+    # Remove certain columns
+    if drop_cols is not None:
+        pfitbir.remove_cols(drop_cols)
+
+    # Drop empty columns
+    if drop_na_cols:
+        pfitbir.remove_empty_cols()
+
+    # Scale to match values in NDA
+    if scale_cols:
+        logging.info("Scaling to match NDA...")
+        pfitbir.convert_scaling_to_nda(column_scaling)
+
+    # Change column names to match NDA's
+    if change_cols:
+        logging.info("Using NDA column names...")
+        pfitbir.change_cols_to_nda(column_mapping)
+
+    # Create indicator columns
+    indicator_cols = get_indicator_cols(indic_cols, pfitbir.dataset)
+
+    # Replace values in columns
+    use_vals = miss_val.split(';')
+    if indicator_cols != []:
+        pfitbir.handle_missing_values(indicator_cols, use_vals)
+
+    # Make list file of unflattened columns
+    if group_cols is not None:
+        bcols, ucols = pfitbir.find_bad_columns(group_cols)
+        # Check if they want to save the bad columns to a separate list
+        pfitbir.fix_bad_columns(make_list, bcols, ucols, sprefix)
+
+    # Save the data file to a new file
+    savename = output_folder + os.sep + 'processed_' + file.split(os.sep)[-1]
+
+    return pfitbir.to_csv(savename, output_format), len(pfitbir.dataset)
+
+def init_preprocess_worker(column_mapping, column_scaling, direction):
+    '''
+    Keeps the alignment for the files preprocessed by this process. The scaling rules are compiled
+    once here (direction is None when they are not used) and only read by the preprocessing.
+    '''
+    if direction is not None:
+        column_scaling = alignment_rules.compile_plan(column_scaling, direction)
+    _alignment['mapping'] = column_mapping
+    _alignment['scaling'] = column_scaling
+
+    return
+
+def available_memory():
+    ''' Returns the bytes of memory available for new processes (Linux only), or None if unknown '''
+    try:
+        with open('/proc/meminfo', 'r') as fin:
+            for line in fin:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+def preprocess_workers(files, workers):
+    ''' Lowers the number of processes so each one has the memory to preprocess the largest file '''
+    available = available_memory()
+    sizes = [os.path.getsize(file) for file in files if os.path.isfile(file)]
+    if available is None or not sizes:
+        return workers
+    fits = available // (max(sizes) * PREPROCESS_MEMORY_FACTOR + PROCESS_MEMORY)
+    if fits < workers:
+        logging.info(f"Only enough memory for {fits} of the {workers} preprocessing processes")
+
+    return max(1, min(workers, fits))
+
+def run_preprocess_file(preprocess_file, file, options, collect = False):
+    '''
+    Preprocesses a file with the alignment of the process, returning its FileResult (with the error if it failed).
+    In a worker process (collect is True), the messages and the stages of the run report are kept in the
+    FileResult for the parent process, since the worker has no job listener and no run being profiled.
+    '''
+    messages = []
+    profile = None
+    if collect:
+        progress.set_listener(lambda event, **fields: messages.append(fields['message']) if event == 'message' else None)
+    try:
+        with (profile_run('preprocess file') if collect else nullcontext()) as profile:
+            wall, cpu, started = time.time(), time.process_time(), profiling.start_stage()
+            output, columns = preprocess_file(file, _alignment['mapping'], _alignment['scaling'], **options)
+            profiling.record('preprocess file', time.time() - wall, time.process_time() - cpu, started,
+                             files = 1, columns = columns)
+    except Exception as e:
+        logging.exception(f"Could not preprocess {file}")
+        output, columns, error = None, None, repr(e)
+    else:
+        error = None
+    finally:
+        if collect:
+            progress.set_listener(None)
+
+    return FileResult(file, output, columns, error, messages, profile.stages if profile is not None else {})
+
+def replay(result):
+    ''' Sends the messages and records the stages of a file preprocessed by a worker process '''
+    for message in result.messages:
+        flash(message)
+    profiling.add_stages(result.stages)
+
+    return result
+
+def preprocess_files(preprocess_file, files, column_mapping, column_scaling, direction, workers = None, **options):
+    '''
+    Preprocesses each file with preprocess_file(file, column_mapping, column_scaling, **options).
+
+    Parameters
+    -----------
+    preprocess_file: a function - preprocess_nda_file or preprocess_fitbir_file
+    files: a list - paths of the files
+    column_mapping: a dict - the column names of the other database
+    column_scaling: a dict - the scaling rules (compiled once in each process)
+    direction: a str or None - alignment_rules.NDA_TO_FITBIR or FITBIR_TO_NDA, None if the files are not scaled
+    workers: an int or None - most processes (None or 1 preprocesses the files one at a time in this process),
+                              lowered to the number that has the memory for the largest file
+    options: the other arguments of preprocess_file
+
+    Returns
+    -----------
+    a generator of FileResult - one for each file, in the order the files are done
+    '''
+    # Compiled scaling rules can't be sent to other processes, so they are used here
+    if not workers or workers <= 1 or len(files) <= 1 or isinstance(column_scaling, alignment_rules.AlignmentPlan):
+        init_preprocess_worker(column_mapping, column_scaling, direction)
+        for file in files:
+            yield run_preprocess_file(preprocess_file, file, options)
+        return
+
+    workers = preprocess_workers(files, min(workers, len(files)))
+    if workers <= 1:
+        init_preprocess_worker(column_mapping, column_scaling, direction)
+        for file in files:
+            yield run_preprocess_file(preprocess_file, file, options)
+        return
+
+    # Detect the formats here, so the processes find them in the cache (errors are reported by the processes)
+    for file in files:
+        try:
+            csv_detect.detect(file)
+        except Exception:
+            pass
+    logging.info(f"Preprocessing {len(files)} files with {workers} processes")
+    with ProcessPoolExecutor(max_workers = workers, initializer = init_preprocess_worker,
+                             initargs = (column_mapping, column_scaling, direction)) as executor:
+        futures = [executor.submit(run_preprocess_file, preprocess_file, file, options, True) for file in files]
+        for future in as_completed(futures):
+            yield replay(future.result())
+
+def report_errors(results):
+    ''' Tells the user which files could not be preprocessed (it fails if none could) and returns the outputs '''
+    errors = [result for result in results if result.error is not None]
+    for result in errors:
+        flash(f"{result.file.split(os.sep)[-1]} could not be processed: {result.error}")
+    if errors and len(errors) == len(results):
+        raise RuntimeError(f"None of the {len(results)} files could be processed")
+    if errors:
+        flash(f"{len(errors)} of {len(results)} files could not be processed")
+
+    return [result.output for result in results if result.error is None]
+
+def preprocess_nda(files, output_folder, column_mapping, column_scaling, drop_cols = None, drop_na_cols = True,
+                   scale_cols = False, change_cols = False, indic_cols = 'ALL', miss_val = '', output_format = 'csv',
+                   workers = PREPROCESS_WORKERS):
+    '''
+    Preprocesses each NDA file and saves it to the output folder as processed_<file name>,
+    with its metadata as metadata_<file name>. The files are preprocessed by workers processes.
+    A file that fails doesn't stop the others: its error is sent to the user.
+
+    Parameters
+    -----------
+    files: a list - paths of the NDA files
+    output_folder: a str - where the processed files are saved
+    column_mapping: a dict - NDA column name -> FITBIR column name
+    column_scaling: a dict - NDA column name -> scaling rule to match FITBIR (or its alignment_rules.AlignmentPlan)
+    drop_cols: a list or None - columns to remove
+    drop_na_cols: a bool - remove the empty columns
+    scale_cols: a bool - scale the values to match FITBIR
+    change_cols: a bool - use the FITBIR column names
+    indic_cols: a str - ';' separated columns to handle missing data in ('ALL' for every column)
+    miss_val: a str - ';' separated values to use for the missing data
+    output_format: a str - csv, gzip, zstd or parquet (csv_columns.OUTPUT_FORMATS)
+    workers: an int or None - most processes preprocessing the files (None for one at a time)
+
+    Returns
+    -----------
+    outputs: a list - paths of the processed files
+    '''
+    report_file = os.path.join(output_folder, 'preprocess_nda_profile.json')
+    results = []
+    with profile_run('preprocess NDA', report_file, files = len(files), workers = workers):
+        tracker = Tracker('preprocess', total = len(files), unit = 'files')
+        for result in preprocess_files(preprocess_nda_file, files, column_mapping, column_scaling,
+                                       alignment_rules.NDA_TO_FITBIR if scale_cols else None, workers,
+                                       output_folder = output_folder, drop_cols = drop_cols,
+                                       drop_na_cols = drop_na_cols, scale_cols = scale_cols,
+                                       change_cols = change_cols, indic_cols = indic_cols, miss_val = miss_val,
+                                       output_format = output_format):
+            results.append(result)
+            if result.error is None:
+                flash(f"{result.file.split(os.sep)[-1]} has been processed and saved to the Outputs folder")
+                tracker.update(columns = result.columns)
+            else:
+                tracker.update()
+
+        tracker.finish()
+    # In the order of the files
+    position = {file: i for i, file in enumerate(files)}
+    results.sort(key = lambda result: position[result.file])
+
+    return report_errors(results)
+
+def preprocess_fitbir(files, output_folder, column_mapping, column_scaling, split_cols = None, split_all = False,
+                      num_suffixes = 1, drop_cols = None, drop_na_cols = True, scale_cols = False,
+                      change_cols = False, indic_cols = 'ALL', miss_val = '', group_cols = None, make_list = False,
+                      output_format = 'csv', workers = PREPROCESS_WORKERS):
+    '''
+    Preprocesses each FITBIR file and saves it to the output folder as processed_<file name>.
+    The files are preprocessed by workers processes. A file that fails doesn't stop the others:
+    its error is sent to the user.
+
+    Parameters
+    -----------
+    files: a list - paths of the FITBIR files
+    output_folder: a str - where the processed files are saved
+    column_mapping: a dict - FITBIR column name -> NDA column name
+    column_scaling: a dict - FITBIR column name -> scaling rule to match NDA (or its alignment_rules.AlignmentPlan)
+    split_cols: a list or None - columns whose names are split on the periods
+    split_all: a bool - split the names of all the columns
+    num_suffixes: an int - number of parts of the names to keep when splitting
+    drop_cols: a list or None - columns to remove
+    drop_na_cols: a bool - remove the empty columns
+    scale_cols: a bool - scale the values to match NDA
+    change_cols: a bool - use the NDA column names
+    indic_cols: a str - ';' separated columns to handle missing data in ('ALL' for every column)
+    miss_val: a str - ';' separated values to use for the missing data
+    group_cols: a list or None - columns to flatten the repeated rows on (None to not flatten)
+    make_list: a bool - save the columns that could not be flattened to a separate file
+    output_format: a str - csv, gzip, zstd or parquet (csv_columns.OUTPUT_FORMATS)
+    workers: an int or None - most processes preprocessing the files (None for one at a time)
+
+    Returns
+    -----------
+    outputs: a list - paths of the processed files
+    '''
+    report_file = os.path.join(output_folder, 'preprocess_fitbir_profile.json')
+    results = []
+    with profile_run('preprocess FITBIR', report_file, files = len(files), workers = workers):
+        tracker = Tracker('preprocess', total = len(files), unit = 'files')
+        for result in preprocess_files(preprocess_fitbir_file, files, column_mapping, column_scaling,
+                                       alignment_rules.FITBIR_TO_NDA if scale_cols else None, workers,
+                                       output_folder = output_folder, split_cols = split_cols,
+                                       split_all = split_all, num_suffixes = num_suffixes, drop_cols = drop_cols,
+                                       drop_na_cols = drop_na_cols, scale_cols = scale_cols,
+                                       change_cols = change_cols, indic_cols = indic_cols, miss_val = miss_val,
+                                       group_cols = group_cols, make_list = make_list,
+                                       output_format = output_format):
+            results.append(result)
+            if result.error is None:
+                logging.info(f"{result.file} has been processed and saved to the Outputs folder")
+                flash(f"{result.file} has been processed and saved to the Outputs folder")
+                tracker.update(columns = result.columns)
+            else:
+                tracker.update()
+
+        tracker.finish()
+    # In the order of the files
+    position = {file: i for i, file in enumerate(files)}
+    results.sort(key = lambda result: position[result.file])
+
+    return report_errors(results)
+
+def merge_transform(files, savename, id_col, date_col, bind, savecols, ti, prefix, aggfunc, intindc, incremental = False,
+                    workers = None):
+    ''' Merges the files (read by workers processes, if given) and converts the merged data from long to wide format '''
+    start = time.time()
+    logging.info("Going to Merge and Transform")
+    flash("Going to Merge and Transform")
+
+    ### Run the merge and transform pipeline
+    with profile_run('merge and transform', report_name(savename), files = len(files), bind = bind,
+                     incremental = incremental, workers = workers):
+        mcsvs.main(files, savename, id_col, savecols, bind, date_col=date_col, l2w = True, suffix = prefix, ti = ti,
+                   aggfunc = aggfunc, intindc = intindc, incremental = incremental, workers = workers)
+
+    logging.info("Merge and transform complete. Open file in the \'Outputs\' folder")
+    flash("Merge and transform complete. Open file in the \'Outputs\' folder")
+    report_time("merge and transfrom", start)
+
+    return [savename]
+
+def merge(files, savename, id_col, date_col, bind, incremental = False, workers = None):
+    ''' Merges the files (read by workers processes, if given) '''
+    start = time.time()
+    logging.info("Going to Merge...")
+    flash("Going to Merge")
+
+    ### Run merge pipeline section
+    with profile_run('merge', report_name(savename), files = len(files), bind = bind, incremental = incremental,
+                     workers = workers):
+        mcsvs.main(files, savename, id_col, [], bind, date_col=date_col, l2w = False, suffix = False, ti = False,
+                   aggfunc = False, incremental = incremental, workers = workers)
+
+    report_time("merge", start)
+    logging.info("Merge complete. Open file in the \'Outputs\' folder")
+    flash("Merge complete. Open file in the \'Outputs\' folder")
+
+    return [savename]
+
+def transform(file, savename, id_col, date_col, ti, suffix, intindc, savecols, aggfunc):
+    ''' Converts a file from long to wide format '''
+    start = time.time()
+    logging.info("Going to Transform...")
+    flash("Going to Transform...")
+
+    ### Run transform pipeline
+    with profile_run('transform', report_name(savename)):
+        tracker = Tracker('parse', total = 1, unit = 'files')
+        dd = lw.read_csv(file, id_col, date_col)
+        tracker.finish(1, keys = len(dd))
+        fdd, cols = lw.convert_long_to_wide(dd, ti, suffix, intindc, savecols, aggfunc=aggfunc)
+        lw.write_to_csv(fdd, cols, savename, id_col)
+
+    report_time("transfrom", start)
+    logging.info("Transformation complete. Open file in the \'Outputs\' folder")
+    flash("Transformation complete. Open file in the \'Outputs\' folder")
+
+    return [savename]
+
+def get_stats(file, savename, streaming = None, workers = STATS_WORKERS):
+    '''
+    Saves the descriptive statistics of each column in the file. With streaming, the file
+    is read in chunks (see stats_stream); None uses streaming for files over STREAM_STATS_BYTES.
+    Otherwise the columns of files with enough values are split between the worker processes.
+    '''
+    logging.info("Getting stats...")
+    flash("Getting Stats...")
+
+    if streaming is None:
+        streaming = os.path.getsize(file) > STREAM_STATS_BYTES
+
+    ### Run stats pipeline
+    with profile_run('stats', report_name(savename), streaming = streaming, workers = workers):
+        if streaming:
+            flash("Reading the file in chunks: the median, percentiles and unique values of large columns are approximate")
+            sdd = stats_stream.stream_stats(file)
+        else:
+            tracker = Tracker('parse', total = 1, unit = 'files')
+            sd = pstats.read_csv(file)
+            tracker.finish(1, columns = len(sd))
+            sdd = pstats.make_stats_dict_from_file(sd, workers = workers)
+        pstats.dict_to_csv(sdd, savename)
+    logging.info("Complete. Open stats file in the \'Outputs\' folder")
+    flash("Complete. Open stats file in the \'Outputs\' folder")
+
+    return [savename]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Preprocesses NDA or FITBIR files, like the Preprocess pages.")
+    parser.add_argument('source', choices = ['nda', 'fitbir'], help = "the database the files come from")
+    parser.add_argument('files', nargs = '+')
+    parser.add_argument('--output', default = 'Outputs', help = "folder the processed files are saved to")
+    parser.add_argument('--alignment', default = os.path.join('database', 'aligned_first_element.db'),
+                        help = "the alignment database (for --scale and --change-cols)")
+    parser.add_argument('--workers', type = int, default = PREPROCESS_WORKERS, help = "number of processes")
+    parser.add_argument('--drop-cols', help = "';' separated columns to remove")
+    parser.add_argument('--keep-empty-cols', action = 'store_true', help = "don't remove the empty columns")
+    parser.add_argument('--scale', action = 'store_true', help = "scale the values to match the other database")
+    parser.add_argument('--change-cols', action = 'store_true', help = "use the column names of the other database")
+    parser.add_argument('--indic-cols', default = 'ALL', help = "';' separated columns to create indicators for")
+    parser.add_argument('--miss-val', default = '', help = "';' separated values to consider as missing")
+    parser.add_argument('--format', choices = list(csv_columns.OUTPUT_FORMATS), default = 'csv')
+    # FITBIR only
+    parser.add_argument('--split-cols', help = "';' separated columns whose names are split on the periods")
+    parser.add_argument('--split-all', action = 'store_true', help = "split the names of all the columns")
+    parser.add_argument('--num-suffixes', type = int, default = 1, help = "parts of the split names to keep")
+    parser.add_argument('--group-cols', help = "';' separated columns to flatten the repeated rows on")
+    parser.add_argument('--make-list', action = 'store_true', help = "save the columns that can't be flattened")
+    args = parser.parse_args(argv)
+
+    direction = alignment_rules.NDA_TO_FITBIR if args.source == 'nda' else alignment_rules.FITBIR_TO_NDA
+    column_mapping, column_scaling = {}, {}
+    if args.scale or args.change_cols:
+        table = AlignmentRepository(args.alignment).get(direction)
+        column_mapping, column_scaling = table.column_mapping, table.column_scaling
+    os.makedirs(args.output, exist_ok = True)
+    drop_cols = args.drop_cols.split(';') if args.drop_cols else None
+
+    # Print the messages sent to the user
+    progress.set_listener(lambda event, **fields: print(fields['message']) if event == 'message' else None)
+    options = dict(drop_cols = drop_cols, drop_na_cols = not args.keep_empty_cols, scale_cols = args.scale,
+                   change_cols = args.change_cols, indic_cols = args.indic_cols, miss_val = args.miss_val,
+                   output_format = args.format, workers = args.workers)
+    if args.source == 'nda':
+        outputs = preprocess_nda(args.files, args.output, column_mapping, column_scaling, **options)
+    else:
+        outputs = preprocess_fitbir(args.files, args.output, column_mapping, column_scaling,
+                                    split_cols = args.split_cols.split(';') if args.split_cols else None,
+                                    split_all = args.split_all, num_suffixes = args.num_suffixes,
+                                    group_cols = args.group_cols.split(';') if args.group_cols else None,
+                                    make_list = args.make_list, **options)
+
+    return outputs
+
+if __name__ == '__main__':
+    logging.basicConfig(level = logging.WARNING)
+    main(sys.argv[1:])
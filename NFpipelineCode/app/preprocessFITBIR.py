@@ -25,6 +25,11 @@ from dateutil.parser import parse
 from datetime import datetime
 import ast
 import logging
+import csv_detect
+import csv_columns
+import indicators
+import flatten
+import alignment_rules
 
 class FITBIRdataset:
 
@@ -184,22 +189,15 @@ class FITBIRdataset:
     def read_csv(self, file):
         #''' Reads the file that you want to process '''
 
-        with open(file, 'r') as fin:
-
-            sniffer = csv.Sniffer()
-            dialect = sniffer.sniff(fin.readline())
-            fin.seek(0)
-            delim = str(dialect.delimiter)
-            reader = csv.DictReader(fin, delimiter = delim)
-
-            #data = defaultdict(list)
-            for row in reader:
-
-                for key, value in row.items():
-                    # Keys are the columns in the data
-
-                    self.dataset[key].append(value)
-
+        # Delimiter is cached between runs
+        delim = csv_detect.detect(file).delimiter
+        # Parsed into lists by column, like adding each row of csv.DictReader
+        columns = csv_columns.read_columns(file, delim)
+        if self.dataset:
+            for key, values in columns.items():
+                self.dataset[key].extend(values)
+        else:
+            self.dataset = columns
 
         return self
 
@@ -296,14 +294,12 @@ class FITBIRdataset:
         return self
 
     def convert_scaling_to_nda(self, converter):
-
-        # get
-        # Check the operator first
-        for data_element in self.dataset.keys():
-            # Only scale the matched items
-            if data_element in converter.keys():
-                # Convert the values in the dataset
-                self._convert(data_element, converter)
+        '''
+        converter is the column_scaling dict or its compiled alignment_rules.AlignmentPlan.
+        The plan applies the same rules as _convert, a column at a time.
+        '''
+        plan = alignment_rules.compile_plan(converter, alignment_rules.FITBIR_TO_NDA)
+        plan.apply(self.dataset)
 
         return self
 
@@ -327,29 +323,28 @@ class FITBIRdataset:
 
         return self
 
-    def find_bad_columns(self, fill_cols):
-
-        df = pd.DataFrame(self.dataset).replace({'': np.nan})
-
-        for fc in fill_cols:
-            if fc in df.columns:
-                df[fc] = df[fc].fillna(method='ffill')
-
-
-
-        use_cols = [dcol for f in fill_cols for dcol in df.columns \
-                    if dcol.endswith(f)]
-        cols = []
-        for _, group in df.groupby(use_cols):
-            if len(group) > 1:
-                for col in group.columns:
+    def handle_missing_values(self, cols, vals):
+        '''
+        Adds the indicator columns of every column and missing value (handle_missing_data for each
+        column and then each value), comparing all the columns at once. The indicators are uint8 arrays.
+        '''
+        # 'nan' and 'na' are the empty values, like in handle_missing_data
+        vals = ['' if isinstance(val, str) and val.lower() in ['nan', 'na'] else val for val in vals]
+        indicators.add_missing_indicators(self.dataset, cols, vals, self.handle_missing_data)
 
-                    if (np.sum(group[col].notnull()) > 1) and (col not in fill_cols):
+        return self
 
-                        if col not in cols:
-                            cols.append(col)
+    def find_bad_columns(self, fill_cols):
+        '''
+        Finds the columns with more than one value in a group of rows (grouped by the columns ending
+        with the fill_cols, after filling the fill_cols forward), with one count of each group.
 
-        return cols, use_cols
+        Returns
+        -----------
+        cols: a list - the bad columns
+        use_cols: a list - the columns grouped by
+        '''
+        return flatten.find_repeated_columns(self.dataset, fill_cols)
 
     def fix_bad_columns(self, make_list, bad_cols, use_cols, path):
 
@@ -358,68 +353,22 @@ class FITBIRdataset:
         -----------
         make_list: a boolean - if True, remove the bad columns from the dateset
                                and save in a separate file
-        group_cols: a list - columns to group by
+        bad_cols: a list - the columns with more than one value in a group
+        use_cols: a list - columns grouped by
 
         Returns
         -----------
         self
         '''
-
-        df = pd.DataFrame(self.dataset).replace({'': np.nan})
-        guid_col = df.filter(regex = '[gGuUiIdD]').columns[0]
-
-        if df[guid_col].isnull().any():
-
-            #bad_cols, use_cols = self.dataset.find_bad_columns(group_cols)
-
-            #print(use_cols)
-
-            if make_list:
-                df[[guid_col] + bad_cols].to_csv(path + '{0}Outputs{0}'.format(os.sep) + "list_columns.csv", index = False)
-
-                df.drop(bad_cols, axis = 1, inplace = True)
-
-            else:
-                df[bad_cols] = df[bad_cols].astype(str)
-
-                ndf = df[[guid_col] + bad_cols].fillna(method='ffill').groupby(guid_col).transform(lambda x: ';'.join(x))
-
-                df[bad_cols] = ndf[bad_cols]
-
-                df.drop_duplicates(inplace = True)
-
-
-            df.dropna(how = 'all', axis = 0, inplace = True)
-            df.dropna(axis = 0, subset = [guid_col], inplace = True)
-            ddict = df.to_dict()
-
-            self.dataset = {col: [val for val in ddict[col].values()] for col in ddict}
-
+        list_file = path + '{0}Outputs{0}'.format(os.sep) + "list_columns.csv"
+        self.dataset = flatten.flatten_rows(self.dataset, bad_cols, make_list, list_file)
 
         return self
 
 
 
-    def to_csv(self, savefile):
-
-        with open(savefile, 'w') as fout:
-
-            writer = csv.writer(fout, lineterminator = '\n')#, fieldnames = list(self.dataset.keys()))
-
-            #writer.writeheader()
-
-            super_data = [self.dataset[col] for col in self.dataset.keys()]
-
-            row_data = list(zip(*super_data))
-
-            rnum = 0
-            for row in row_data:
-
-                # Write column names
-                if rnum == 0:
-                    writer.writerow(list(self.dataset.keys()))
-                #else:
-                writer.writerow(row)
-                rnum += 1
-
-        return
+    def to_csv(self, savefile, output_format = 'csv'):
+        '''
+        Writes the data set row by row (output_format: csv, gzip, zstd or parquet) and returns the name of the file
+        '''
+        return csv_columns.write_columns(savefile, self.dataset, output_format)
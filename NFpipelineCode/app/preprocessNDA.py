@@ -26,6 +26,10 @@ from datetime import datetime
 import ast
 import pprint
 import logging
+import csv_detect
+import csv_columns
+import indicators
+import alignment_rules
 
 class NDAdataset:
 
@@ -260,22 +264,15 @@ class NDAdataset:
     def read_csv(self, file):
         # Reads the file that you want to process
 
-        with open(file, 'r') as fin:
-
-            sniffer = csv.Sniffer()
-            dialect = sniffer.sniff(fin.readline())
-            fin.seek(0)
-            delim = str(dialect.delimiter)
-            reader = csv.DictReader(fin, delimiter = delim)
-
-            #data = defaultdict(list)
-            for row in reader:
-
-                for key, value in row.items():
-                    # Keys are the columns in the data
-
-                    self.dataset[key].append(value)
-
+        # Delimiter is cached between runs
+        delim = csv_detect.detect(file).delimiter
+        # Parsed into lists by column, like adding each row of csv.DictReader
+        columns = csv_columns.read_columns(file, delim)
+        if self.dataset:
+            for key, values in columns.items():
+                self.dataset[key].extend(values)
+        else:
+            self.dataset = columns
 
         return self
 
@@ -343,13 +340,12 @@ class NDAdataset:
         return self
 
     def convert_scaling_to_fitbir(self, converter):
-
-        # Check the operator first
-        for data_element in list(self.dataset): # uses list because the size of the dictionary changes in the loop
-            # Only scale the matched items
-            if data_element in converter.keys():
-                # Convert the values in the dataset
-                self._convert(data_element, converter)
+        '''
+        converter is the column_scaling dict or its compiled alignment_rules.AlignmentPlan.
+        The plan applies the same rules as _convert, a column at a time.
+        '''
+        plan = alignment_rules.compile_plan(converter, alignment_rules.NDA_TO_FITBIR)
+        plan.apply(self.dataset)
 
         return self
 
@@ -365,28 +361,19 @@ class NDAdataset:
 
         return self
 
+    def handle_missing_values(self, cols, vals):
+        '''
+        Adds the indicator columns of every column and missing value (handle_missing_data for each
+        column and then each value), comparing all the columns at once. The indicators are uint8 arrays.
+        '''
+        indicators.add_missing_indicators(self.dataset, cols, vals, self.handle_missing_data)
 
+        return self
 
-    def to_csv(self, savefile):
-
-        with open(savefile, 'w') as fout:
-
-            writer = csv.writer(fout, lineterminator = '\n')#, fieldnames = list(self.dataset.keys()))
-
-            #writer.writeheader()
-
-            super_data = [self.dataset[col] for col in self.dataset.keys()]
-
-            row_data = list(zip(*super_data))
-
-            rnum = 0
-            for row in row_data:
-
-                # Write column names
-                if rnum == 0:
-                    writer.writerow(list(self.dataset.keys()))
 
-                writer.writerow(row)
-                rnum += 1
 
-        return
+    def to_csv(self, savefile, output_format = 'csv'):
+        '''
+        Writes the data set row by row (output_format: csv, gzip, zstd or parquet) and returns the name of the file
+        '''
+        return csv_columns.write_columns(savefile, self.dataset, output_format)
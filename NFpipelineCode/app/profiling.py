@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module records the wall time, CPU time, peak memory and row/column counts of each stage of a
+pipeline run (header scan, parse, merge, remove empty columns, long to wide, write, stats, ...) and saves them
+as a JSON run report. The stages are recorded by the progress.Tracker of each stage.
+
+The peak memory of a stage is the peak from its start to its end: the peak of the process is reset when a
+stage starts (after adding it to the peaks of the stages still running). Where it can't be reset, the stages
+have rss_high_water_mb instead, the highest memory of the process so far (including the stages before).
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Profile of the run in progress (None when no run is being profiled)
+_profile = None
+
+
+def reset_peak_rss():
+    '''
+    Resets the peak memory of the process (Linux only), so the peaks of a run
+    don't include the runs done before by the same (job) process.
+    Returns True if it was reset.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as fout:
+            fout.write('5')
+    except OSError:
+        return False
+
+    return True
+
+def peak_rss_mb():
+    ''' Returns the highest resident memory of the process so far in MB, or None if unknown '''
+    try:
+        with open('/proc/self/status', 'r') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB on Linux
+    if sys.platform == 'darwin':
+        return peak / (1024 * 1024)
+
+    return peak / 1024
+
+
+class RunProfile:
+    '''
+    The stages of one pipeline run, in the order they first finished.
+    A stage that runs more than once (for example, 'write') adds up its times and counts.
+
+    Stages can overlap: when files are read while they are merged,
+    the 'parse' time is also part of the 'merge' time.
+    '''
+
+    def __init__(self, name, **settings):
+
+        self.name = name
+        self.settings = settings
+        self.stages = {}
+        self.start = time.time()
+        self.cpu_start = time.process_time()
+        self.peak_was_reset = reset_peak_rss()
+        # Name of the memory field of the stages
+        self.peak_key = 'peak_rss_mb' if self.peak_was_reset else 'rss_high_water_mb'
+        # Highest peak of the run, and of each stage still running
+        self.peak = None
+        self.running = {}
+
+    def update_peaks(self):
+        ''' Adds the peak of the process (since the last reset) to the peak of the run and of the running stages '''
+        peak = peak_rss_mb()
+        if peak is not None:
+            self.peak = max(filter(None, [self.peak, peak]))
+            for started, high in self.running.items():
+                self.running[started] = max(filter(None, [high, peak]))
+
+        return peak
+
+    def start_stage(self):
+        ''' Starts the peak memory of a stage. Returns the key of the stage for record. '''
+        self.update_peaks()
+        if self.peak_was_reset:
+            reset_peak_rss()
+        started = object()
+        self.running[started] = None
+
+        return started
+
+    def record(self, stage, wall, cpu, started = None, **counts):
+        '''
+        Adds a run of a stage that took wall seconds (cpu seconds of CPU time).
+        The peak memory is the peak since started (from start_stage), or the peak of the run so far.
+        '''
+        entry = self.stages.setdefault(stage, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+        entry['calls'] += 1
+        entry['wall_s'] += wall
+        entry['cpu_s'] += cpu
+        for key, value in counts.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                entry[key] = entry.get(key, 0) + value
+            else:
+                entry[key] = value
+        self.update_peaks()
+        peak = self.running.pop(started) if started in self.running else self.peak
+        # The highest peak of the runs of the stage
+        entry[self.peak_key] = max(filter(None, [entry.get(self.peak_key), peak]), default = None)
+
+        return self
+
+    def add_stages(self, stages):
+        ''' Adds the stages recorded by another process (for example, a worker preprocessing a file) '''
+        for stage, counts in stages.items():
+            entry = self.stages.setdefault(stage, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+            for key, value in counts.items():
+                if key in ('peak_rss_mb', 'rss_high_water_mb'):
+                    # The highest peak of the processes
+                    entry[key] = max(filter(None, [entry.get(key), value]), default = None)
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    entry[key] = entry.get(key, 0) + value
+                else:
+                    entry[key] = value
+
+        return self
+
+    def report(self):
+        ''' Returns the run report as a JSON serializable dict '''
+        return {'name': self.name,
+                'settings': self.settings,
+                'started': self.start,
+                'wall_s': time.time() - self.start,
+                'cpu_s': time.process_time() - self.cpu_start,
+                'peak_rss_mb': max(filter(None, [self.peak, self.update_peaks()]), default = None),
+                # Without the reset, the peaks include earlier runs of the same process
+                # and the stages have the cumulative rss_high_water_mb
+                'peak_rss_reset': self.peak_was_reset,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'stages': self.stages}
+
+    def save(self, filename):
+        with open(filename, 'w') as fout:
+            json.dump(self.report(), fout, indent = 2)
+
+        return self
+
+
+def start_stage():
+    ''' Starts the peak memory of a stage in the run being profiled. Returns the key to pass to record. '''
+    if _profile is not None:
+        return _profile.start_stage()
+
+    return None
+
+def record(stage, wall, cpu, started = None, **counts):
+    ''' Records a stage in the run being profiled, if there is one '''
+    if _profile is not None:
+        _profile.record(stage, wall, cpu, started, **counts)
+
+    return
+
+def add_stages(stages):
+    ''' Adds the stages recorded by another process to the run being profiled, if there is one '''
+    if _profile is not None:
+        _profile.add_stages(stages)
+
+    return
+
+def timed(stage, items):
+    '''
+    Yields the items, recording the time spent producing them (for example,
+    reading the rows of a file) as the stage. Only the time inside the iterator
+    is counted, not the time the caller spends on each item.
+    '''
+    wall = cpu = 0.0
+    n = 0
+    items = iter(items)
+    started = start_stage()
+    try:
+        while True:
+            w, c = time.time(), time.process_time()
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            finally:
+                wall += time.time() - w
+                cpu += time.process_time() - c
+            n += 1
+            yield item
+    finally:
+        record(stage, wall, cpu, started, items = n)
+
+@contextmanager
+def profile_run(name, report_file = None, **settings):
+    '''
+    Profiles the stages run inside the with block and saves the run report to report_file
+    (if given), even if the run fails.
+
+    Example
+    -----------
+    with profile_run('merge', 'Outputs/merged_profile.json', bind = 'row'):
+        merge_csvs.main(...)
+    '''
+    global _profile
+    previous = _profile
+    _profile = RunProfile(name, **settings)
+    try:
+        yield _profile
+    finally:
+        profile, _profile = _profile, previous
+        if report_file is not None:
+            try:
+                profile.save(report_file)
+                logging.info(f"Saved the run report to {report_file}")
+            except OSError as e:
+                logging.info(f"Could not save the run report: {e}")
+
+def report_name(filename):
+    ''' Name of the run report saved next to an output file: <name>_profile.json '''
+    return os.path.splitext(str(filename))[0] + '_profile.json'
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module sends the messages and progress of the pipeline to the user. Inside a web request the
+messages are flashed like before. Inside a background job (where there is no request) they are passed to the job
+as events, together with structured progress events (files read, rows merged, bytes written, ETA, ...).
+The finished stages are also recorded in the run report of the profiling module.
+"""
+import time
+
+import profiling
+
+from flask import has_request_context
+from flask import flash as flask_flash
+
+# Function called as listener(event, **fields) for each event sent outside of a request (set by the jobs module)
+_listener = None
+
+# Minimum number of seconds between two progress events of the same stage
+PROGRESS_INTERVAL = 1.0
+
+
+def set_listener(listener):
+    ''' Sets the function called with each event sent outside of a request. None removes it. '''
+    global _listener
+    _listener = listener
+
+    return
+
+def emit(event, **fields):
+    ''' Sends a structured event to the listener, if there is one '''
+    if _listener is not None:
+        _listener(event, **fields)
+
+    return
+
+def flash(message, category = 'message'):
+    '''
+    Drop-in replacement for flask.flash that is safe to call outside of a request.
+    Without a request, the message goes to the listener (if there is one).
+    '''
+    if has_request_context():
+        flask_flash(message, category)
+    else:
+        emit('message', message = message)
+
+    return
+
+
+class Tracker:
+    '''
+    Follows the progress of a pipeline stage and sends 'progress' events with the
+    amount done, the total, the rate and an estimate of the time left.
+
+    Example
+    -----------
+    tracker = Tracker('read', total = len(files), unit = 'files')
+    for file in files:
+        ...
+        tracker.update(rows = nrows)
+    tracker.finish()
+    '''
+
+    def __init__(self, stage, total = None, unit = 'items'):
+
+        self.stage = stage
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        # Other counts of the stage (rows, columns, bytes...)
+        self.counts = {}
+        self.start = time.time()
+        self.cpu_start = time.process_time()
+        self.started = profiling.start_stage()
+        self._last = 0
+
+    def eta(self):
+        ''' Seconds left, estimated from the rate so far. None if unknown. '''
+        if not self.total or not self.done:
+            return None
+        elapsed = time.time() - self.start
+
+        return elapsed / self.done * (self.total - self.done)
+
+    def update(self, n = 1, **counts):
+        ''' Adds n to the amount done and the counts to the stage totals '''
+        self.done += n
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+        # Don't send more than one event per interval
+        now = time.time()
+        if now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self.send()
+
+        return self
+
+    def send(self, finished = False):
+        elapsed = time.time() - self.start
+        emit('progress', stage = self.stage, done = self.done, total = self.total, unit = self.unit,
+             elapsed = elapsed, eta = 0 if finished else self.eta(), finished = finished, **self.counts)
+
+        return self
+
+    def finish(self, n = 0, **counts):
+        ''' Adds n and the counts, records the stage in the run report and sends the final event of the stage '''
+        self.done += n
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+        profiling.record(self.stage, time.time() - self.start, time.process_time() - self.cpu_start, self.started,
+                         **{self.unit: self.done, **self.counts})
+
+        return self.send(finished = True)
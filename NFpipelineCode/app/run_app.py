@@ -24,7 +24,6 @@ from flask_wtf import Form
 from werkzeug import secure_filename
 from forms import *
 import csv
-import sqlite3 as sql
 import pandas as pd
 import os
 import glob
@@ -44,6 +43,12 @@ import scrape_NDA_data_dictionary as scrapeNDA
 import scrape_FITBIR_data_dictionary as scrapeFITBIR
 import scrape_all_NDA as scrapeNDAall
 import scrape_all_fitbir_dictionaries as scrapeFITBIRall
+from column_registry import ColumnRegistry
+from alignment_repository import AlignmentRepository
+import alignment_rules
+import pipeline_tasks as tasks
+import jobs
+import gevent
 from preprocessNDA import *
 from preprocessFITBIR import *
 
@@ -129,6 +134,9 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 app.secret_key = os.urandom(24)
 
+# Background jobs for the long pipeline steps
+job_queue = jobs.JobQueue()
+
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app_dash = dash.Dash(
@@ -138,22 +146,11 @@ app_dash = dash.Dash(
     external_stylesheets = external_stylesheets
 )
 
-### Connect to the Aligned SQLite Database
-def get_db_connection():
-    conn = None
-    try: # Try to connect
-        #str(new_path) + os.sep + 'databases' + os.sep
-        conn = sql.connect(database_path)
-        logging.info('Connected to database...')
-        temp_cursor = conn.execute("SELECT * FROM alignment")
-        logging.info('Selected all from database...')
-        names = list(map(lambda x: x[0], temp_cursor.description))
-        #print(names)
-    except Exception as e:
-        logging.info(e)
-        print(e)
+### Output formats of the preprocessing forms
+OUTPUT_FORMATS = {'value1': 'csv', 'value2': 'gzip', 'value3': 'zstd', 'value4': 'parquet'}
 
-    return conn
+### The alignment table of the Aligned SQLite Database
+alignment = AlignmentRepository(database_path)
 
 
 ### Deprecated Bokeh visualizations in favor of Dash ###
@@ -393,124 +390,40 @@ def ppNDA():
     #print(dir(request))
     form = processNDA(request.form)
 
-    # Load the alignment names into a dictionary
-
-    con = get_db_connection()
-    con.row_factory = sql.Row
-    cur = con.cursor()
-    cur.execute('SELECT NDA_Element, FITBIR_Element, NF_Condition1, NF_Condition2, \
-                NF_Operator, NF_formula FROM alignment')
-
-    column_mapping = dict()
-    column_scaling = dict()
-    for row in cur.fetchall():
-        if row['NDA_Element'].strip() not in column_mapping.keys():
-            column_mapping[row['NDA_Element'].strip()] = row['FITBIR_Element'].strip()
-            # Do the same for scaling
-            # Need to make the keys the same for scaling, since the conditions
-            # are based on the FITBIR names
-            column_scaling[row['NDA_Element'].strip()] = {
-                                                            'FITBIR_Element': row['FITBIR_Element'].strip(),
-                                                            'Condition1': row['NF_Condition1'],
-                                                            'Condition2': row['NF_Condition2'],
-                                                            'Operator': row['NF_Operator'],
-                                                            'Formula': row['NF_formula']
-                                                            }
-    con.close()
+    # The alignment names and scaling rules (loaded once, read again if the database changes)
+    table = alignment.get(alignment_rules.NDA_TO_FITBIR)
+    column_mapping = table.column_mapping
+    column_scaling = table.column_scaling
 
     # Display the following paths in the application
     #flash(application_path)
     #flash(database_path)
     #flash(new_path)
     #flash(UPLOAD_FOLDER)
+    job_id = None
     if form.execute.data:
         logging.info(UPLOAD_FOLDER)
         datafiles = glob.glob(f'{UPLOAD_FOLDER}{os.sep}*.[ct]*')
 
-        for file in datafiles:
-
-
-            pnda = NDAdataset()
-            logging.info("Initialized dataset")
-            # Read csv file
-            pnda.read_csv(file)
-            logging.info("Read file")
-            # Remove certain columns
-            remove_choice = form.remove.data
-            #remove_choices = form.remove.choices
-            #for name, val in remove_choices:
-            #    if name == remove_choice:
-            #        if val == 'Yes':
-
-
-            if remove_choice == 'value1':
-                drop_cols = form.drop_cols.data.split(';')
-                #print(drop_cols)
-                pnda.remove_cols(drop_cols)
-                logging.info("removed some columns")
-
-            # Collect the metadata
-            metadata = pnda.collect_metadata()
-            logging.info("collected metadata")
-            # Write metadata to file
-            with open(f'{new_path}{os.sep}Outputs{os.sep}metadata_{file.split(os.sep)[-1]}', 'w') as fout:
-                writer = csv.DictWriter(fout, fieldnames = ['Variable', 'Description'])
-                writer.writeheader()
-                for key, value in metadata.items():
-                    writer.writerow({'Variable': key, 'Description': value})
-
-            logging.info("wrote metadata to file")
-            # Remove empty columns
-            na_choice = form.drop_na_cols.data
-            if na_choice == 'value1':
-                logging.info("Dropped empty columns")
-                pnda.remove_empty_cols()
-
-            # Scale to match values in FITBIR
-            scale_choice = form.scale_cols.data
-            if scale_choice == 'value1':
-                logging.info("Scaling to match FITBIR...")
-                pnda.convert_scaling_to_fitbir(column_scaling)
-
-            # Change column names to match FITBIR's (do AFTER scaling!)
-            change_choice = form.change_cols.data
-            if change_choice == 'value1':
-                pnda.change_cols_to_fitbir(column_mapping)
-                logging.info("Using FITBIR column names!")
-
-            # Create indicator columns
-            no_cols = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', \
-                        '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null', 'none']
-
-            no_cols = list(map(lambda x: x.lower(), no_cols))
-
-            if form.indic_cols.data.lower() != 'all':
-                if form.indic_cols.data.lower() in no_cols:
-                    indicator_cols = []
-                else:
-                    indicator_cols = form.indic_cols.data.split(';')
-            else:
-                indicator_cols = list(pnda.dataset.keys())
-
-            logging.info(indicator_cols)
-
-            # Handle missing data
-            #if form.miss_val.data != 'NA'.lower():
-
-            use_vals = form.miss_val.data.split(';')
-            if indicator_cols != []:
-                for col in indicator_cols:
-                    for use_val in use_vals:
-                        pnda.handle_missing_data(col, use_val)
-
-            # Save the processed data set
-            savename = str(new_path) + '{0}Outputs{0}'.format(os.sep) + 'processed_' + file.split(os.sep)[-1]
-            pnda.to_csv(savename)
-
-            flash(f"{file.split(os.sep)[-1]} has been processed and saved to the Outputs folder")
-            #Response(generate(), mimetype= 'text/event-stream')
-
-    return render_template('process_nda.html', form = form)
+        # Remove certain columns
+        if form.remove.data == 'value1':
+            drop_cols = form.drop_cols.data.split(';')
+        else:
+            drop_cols = None
+
+        ### Run the preprocessing in the background
+        job_id = job_queue.submit("Preprocess NDA", tasks.preprocess_nda, datafiles, f'{new_path}{os.sep}Outputs',
+                                  column_mapping, column_scaling,
+                                  drop_cols = drop_cols,
+                                  drop_na_cols = form.drop_na_cols.data == 'value1',
+                                  scale_cols = form.scale_cols.data == 'value1',
+                                  change_cols = form.change_cols.data == 'value1',
+                                  indic_cols = form.indic_cols.data,
+                                  miss_val = form.miss_val.data,
+                                  output_format = OUTPUT_FORMATS[form.output_format.data])
+        flash(f"Preprocessing the NDA files in the background (job {job_id})")
+
+    return render_template('process_nda.html', form = form, job_id = job_id)
 
 
 @app.route("/preprocessFITBIR", methods = ['GET', 'POST'])
@@ -518,181 +431,60 @@ def ppFITBIR():
 
     form = processFITBIR(request.form)
 
-    # Load the alignment names into a dictionary
-    con = get_db_connection()
-    con.row_factory = sql.Row
-    cur = con.cursor()
-    cur.execute('SELECT NDA_Element, FITBIR_Element, FN_Condition1, FN_Condition2, \
-                FN_Operator, FN_formula FROM alignment')
-
-    column_mapping = dict()
-    column_scaling = dict()
-    for row in cur.fetchall():
-        if row['FITBIR_Element'].strip() not in column_mapping.keys():
-            column_mapping[row['FITBIR_Element'].strip()] = row['NDA_Element'].strip()
-            # Do the same for scaling
-            column_scaling[row['FITBIR_Element'].strip()] = {
-                                                            'Condition1': row['FN_Condition1'],
-                                                            'Condition2': row['FN_Condition2'],
-                                                            'Operator': row['FN_Operator'],
-                                                            'Formula': row['FN_formula']
-                                                            }
-
-    con.close()
+    # The alignment names and scaling rules (loaded once, read again if the database changes)
+    table = alignment.get(alignment_rules.FITBIR_TO_NDA)
+    column_mapping = table.column_mapping
+    column_scaling = table.column_scaling
 
+    job_id = None
     if form.execute.data:
 
         logging.info("FITBIR Preprocess Form has been executed.")
         datafiles = glob.glob(str(UPLOAD_FOLDER) + os.sep + '*.[ct]*')
 
-        for file in datafiles:
-            logging.info(file)
-            # IMPORTANT: we create a new object for each file because each
-            # file is processed separately.
-            # Create dataset object
-            pfitbir = FITBIRdataset()
-            # Read in CSV file
-            pfitbir.read_csv(file)
-
-            # Split cols based on periods
-            spc_choice = form.splitcols.data
-            spc_choices = form.splitcols.choices
-            for spc_name, spc_val in spc_choices:
-                if spc_name == spc_choice:
-                    if spc_val == 'Yes':
-
-            #if form.splitcols.data == 'Yes':
-
-                        # Keep certain parts of the column names
-                        num_suffixes = int(form.num_suffixes.data)
-                        split_columns = form.cols_to_split.data
-                        use_columns = split_columns.split(';')
-                        split_all = False
-                        logging.info("Split cols yes")
-                        #print(pfitbir.dataset)
-                        pfitbir.split_cols(use_columns, split_all, num_suffixes)
-                        logging.info("Splitted columns")
-                        #print(pfitbir.dataset)
-
-            # Split all the columns
-            sall_choice = form.splitall.data
-            sall_choices = form.splitall.choices
-            for sall_name, sall_val in sall_choices:
-                if sall_name == sall_choice:
-                    if sall_val == 'Yes':
-
-            #if form.splitall.data == 'Yes':
-                        # Keep certain parts of the column names
-                        num_suffixes = int(form.num_suffixes.data)
-
-                        split_all = True
-                        use_columns = list(pfitbir.dataset.keys())
-
-
-                        pfitbir.split_cols(use_columns, split_all, num_suffixes)
-
-            # Remove certain columns
-            rm_choice = form.remove.data
-            rm_choices = form.remove.choices
-            for rname, rval in rm_choices:
-                if rname == rm_choice:
-                    if rval == 'Yes':
-                        drop_cols = form.drop_cols.data
-                        drop_cols = drop_cols.split(';')
-                        pfitbir.remove_cols(drop_cols)
-
-            #if form.remove.data == 'Yes':
-
-            #    drop_cols = form.drop_cols.data
-
-            #    pfitbir.remove_cols(drop_cols)
-
-            # Drop empty columns
-            #print("NA COLUMNS")
-            #print(form.drop_na_cols.data)
-            #print(form.drop_na_cols.choices)
-            na_choice = form.drop_na_cols.data
-            na_choices = form.drop_na_cols.choices
-            for name, val in na_choices:
-                if name == na_choice:
-                    if val == 'Yes':
-                        #print("NA columns")
-                        pfitbir.remove_empty_cols()
-
-            # Scale to match values in NDA
-            scale_choice = form.scale_cols.data
-            if scale_choice == 'value1':
-                logging.info("Scaling to match NDA...")
-                pfitbir.convert_scaling_to_nda(column_scaling)
-
-            # Change column names to match NDA's
-            change_choice = form.change_cols.data
-            if change_choice == 'value1':
-                logging.info("Using NDA column names...")
-                pfitbir.change_cols_to_nda(column_mapping)
-
-
-
-            # Handle missing data
-            no_cols = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', \
-                        '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null', 'none']
-
-            no_cols = list(map(lambda x: x.lower(), no_cols))
-
-            # Create indicator columns
-            if form.indic_cols.data.lower() != 'all':
-                if form.indic_cols.data.lower() in no_cols:
-                    indicator_cols = []
-                else:
-                    indicator_cols = form.indic_cols.data.split(';')
-            else:
-                indicator_cols = list(pfitbir.dataset.keys())
-
-            # Replace values in columns
-            use_vals = form.miss_val.data.split(';')
-            if indicator_cols != []:
-                for col in indicator_cols:
-                    for use_val in use_vals:
-                        pfitbir.handle_missing_data(col, use_val)
-
-            # Make list file of unflattened columns
-            f_choice = form.flatten_cols.data
-            f_choices = form.flatten_cols.choices
-            for fname, fval in f_choices:
-                if fname == f_choice:
-                    f_val = fval
-
-            ml_choice = form.make_list.data
-            ml_choices = form.make_list.choices
-            for mlname, mlval in ml_choices:
-                if mlname == ml_choice:
-                    ml_val =  mlval
-
-            if f_val == 'Yes':
-
-                group_cols = form.group_cols.data.split(';')
-
-                # Check if they want to save the bad columns to a separate list
-                if ml_val == 'Yes':
-
-                    sprefix = str(new_path)
-                    bcols, ucols = pfitbir.find_bad_columns(group_cols)
-                    pfitbir.fix_bad_columns(True, bcols, ucols, sprefix)
-
-                else:
-                    sprefix = str(new_path)
+        # Split cols based on periods
+        if form.splitcols.data == 'value1':
+            split_cols = form.cols_to_split.data.split(';')
+        else:
+            split_cols = None
+        # Split all the columns
+        split_all = form.splitall.data == 'value1'
+        # Keep certain parts of the column names
+        if split_cols is not None or split_all:
+            num_suffixes = int(form.num_suffixes.data)
+        else:
+            num_suffixes = 1
 
-                    bcols, ucols = pfitbir.find_bad_columns(group_cols)
-                    pfitbir.fix_bad_columns(False, bcols, ucols, sprefix)
+        # Remove certain columns
+        if form.remove.data == 'value1':
+            drop_cols = form.drop_cols.data.split(';')
+        else:
+            drop_cols = None
 
-            # Save the data file to a new file
-            savename = str(new_path) + '{0}Outputs{0}'.format(os.sep) + 'processed_' + file.split(os.sep)[-1]
-            pfitbir.to_csv(savename)
-            logging.info(f"{file} has been processed and saved to the Outputs folder")
-            flash(f"{file} has been processed and saved to the Outputs folder")
+        # Flatten the repeated rows
+        if form.flatten_cols.data == 'value1':
+            group_cols = form.group_cols.data.split(';')
+        else:
+            group_cols = None
 
+        ### Run the preprocessing in the background
+        job_id = job_queue.submit("Preprocess FITBIR", tasks.preprocess_fitbir, datafiles, f'{new_path}{os.sep}Outputs',
+                                  column_mapping, column_scaling,
+                                  split_cols = split_cols,
+                                  split_all = split_all,
+                                  num_suffixes = num_suffixes,
+                                  drop_cols = drop_cols,
+                                  drop_na_cols = form.drop_na_cols.data == 'value1',
+                                  scale_cols = form.scale_cols.data == 'value1',
+                                  change_cols = form.change_cols.data == 'value1',
+                                  indic_cols = form.indic_cols.data,
+                                  miss_val = form.miss_val.data,
+                                  group_cols = group_cols,
+                                  make_list = form.make_list.data == 'value1',
+                                  output_format = OUTPUT_FORMATS[form.output_format.data])
+        flash(f"Preprocessing the FITBIR files in the background (job {job_id})")
 
-    return render_template('process_fitbir.html', form = form)
+    return render_template('process_fitbir.html', form = form, job_id = job_id)
 
 
 
@@ -700,7 +492,7 @@ def ppFITBIR():
 def merge_and_transform():
     ''' This is where the script to merge and transform the data is called. '''
     form = MergeTransForm(request.form)
-    start = time.time()
+    job_id = None
     if form.execute.data:
         #print(form.archive)
 
@@ -754,38 +546,22 @@ def merge_and_transform():
             savename = savename + '.csv'
 
         save = str(new_path) + '{0}Outputs{0}'.format(os.sep) + savename#"../Outputs/" + savename
-        #print(save)
-        #print(dir(form.archive))
-        logging.info("Going to Merge and Transform")
-        flash("Going to Merge and Transform")
-
-        ### Run the merge and transform pipeline
-        mcsvs.main(datafiles, save, idcol, save_cols, bind, date_col=datecol, l2w = True, suffix = prefix, ti = ti, aggfunc = aggfunc, intindc = intindc)
-
-        logging.info("Merge and transform complete. Open file in the \'Outputs\' folder")
-        flash("Merge and transform complete. Open file in the \'Outputs\' folder")
-        end = time.time()
-        total_time = end- start
-        if total_time/60 > 60:
-            logging.info("Total time to merge and transfrom: {:.5f} hours".format(total_time/3600))
-            flash("Total time to merge and transfrom: {:.5f} hours".format(total_time/3600))
-
-        elif (total_time/60 < 60) & (total_time > 60):
-            logging.info("Total time to merge and transfrom: {:.5f} minutes".format(total_time/60))
-            flash("Total time to merge and transfrom: {:.5f} minutes".format(total_time/60))
-        else:
-            logging.info("Total time to merge and transfrom: {:.5f} seconds".format(total_time))
-            flash("Total time to merge and transfrom: {:.5f} seconds".format(total_time))
+        incremental = form.incremental.data == 'value1'
 
-    return render_template('merge_transform.html', form = form)
+        ### Run the merge and transform pipeline in the background
+        job_id = job_queue.submit("Merge & Transform", tasks.merge_transform, datafiles, save, idcol, datecol, bind,
+                                  save_cols, ti, prefix, aggfunc, intindc, incremental = incremental)
+        flash(f"Merging and transforming in the background (job {job_id})")
+
+    return render_template('merge_transform.html', form = form, job_id = job_id)
     #return
 
 @app.route("/merge", methods = ["GET", "POST"])
 def merge():
     form = MergeForm(request.form)
+    job_id = None
     if form.execute.data: #request.method == "POST" and form.validate():
         #print(dir(form.archive))
-        start = time.time()
         # choice = form.archive.data
         # choices = form.archive.choices
         # for name, val in choices:
@@ -811,35 +587,20 @@ def merge():
         if '.' not in savename:
             savename = savename + '.csv'
         save = str(new_path) + '{0}Outputs{0}'.format(os.sep) + savename#"../Outputs/" + savename
-        logging.info("Going to Merge...")
-        flash("Going to Merge")
-
-        ### Run merge pipeline section
-        mcsvs.main(datafiles, save, idcol, [], bind, date_col=datecol, l2w = False, suffix = False, ti = False, aggfunc = False)
+        incremental = form.incremental.data == 'value1'
 
-        end = time.time()
-        total_time = end- start
-        if total_time/60 > 60:
-            logging.info("Total time to merge: {:.5f} hours".format(total_time/3600))
-            flash("Total time to merge: {:.5f} hours".format(total_time/3600))
+        ### Run merge pipeline section in the background
+        job_id = job_queue.submit("Merge", tasks.merge, datafiles, save, idcol, datecol, bind, incremental = incremental)
+        flash(f"Merging in the background (job {job_id})")
 
-        elif (total_time/60 < 60) & (total_time > 60):
-            logging.info("Total time to merge: {:.5f} minutes".format(total_time/60))
-            flash("Total time to merge: {:.5f} minutes".format(total_time/60))
-        else:
-            logging.info("Total time to merge: {:.5f} seconds".format(total_time))
-            flash("Total time to merge: {:.5f} seconds".format(total_time))
-
-        logging.info("Merge complete. Open file in the \'Outputs\' folder")
-        flash("Merge complete. Open file in the \'Outputs\' folder")
-    return render_template("merge.html", form = form)
+    return render_template("merge.html", form = form, job_id = job_id)
     #return
 
 @app.route("/transform", methods = ["GET", "POST"])
 def transform():
     form = TransForm(request.form)
+    job_id = None
     if form.execute.data:#request.method == "POST" and form.validate():
-        start = time.time()
         # choice = form.archive.data
         # choices = form.archive.choices
         # for name, val in choices:
@@ -876,54 +637,82 @@ def transform():
             savename = savename + '.csv'
         save = str(new_path) + '{0}Outputs{0}'.format(os.sep) + savename#"../Outputs/" + savename
 
-        logging.info("Going to Transform...")
-        flash("Going to Transform...")
-
-        ### Run transform pipeline
-        dd = lw.read_csv(datafiles[0], idcol, datecol)
-        fdd, cols = lw.convert_long_to_wide(dd, ti, suff, intindc, save_cols, aggfunc=aggfunc)
-        lw.write_to_csv(fdd, cols, save, idcol)
+        ### Run transform pipeline in the background
+        job_id = job_queue.submit("Transform", tasks.transform, datafiles[0], save, idcol, datecol, ti, suff,
+                                  intindc, save_cols, aggfunc)
+        flash(f"Transforming in the background (job {job_id})")
 
-        end = time.time()
-        total_time = end- start
-        if total_time/60 > 60:
-            logging.info("Total time to transfrom: {:.5f} hours".format(total_time/3600))
-            flash("Total time to transfrom: {:.5f} hours".format(total_time/3600))
-
-        elif (total_time/60 < 60) & (total_time > 60):
-            logging.info("Total time to transfrom: {:.5f} minutes".format(total_time/60))
-            flash("Total time to transfrom: {:.5f} minutes".format(total_time/60))
-        else:
-            logging.info("Total time to transfrom: {:.5f} seconds".format(total_time))
-            flash("Total time to transfrom: {:.5f} seconds".format(total_time))
-
-        logging.info("Transformation complete. Open file in the \'Outputs\' folder")
-        flash("Transformation complete. Open file in the \'Outputs\' folder")
-
-    return render_template("transform.html", form = form)
+    return render_template("transform.html", form = form, job_id = job_id)
     #return
 
 @app.route("/get_stats", methods = ["POST", "GET"])
 def get_stats():
 
     form = StatsForm(request.form)
+    job_id = None
     if form.execute.data:#request.method == "POST" and form.validate():
         files = glob.glob(str(UPLOAD_FOLDER) + os.sep + '*.[ct]*') #glob.glob(UPLOAD_FOLDER + '/*.[ct]*')
         savename = form.savename.data
         if '.' not in savename:
             savename = savename + '.csv'
         save = str(new_path) + '{0}Outputs{0}'.format(os.sep) + savename #"../Outputs/" + savename
-        logging.info("Getting stats...")
-        flash("Getting Stats...")
-
-        ### Run stats pipeline
-        sd = pstats.read_csv(files[0])
-        sdd = pstats.make_stats_dict_from_file(sd)
-        pstats.dict_to_csv(sdd, save)
-        logging.info("Complete. Open stats file in the \'Outputs\' folder")
-        flash("Complete. Open stats file in the \'Outputs\' folder")
-
-    return render_template("stats.html", form = form)
+        # None lets the task decide from the size of the file
+        streaming = {'value1': True, 'value2': False}.get(form.streaming.data)
+        ### Run stats pipeline in the background
+        job_id = job_queue.submit("Get Stats", tasks.get_stats, files[0], save, streaming = streaming)
+        flash(f"Collecting the stats in the background (job {job_id})")
+
+    return render_template("stats.html", form = form, job_id = job_id)
+
+### Status, progress and result of the background jobs
+@app.route("/jobs/<job_id>/status")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    return jsonify(job.status())
+
+@app.route("/jobs/<job_id>/progress")
+def job_progress(job_id):
+    ''' Messages of the job, starting at the index given by ?since= '''
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    since = request.args.get('since', 0, type = int)
+    # Get the state first, a finished job has written all its messages
+    state = job.state()
+
+    return jsonify({'state': state, 'messages': job.messages()[since:]})
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    ''' Server-sent events stream of the messages and progress of the job '''
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    # Continue after the last event the browser received if it reconnects
+    offset = request.headers.get('Last-Event-ID', 0, type = int)
+    stream = jobs.stream_events(job, offset, sleep = gevent.sleep)
+
+    return Response(stream, mimetype = 'text/event-stream', headers = {'Cache-Control': 'no-cache'})
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+
+    state = job.state()
+    if state == 'finished':
+        return jsonify({'state': state, 'outputs': job.result()})
+    elif state == 'failed':
+        return jsonify({'state': state, 'error': job.status()['error']}), 500
+    else:
+        # Not finished yet
+        return jsonify({'state': state}), 202
 
 #@app.route("/preview", methods=["GET", "POST"])
 #def preview():
@@ -2389,15 +2178,12 @@ def scrape_FITBIR():
     if form.execute_some.data:#request.method == "POST" and form.validate():
         datafiles = glob.glob(str(UPLOAD_FOLDER) + os.sep + '*.[ct]*') #glob.glob("{}/*.[ct]*".format(UPLOAD_FOLDER))[0]
         #print(datafile)
-        names = []
+        names = ColumnRegistry()
         for datafile in datafiles:
             with open(datafile, 'r') as fin:
                 reader = csv.reader(fin)
                 header = next(reader)
-                for h in header:
-                    nh = h.split('.')[-1]
-                    if nh not in names:
-                        names.append(nh)
+                names.update(h.split('.')[-1] for h in header)
 
         #names = [n.split('.')[-1] for n in names]
         names = [n for n in names if n not in ['Study ID', 'Dataset']]
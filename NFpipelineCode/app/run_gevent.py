@@ -12,6 +12,11 @@ Description: This module serves the application. This file is run when the appli
 
 """
 
+import multiprocessing
+# Needed by the worker processes when the application is frozen with PyInstaller.
+# Must run before the application is imported and the browser is opened.
+multiprocessing.freeze_support()
+
 from gevent.pywsgi import WSGIServer
 import run_app
 import webbrowser
@@ -33,22 +38,25 @@ log_dir.mkdir(parents=True, exist_ok=True)
 log_path = Path(log_dir, 'error.log')
 ###########################################################
 
-host = 'localhost'
-port = 5271
+# The worker processes of the background jobs import this module too, so only
+# the main process opens the browser and serves the application
+if __name__ == '__main__':
+    host = 'localhost'
+    port = 5271
 
-base_url = f"http://{host}:{port}" #"http://localhost:5271"
-webbrowser.open_new_tab(base_url)
+    base_url = f"http://{host}:{port}" #"http://localhost:5271"
+    webbrowser.open_new_tab(base_url)
 
-# Log errors and print outs
-logger = logging.getLogger('gevent')
-logging.basicConfig(filename=log_path,
-                    filemode='w',
-                    #format='Date-Time : %(asctime)s : Line No. : %(lineno)d - %(message)s',
-                    level=logging.INFO)
+    # Log errors and print outs
+    logger = logging.getLogger('gevent')
+    logging.basicConfig(filename=log_path,
+                        filemode='w',
+                        #format='Date-Time : %(asctime)s : Line No. : %(lineno)d - %(message)s',
+                        level=logging.INFO)
 
-logging.info(log_path)
+    logging.info(log_path)
 
-my_app = run_app.app
+    my_app = run_app.app
 
-http_server = WSGIServer((host, port), my_app)
-http_server.serve_forever()
+    http_server = WSGIServer((host, port), my_app)
+    http_server.serve_forever()
@@ -33,8 +33,9 @@ import ast
 from functools import reduce
 import os
 from pathlib import Path
-from flask import flash
+from progress import flash, Tracker
 import logging
+from column_registry import ColumnRegistry
 
 # We do this to ignore a specific Pandas warning
 import warnings
@@ -90,6 +91,7 @@ def write_to_csv(savename, names, method):
         writer.writeheader()
 
         urls = get_urls(names)
+        tracker = Tracker('scrape', total = len(names), unit = 'variables')
 
         for name, url in zip(names, urls):
 
@@ -102,6 +104,7 @@ def write_to_csv(savename, names, method):
             # Some data elements are not in FITBR (ex: Associated GUID)
             if tag_general is None:
                 logging.info(f"{name} does not have a URL to scrape from.")
+                tracker.update(skipped = 1)
                 continue
             #print(tag_general)
             tag_basic = soup.find(id='basic')
@@ -152,13 +155,14 @@ def write_to_csv(savename, names, method):
                     ndd = {k: dd.get(k, '') for k in dd if k in fieldnames}
                     writer.writerow(ndd)
 
+            tracker.update()
+
+        tracker.finish()
+
 def main(given_names):
 
     # Remove duplicate names
-    names = []
-    for n in given_names:
-        if n not in names:
-            names.append(n)
+    names = ColumnRegistry(given_names).names()
 
     # Check the file already exists
     savename = 'Outputs{}fitbir_data_dictionary.csv'.format(os.sep)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module calculates the same descriptive statistics as stats_pipeline.try_stats, but converts each
+column to numbers only once and calculates the numeric statistics of many columns at a time. The numeric values of
+a group of columns are stacked in a 2-D array (one row per column) that is sorted once for the median, percentiles,
+min, max and mode, and summed along the rows for the mean, variance, skewness and kurtosis. The formulas are the
+ones pandas uses, so the results are the same as calling the pandas Series methods on each column (except that
+a percentile of exactly zero may come out as 0.0 instead of -0.0).
+"""
+import itertools
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Number of values stacked in one 2-D array (limits the memory used for wide files)
+STATS_BLOCK_CELLS = 4000000
+
+# Number of values sent to a worker process at a time when calculating in parallel
+PARALLEL_SHARD_CELLS = 500000
+# Fewer values than this are calculated in this process, since starting the worker processes takes longer
+PARALLEL_MIN_CELLS = 4 * PARALLEL_SHARD_CELLS
+
+
+class PreparedColumn:
+    ''' The counts of the values of a column and its values converted to numbers '''
+
+    def __init__(self, name, values):
+
+        self.name = name
+        self.length = len(values)
+        self.counts = Counter(values)
+        # The values that are not missing (one pass over the counts)
+        self.present = []
+        self.missing = 0
+        for v, c in self.counts.items():
+            if is_missing(v):
+                self.missing += c
+            else:
+                self.present.append(v)
+
+        array = np.array(values, dtype = object)
+        if self.length:
+            array[array == ''] = np.nan
+        # The mode is numeric only if all the values are numbers (like to_numeric with errors='ignore')
+        try:
+            numeric = pd.to_numeric(array)
+            self.all_numeric = True
+        except (ValueError, TypeError):
+            numeric = pd.to_numeric(array, errors = 'coerce')
+            self.all_numeric = False
+
+        # Integer columns keep their type for the min, max and mode
+        self.dtype = numeric.dtype
+        self.numeric = numeric if numeric.dtype.kind in 'iu' else None
+        self.values = numeric.astype(np.float64, copy = False) if numeric.dtype.kind in 'iuf' else None
+
+    def supported(self):
+        ''' Checks if the column can be calculated here (else it is left to stats_pipeline.try_stats) '''
+        return self.values is not None and None not in self.counts
+
+
+def is_missing(value):
+    ''' The values try_stats counts as missing: empty strings, None and NaN '''
+    return value is None or (isinstance(value, str) and value == '') or (isinstance(value, float) and value != value)
+
+def lerp(a, b, t):
+    ''' Linear interpolation between a and b, calculated like numpy.quantile '''
+    diff_b_a = b - a
+    return np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
+
+def quantiles(ordered, count, q):
+    '''
+    Returns the q quantile of each row of ordered (sorted, with the NaNs at the end),
+    where count is the number of numbers in each row.
+    '''
+    if ordered.shape[1] == 0:
+        return np.full(len(ordered), np.nan)
+    virtual = (count - 1) * q
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = previous.astype(np.intp)
+    following = previous + 1
+    # Past the last number, both bounds are the last number
+    above = virtual >= count - 1
+    # numpy takes the weight from the index -1 in this case
+    gamma[above] = virtual[above] + 1
+    previous[above] = count[above] - 1
+    following[above] = count[above] - 1
+    previous[count == 0] = 0
+    following[count == 0] = 0
+
+    rows = np.arange(len(ordered))
+    result = lerp(ordered[rows, previous], ordered[rows, following], gamma)
+    result[count == 0] = np.nan
+
+    return result
+
+def medians(ordered, count):
+    ''' Returns the median of each row of ordered (sorted, with the NaNs at the end) '''
+    if ordered.shape[1] == 0:
+        return np.full(len(ordered), np.nan)
+    rows = np.arange(len(ordered))
+    half = np.maximum(count - 1, 0) // 2
+    low = ordered[rows, half]
+    high = ordered[rows, np.where((count % 2 == 0) & (count > 0), half + 1, half)]
+    # Like numpy.mean of the middle values (the sum starts at 0.0, so -0.0 becomes 0.0)
+    result = np.where(count % 2 == 0, ((0.0 + low) + high) / 2, 0.0 + low)
+    result[count == 0] = np.nan
+
+    return result
+
+def mode(row, count):
+    ''' Returns the smallest of the most common numbers of a sorted row '''
+    if count == 0:
+        return np.nan
+    row = row[:count]
+    starts = np.flatnonzero(np.concatenate(([True], row[1:] != row[:-1])))
+    lengths = np.diff(np.append(starts, count))
+
+    return row[starts[np.argmax(lengths)]]
+
+def moments(block, mask, count):
+    '''
+    Returns the mean, variance, skewness and kurtosis of each row of block,
+    skipping the values in mask (same formulas as pandas.core.nanops).
+    The sums are calculated for all the rows at once. The last steps of the skewness
+    and kurtosis are done one column at a time, because numpy's power function
+    on arrays can differ from the one on single numbers in the last digit.
+    '''
+    values = np.where(mask, 0.0, block)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = values.sum(axis = 1, dtype = np.float64) / count
+    mean[count == 0] = np.nan
+
+    # Variance (ddof = 1)
+    var_count = np.where(count <= 1, np.nan, count)
+    d = np.where(count <= 1, np.nan, count - 1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        avg = values.sum(axis = 1, dtype = np.float64) / var_count
+    sqr = (avg[:, None] - values) ** 2
+    np.putmask(sqr, mask, 0)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        variance = sqr.sum(axis = 1, dtype = np.float64) / d
+
+    # Skewness and kurtosis
+    adjusted = values - np.where(count == 0, np.nan, mean)[:, None]
+    np.putmask(adjusted, mask, 0)
+    adjusted2 = adjusted ** 2
+    m2 = adjusted2.sum(axis = 1, dtype = np.float64)
+    m3 = (adjusted2 * adjusted).sum(axis = 1, dtype = np.float64)
+    m4 = (adjusted2 ** 2).sum(axis = 1, dtype = np.float64)
+    max_abs = np.abs(values).max(axis = 1, initial = 0.0)
+
+    skew = np.empty(len(block))
+    kurt = np.empty(len(block))
+    for i in range(len(block)):
+        skew[i], kurt[i] = skew_kurtosis(count[i], m2[i], m3[i], m4[i], max_abs[i])
+
+    return mean, variance, skew, kurt
+
+def skew_kurtosis(count, m2, m3, m4, max_abs):
+    ''' Skewness and kurtosis from the sums of the powers of the deviations (numpy floats) '''
+    eps = np.finfo(np.float64).eps
+    m2 = np.float64(0) if np.abs(m2) < ((eps * max_abs) ** 2) * count else m2
+    m3 = np.float64(0) if np.abs(m3) < ((eps * max_abs) ** 3) * count else m3
+    m4 = np.float64(0) if np.abs(m4) < ((eps * max_abs) ** 4) * count else m4
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore', over = 'ignore'):
+        if count < 3:
+            skew = np.nan
+        elif m2 == 0:
+            skew = np.float64(0)
+        else:
+            skew = (count * (count - 1) ** 0.5 / (count - 2)) * (m3 / m2 ** 1.5)
+
+        adj = 3 * (count - 1) ** 2 / ((count - 2) * (count - 3))
+        numerator = count * (count + 1) * (count - 1) * m4
+        denominator = (count - 2) * (count - 3) * m2 ** 2
+        if count < 4:
+            kurt = np.nan
+        elif denominator == 0:
+            kurt = np.float64(0)
+        else:
+            kurt = numerator / denominator - adj
+
+    return skew, kurt
+
+def value_range(column):
+    ''' The sorted unique values (with NaN last if there are missing values), if there are 10 or less '''
+    if len(column.present) + (column.missing > 0) > 10:
+        return "Element has more than 10 unique values"
+
+    present = sorted(column.present)
+    if column.missing:
+        present.append(np.nan)
+
+    return str(present)
+
+def text_mode(column):
+    ''' The smallest of the most common values of a column that is not all numbers '''
+    if not column.present:
+        return np.nan
+    top = max(column.counts[v] for v in column.present)
+    tied = [v for v in column.present if column.counts[v] == top]
+    try:
+        return min(tied)
+    except TypeError:
+        return tied[0]
+
+def block_stats(columns):
+    '''
+    Returns the statistics of columns that have the same number of values,
+    as a list of dicts in the same order as columns.
+    '''
+    block = np.vstack([c.values for c in columns])
+    mask = np.isnan(block)
+    count = (~mask).sum(axis = 1).astype(np.float64)
+
+    # One sort for the min, max, median, percentiles and mode
+    ordered = np.sort(block, axis = 1)
+    n = count.astype(np.intp)
+    median = medians(ordered, n)
+    q05 = quantiles(ordered, n, 0.05)
+    q95 = quantiles(ordered, n, 0.95)
+    mean, variance, skew, kurt = moments(block, mask, count)
+    # Like pandas, the missing values are replaced (not skipped), so -0.0 and 0.0 come out the same way
+    if block.shape[1]:
+        lows = np.where(mask, np.inf, block).min(axis = 1)
+        highs = np.where(mask, -np.inf, block).max(axis = 1)
+    std = np.sqrt(variance)
+
+    results = []
+    for i, column in enumerate(columns):
+        row = ordered[i]
+        if column.numeric is not None and column.length:
+            # Integer columns don't have missing values
+            low, high = column.numeric.min(), column.numeric.max()
+        elif n[i]:
+            low, high = lows[i], highs[i]
+        else:
+            low = high = np.nan
+
+        if column.numeric is not None and column.length:
+            # From the integers, since the floats can't hold the integers above 2**53
+            common = mode(np.sort(column.numeric), column.length)
+        elif column.all_numeric:
+            common = mode(row, n[i])
+        else:
+            common = text_mode(column)
+
+        results.append({'% Missing': column.missing / column.length * 100 if column.length else np.nan,
+                        '# Unique Values': len(column.present),
+                        'Mean': mean[i],
+                        'Median': median[i],
+                        'Min': low,
+                        'Max': high,
+                        'Mode': common,
+                        'Variance': variance[i],
+                        'Standard Deviation': std[i],
+                        '5th Percentile': q05[i],
+                        '95th Percentile': q95[i],
+                        'Skewness': skew[i],
+                        'Kurtosis': kurt[i],
+                        'Value Range': value_range(column)})
+
+    return results
+
+def column_stats(columns, fallback, block_cells = STATS_BLOCK_CELLS, workers = None):
+    '''
+    Calculates the statistics of each column.
+
+    Parameters
+    -----------
+    columns: an iterable - (column name, list of values) pairs
+    fallback: a function - fallback(name, values) returns the statistics of a column
+                           this module can't calculate (stats_pipeline uses try_stats).
+                           It must be a module level function if workers is given.
+    block_cells: an int - number of values converted to numbers before calculating their statistics
+    workers: an int - number of processes calculating the statistics of groups of columns in parallel,
+                      if there are more than PARALLEL_MIN_CELLS values (None calculates them in this process)
+
+    Returns
+    -----------
+    a generator of (column name, dict of statistics) pairs, in the same order as columns
+    '''
+    if workers and workers > 1:
+        # The first columns are kept until there are enough values for the worker processes
+        columns = iter(columns)
+        first = []
+        cells = 0
+        for name, values in columns:
+            first.append((name, values))
+            cells += len(values)
+            if cells >= PARALLEL_MIN_CELLS:
+                yield from parallel_column_stats(itertools.chain(first, columns), fallback, workers,
+                                                 min(block_cells, PARALLEL_SHARD_CELLS))
+                return
+        columns = first
+
+    batch = []
+    cells = 0
+    for name, values in columns:
+        column = PreparedColumn(name, values)
+        if not column.supported():
+            batch.append((column, fallback(name, values)))
+        else:
+            batch.append((column, None))
+            cells += column.length
+        if cells >= block_cells:
+            yield from _finish(batch)
+            batch = []
+            cells = 0
+
+    yield from _finish(batch)
+
+def _finish(batch):
+    ''' Calculates the statistics of a batch of prepared columns, grouping them by length '''
+    by_length = {}
+    for column, result in batch:
+        if result is None:
+            by_length.setdefault(column.length, []).append(column)
+
+    calculated = {}
+    for columns in by_length.values():
+        for column, result in zip(columns, block_stats(columns)):
+            calculated[id(column)] = result
+
+    for column, result in batch:
+        yield column.name, result if result is not None else calculated[id(column)]
+
+def shard_stats(columns, fallback):
+    ''' Returns the statistics of a list of columns (run by the worker processes) '''
+    return list(column_stats(columns, fallback))
+
+def shards(columns, shard_cells):
+    ''' Splits the columns into lists of about shard_cells values '''
+    shard = []
+    cells = 0
+    for name, values in columns:
+        shard.append((name, values))
+        cells += len(values)
+        if cells >= shard_cells:
+            yield shard
+            shard = []
+            cells = 0
+    if shard:
+        yield shard
+
+def parallel_column_stats(columns, fallback, workers, shard_cells = PARALLEL_SHARD_CELLS):
+    '''
+    Calculates the statistics of groups of columns in a pool of worker processes.
+    Converting the values to numbers is most of the work, so the workers get the values
+    (not the numbers) and return the finished statistics, which are small. Only a few groups
+    are sent ahead of the results, so the columns can come from a generator. The results
+    are returned in the same order as columns.
+    '''
+    pending = deque()
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        try:
+            for shard in shards(columns, shard_cells):
+                pending.append(executor.submit(shard_stats, shard, fallback))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
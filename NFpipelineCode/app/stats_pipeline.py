@@ -34,39 +34,71 @@ Description: This module calculates the statistics for the given file in the Inp
 import numpy as np
 import pandas as pd
 import csv
-from collections import defaultdict
+import csv_detect
+import csv_columns
+import stats_engine
+from progress import Tracker
 
 def read_csv(file):
     ''' Reads the merged file that you want to get statistics for '''
 
-    with open(file, 'r') as fin:
+    # Delimiter is cached between runs
+    delim = csv_detect.detect(file).delimiter
+    # Parsed into lists by column, like adding each row of csv.DictReader
+    return csv_columns.read_columns(file, delim)
 
-        sniffer = csv.Sniffer()
-        dialect = sniffer.sniff(fin.readline())
-        fin.seek(0)
-        delim = str(dialect.delimiter)
-        reader = csv.DictReader(fin, delimiter = delim)
+def csv_str(value):
+    ''' Converts a value to the string csv.writer writes for it '''
+    if value is None:
+        return ''
 
-        data = defaultdict(list)
-        for row in reader:
+    return str(value)
 
-            for key, value in row.items():
+def rows_to_columns(rows, columns):
+    '''
+    Collects the values of each column from rows (dicts, like the ones passed to
+    csv.DictWriter), as the strings that read_csv would get back from the file.
+    '''
+    data = {col: [] for col in columns}
+    for row in rows:
+        for col, values in data.items():
+            values.append(csv_str(row.get(col, '')))
 
-                data[key].append(value)
+    return data
 
+def make_stats_dict_from_file(dd, vectorized = True, workers = None):
+    '''
+    dd is a dict of lists or an iterable of (column, list) pairs
 
-    return data
+    If vectorized, the stats are calculated with stats_engine (each column is converted to numbers
+    once and the numeric stats of many columns are calculated together). Otherwise try_stats
+    is called on each column. Both give the same results.
 
-def make_stats_dict_from_file(dd):
+    If workers is given, the numeric stats of large files are calculated by that many processes
+    (vectorized only).
+    '''
 
     stats_dict = {}
 
-    for key, values in dd.items():
-        stats_dict[key] = {}
-        try_stats(stats_dict, key, values)
+    items = dd.items() if isinstance(dd, dict) else dd
+    tracker = Tracker('stats', total = len(dd) if isinstance(dd, dict) else None, unit = 'columns')
+    if vectorized:
+        for key, stats in stats_engine.column_stats(items, column_try_stats, workers = workers):
+            stats_dict[key] = stats
+            tracker.update()
+    else:
+        for key, values in items:
+            stats_dict[key] = {}
+            try_stats(stats_dict, key, values)
+            tracker.update(values = len(values))
+    tracker.finish()
 
     return stats_dict
 
+def column_try_stats(col, values):
+    ''' Returns the stats of one column calculated by try_stats '''
+    return try_stats({col: {}}, col, values)[col]
+
 
 
 
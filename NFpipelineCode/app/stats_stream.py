@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: This module calculates the descriptive statistics of stats_pipeline for files that are too large to
+load in memory. The file is read in chunks of rows and each column keeps running totals:
+
+    - the number of values and missing values
+    - the mean and the sums of the powers of the deviations (for the variance, skewness and kurtosis),
+      combined chunk by chunk with the pairwise update formulas (Welford / Chan / Pebay)
+    - the min and max
+    - the counts of the values, exact up to a limit and then an approximate summary of the most common values
+      (for the mode), and a sketch of the hashes of the values (for the number of unique values)
+    - the numbers themselves while there are few of them, then a quantile sketch with a bounded relative
+      error (for the median and percentiles)
+
+Files that fit in one chunk get the exact statistics of stats_pipeline.make_stats_dict_from_file.
+"""
+import csv
+import math
+import itertools
+import logging
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import csv_detect
+import stats_engine
+import stats_pipeline as statsp
+from progress import Tracker
+
+# Number of values read at a time (the number of rows depends on the number of columns)
+CHUNK_CELLS = 1000000
+
+# Columns with up to this many numbers get the exact median and percentiles
+EXACT_VALUES = 5000
+
+# Number of different values counted exactly per column (for the mode, unique values and value range)
+MAX_DISTINCT = 1000
+
+# Number of hashes kept per column to estimate the number of unique values
+DISTINCT_SKETCH_SIZE = 1024
+
+# Relative error of the approximate median and percentiles
+QUANTILE_ACCURACY = 0.01
+
+
+class FrequentValues:
+    '''
+    Counts of the values of a column. The counts are exact until there are more than
+    capacity different values. Then only the most common values are kept, with counts
+    that are too low by at most the number of values seen / capacity (Misra-Gries summary),
+    which is enough to find the mode of columns that have one.
+    '''
+
+    def __init__(self, capacity = MAX_DISTINCT):
+
+        self.capacity = capacity
+        self.counts = Counter()
+        self.exact = True
+
+    def update(self, counts):
+        # A chunk with too many values is summarized first (the summaries can be added up)
+        counts = self._reduce(counts)
+        self.counts.update(counts)
+        self.counts = Counter(self._reduce(self.counts))
+
+        return self
+
+    def _reduce(self, counts):
+        ''' Subtracts the (capacity + 1)th largest count from all the counts and drops the ones left at 0 '''
+        if len(counts) <= self.capacity:
+            return counts
+        self.exact = False
+        values = np.fromiter(counts.values(), dtype = np.int64, count = len(counts))
+        threshold = np.partition(values, len(values) - self.capacity - 1)[len(values) - self.capacity - 1]
+        keep = np.flatnonzero(values > threshold)
+        keys = list(counts)
+
+        return {keys[i]: int(values[i] - threshold) for i in keep}
+
+    def mode(self):
+        ''' The smallest of the most common values (NaN if there are none) '''
+        if not self.counts:
+            return np.nan
+        top = max(self.counts.values())
+        tied = [v for v, c in self.counts.items() if c == top]
+        try:
+            return min(tied)
+        except TypeError:
+            return tied[0]
+
+
+class DistinctSketch:
+    '''
+    Estimates the number of different values from the smallest hashes of the values
+    (k minimum values sketch). The count is exact while there are fewer than size values.
+    '''
+
+    def __init__(self, size = DISTINCT_SKETCH_SIZE):
+
+        self.size = size
+        self.hashes = np.array([], dtype = np.uint64)
+
+    def update(self, values):
+        if len(values):
+            hashes = pd.util.hash_array(np.asarray(values, dtype = object))
+            self.hashes = np.union1d(self.hashes, hashes)[:self.size]
+
+        return self
+
+    def count(self):
+        if len(self.hashes) < self.size:
+            return len(self.hashes)
+        # The size-th smallest of n random hashes is about size / n of the way up
+        kth = (float(self.hashes[-1]) + 1) / 2.0**64
+
+        return int(round((self.size - 1) / kth))
+
+
+class QuantileSketch:
+    '''
+    Histogram of the numbers with buckets that grow geometrically (like DDSketch), so any
+    quantile is returned with a relative error of at most accuracy. The number of buckets
+    only depends on the range of the numbers, not on how many there are.
+    '''
+
+    def __init__(self, accuracy = QUANTILE_ACCURACY):
+
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def _add(self, buckets, values):
+        index = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        keys, counts = np.unique(index, return_counts = True)
+        buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def update(self, values):
+        ''' Adds the numbers (without NaNs) '''
+        values = values[np.isfinite(values)]
+        self.count += len(values)
+        self.zeros += int(np.sum(values == 0))
+        if np.any(values > 0):
+            self._add(self.positive, values[values > 0])
+        if np.any(values < 0):
+            self._add(self.negative, -values[values < 0])
+
+        return self
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+
+        seen = 0
+        for index in sorted(self.negative, reverse = True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+
+        return self._value(max(self.positive))
+
+
+class ColumnAccumulator:
+    ''' Running statistics of one column, updated one chunk of values at a time '''
+
+    def __init__(self, name, exact_values = EXACT_VALUES, max_distinct = MAX_DISTINCT,
+                 accuracy = QUANTILE_ACCURACY):
+
+        self.name = name
+        self.length = 0
+        self.missing = 0
+        self.has_none = False
+        # Counts of the text values and of the numbers (the mode is numeric if all the values are numbers)
+        self.values = FrequentValues(max_distinct)
+        self.numbers = FrequentValues(max_distinct)
+        self.distinct = DistinctSketch()
+        self.all_numeric = True
+        self.all_int = True
+
+        # Moments of the numbers
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = self.m3 = self.m4 = 0.0
+        self.max_abs = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+        # The numbers are kept until there are more than exact_values, then only the sketch
+        self.exact_values = exact_values
+        self.kept = []
+        self.sketch = QuantileSketch(accuracy)
+
+    def update(self, values):
+        ''' Adds a chunk of values (strings, with '' or None for missing values) '''
+        self.length += len(values)
+        counts = Counter(values)
+        # The values of a CSV file are strings, so '' and None are the only missing values
+        self.has_none = self.has_none or None in counts
+        for v in ('', None):
+            if v in counts:
+                self.missing += counts.pop(v)
+                self.all_int = False
+        self.values.update(counts)
+        keys = list(counts)
+        self.distinct.update(keys)
+
+        # Only the different values are converted to numbers, then repeated as often as they appear
+        try:
+            key_numbers = np.array(keys, dtype = np.float64)
+        except (ValueError, TypeError):
+            key_numbers = pd.to_numeric(np.array(keys, dtype = object), errors = 'coerce').astype(np.float64)
+            self.all_numeric = False
+        if self.all_int:
+            try:
+                np.array(keys, dtype = np.int64)
+            except (ValueError, TypeError, OverflowError):
+                self.all_int = False
+        key_counts = np.fromiter(counts.values(), dtype = np.int64, count = len(keys))
+        present = ~np.isnan(key_numbers)
+        key_numbers, key_counts = key_numbers[present], key_counts[present]
+        numbers = np.repeat(key_numbers, key_counts)
+
+        if self.all_numeric and len(key_numbers):
+            # Different strings can be the same number ('1' and '1.0')
+            unique, inverse = np.unique(key_numbers, return_inverse = True)
+            totals = np.bincount(inverse, weights = key_counts).astype(np.int64)
+            self.numbers.update(dict(zip(unique.tolist(), totals.tolist())))
+        self._add_numbers(numbers)
+
+        return self
+
+    def _add_numbers(self, x):
+        if not len(x):
+            return
+
+        # Moments of the chunk, then combined with the running moments
+        nb = len(x)
+        mean_b = x.mean()
+        d = x - mean_b
+        d2 = d ** 2
+        m2_b, m3_b, m4_b = d2.sum(), (d2 * d).sum(), (d2 ** 2).sum()
+
+        na = self.n
+        n = na + nb
+        delta = mean_b - self.mean
+        self.m4 = (self.m4 + m4_b + delta ** 4 * na * nb * (na ** 2 - na * nb + nb ** 2) / n ** 3
+                   + 6 * delta ** 2 * (na ** 2 * m2_b + nb ** 2 * self.m2) / n ** 2
+                   + 4 * delta * (na * m3_b - nb * self.m3) / n)
+        self.m3 = (self.m3 + m3_b + delta ** 3 * na * nb * (na - nb) / n ** 2
+                   + 3 * delta * (na * m2_b - nb * self.m2) / n)
+        self.m2 = self.m2 + m2_b + delta ** 2 * na * nb / n
+        self.mean = self.mean + delta * nb / n
+        self.n = n
+
+        self.min = np.fmin(self.min, x.min())
+        self.max = np.fmax(self.max, x.max())
+        self.max_abs = max(self.max_abs, float(np.abs(x).max()))
+
+        self.sketch.update(x)
+        if self.kept is not None:
+            self.kept.append(x)
+            if sum(len(k) for k in self.kept) > self.exact_values:
+                self.kept = None
+
+    def quantiles(self):
+        ''' The median, 5th and 95th percentiles (exact if the numbers were kept) '''
+        if self.kept is not None:
+            ordered = np.sort(np.concatenate(self.kept) if self.kept else np.array([]))[None, :]
+            count = np.array([ordered.shape[1]])
+            return (stats_engine.medians(ordered, count)[0], stats_engine.quantiles(ordered, count, 0.05)[0],
+                    stats_engine.quantiles(ordered, count, 0.95)[0])
+
+        return self.sketch.quantile(0.5), self.sketch.quantile(0.05), self.sketch.quantile(0.95)
+
+    def stats(self):
+        ''' Returns the statistics in the format of stats_pipeline.make_stats_dict_from_file '''
+        n = np.float64(self.n)
+        if self.n:
+            mean = np.float64(self.mean)
+            low, high = self.min, self.max
+        else:
+            mean = low = high = np.nan
+        variance = np.float64(self.m2) / (n - 1) if self.n > 1 else np.nan
+        skew, kurt = stats_engine.skew_kurtosis(n, np.float64(self.m2), np.float64(self.m3),
+                                                np.float64(self.m4), self.max_abs)
+        median, q05, q95 = self.quantiles()
+
+        if self.all_numeric:
+            mode = self.numbers.mode()
+        else:
+            mode = self.values.mode()
+        if self.all_int and self.n:
+            low, high, mode = np.int64(low), np.int64(high), np.int64(mode)
+
+        # The value range needs the exact counts
+        if self.values.exact:
+            unique = len(self.values.counts)
+            if unique + (self.missing > 0) > 10:
+                value_range = "Element has more than 10 unique values"
+            else:
+                present = sorted(self.values.counts)
+                if self.missing:
+                    present.append(np.nan)
+                value_range = str(present)
+        else:
+            unique = self.distinct.count()
+            value_range = "Element has more than 10 unique values"
+
+        return {'% Missing': self.missing / self.length * 100 if self.length else np.nan,
+                '# Unique Values': unique,
+                'Mean': mean,
+                'Median': median,
+                'Min': low,
+                'Max': high,
+                'Mode': mode,
+                'Variance': variance,
+                'Standard Deviation': np.sqrt(variance),
+                '5th Percentile': q05,
+                '95th Percentile': q95,
+                'Skewness': skew,
+                'Kurtosis': kurt,
+                'Value Range': value_range}
+
+
+def read_chunks(file, chunk_cells = CHUNK_CELLS):
+    '''
+    Reads a CSV file a chunk of rows (of about chunk_cells values) at a time. Yields the column names first,
+    then for each chunk a list with the values of each column. Like csv.DictReader,
+    the values missing at the end of short rows are None.
+    '''
+    delim = csv_detect.detect(file).delimiter
+    with open(file, 'r') as fin:
+        reader = csv.reader(fin, delimiter = delim)
+        columns = next(reader, [])
+        yield columns
+
+        ncols = len(columns)
+        chunk_rows = max(1, chunk_cells // max(ncols, 1))
+        chunk = []
+        for row in reader:
+            # Skip blank lines, like csv.DictReader
+            if not row:
+                continue
+            if len(row) < ncols:
+                row = row + [None] * (ncols - len(row))
+            chunk.append(row[:ncols])
+            if len(chunk) >= chunk_rows:
+                yield [list(values) for values in zip(*chunk)]
+                chunk = []
+        if chunk:
+            yield [list(values) for values in zip(*chunk)]
+
+def stream_stats(file, chunk_cells = CHUNK_CELLS, exact_values = EXACT_VALUES, max_distinct = MAX_DISTINCT,
+                 accuracy = QUANTILE_ACCURACY):
+    '''
+    Calculates the statistics of each column of a CSV file without loading the whole file.
+
+    Parameters
+    -----------
+    file: a str - path of the CSV file
+    chunk_cells: an int - number of values read at a time (files with fewer values get the exact statistics)
+    exact_values: an int - columns with up to this many numbers get the exact median and percentiles
+    max_distinct: an int - number of different values counted exactly per column
+    accuracy: a float - relative error of the approximate median and percentiles
+
+    Returns
+    -----------
+    stats_dict: a dict - column -> statistics, like stats_pipeline.make_stats_dict_from_file
+    '''
+    chunks = read_chunks(file, chunk_cells)
+    columns = next(chunks)
+    first = next(chunks, None)
+    second = next(chunks, None) if first is not None else None
+    if second is None:
+        # The whole file fits in one chunk, use the exact statistics
+        chunks.close()
+        return statsp.make_stats_dict_from_file(statsp.read_csv(file))
+
+    logging.info(f"Calculating the stats of {file} in chunks of {len(first[0])} rows")
+    accumulators = {col: ColumnAccumulator(col, exact_values, max_distinct, accuracy) for col in columns}
+    # Repeated column names keep the last values, like csv.DictReader
+    last = {col: j for j, col in enumerate(columns)}
+    tracker = Tracker('stats', unit = 'rows')
+    for chunk in itertools.chain((first, second), chunks):
+        _update(accumulators, last, chunk)
+        tracker.update(len(chunk[0]) if chunk else 0)
+    tracker.finish(columns = len(accumulators))
+
+    stats_dict = {}
+    for col, acc in accumulators.items():
+        if acc.has_none:
+            logging.info(f"Column {col} has rows that are too short, their values are counted as missing")
+        stats_dict[col] = acc.stats()
+
+    return stats_dict
+
+def _update(accumulators, last, chunk):
+    for col, j in last.items():
+        accumulators[col].update(chunk[j])
+
+    return
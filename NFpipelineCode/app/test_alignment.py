@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the alignment module (the alignment database). This requires the use of pytest to run.
+
+"""
+import csv
+import json
+import sqlite3
+import alignment
+import alignment_rules
+from alignment_repository import AlignmentRepository
+
+COLUMNS = ['NDA_Structure', 'FITBIR_Form', 'NDA_Element', 'FITBIR_Element', 'FN_Condition1', 'FN_Condition2',
+           'FN_Operator', 'NF_Condition1', 'NF_Condition2', 'NF_Operator', 'FN_formula', 'NF_formula']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline = '') as fout:
+        writer = csv.writer(fout)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+class TestAlignment:
+
+    def test_build_database(self, tmp_path):
+        write_csv(tmp_path / 'alignment.csv',
+                  [[' ace01 ', 'ACE', ' sex ', 'GenderTyp ', '', '', '', 'M=Male;F=Female', '', ' dict', '', ''],
+                   ['ace01', 'ACE', 'age', 'AgeYrs', '', '', '', '', '', '', 'x*12', 'x/12'],
+                   ['ace01', 'ACE', 'bad_op', 'BadOp', '', '', '', '', '', '>', '', ''],
+                   ['ace01', 'ACE', 'bad_formula', 'BadFormula', '', '', '', '', '', '', '', '__import__("os")'],
+                   ['tbi01', 'TBI', 'totals', 'Total', '', '', '', 'a,b', '', 'sum', '', '']])
+        database = str(tmp_path / 'alignment.db')
+        rejected = alignment.build_database(str(tmp_path / 'alignment.csv'), database)
+        assert [(line, element) for line, element, _ in rejected] == [(4, 'bad_op'), (5, 'bad_formula')]
+
+        con = sqlite3.connect(database)
+        con.row_factory = sqlite3.Row
+        rows = con.execute('SELECT * FROM alignment ORDER BY id').fetchall()
+        indexes = {row['name'] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        con.close()
+        # The GUID and interview_date rows come first
+        assert [row['NDA_Element'] for row in rows] == ['subjectkey', 'interview_date', 'sex', 'age', 'totals']
+        assert rows[2]['NDA_Structure'] == 'ace01' and rows[2]['FITBIR_Element'] == 'GenderTyp'
+        assert rows[2]['NF_Rule'] == 'MappingRule' and json.loads(rows[2]['NF_Parsed']) == {'M': 'Male', 'F': 'Female'}
+        assert rows[3]['NF_Rule'] == 'FormulaRule' and rows[3]['FN_Rule'] == 'FormulaRule'
+        assert rows[4]['NF_Rule'] == 'SumRule' and json.loads(rows[4]['NF_Parsed']) == ['a', 'b']
+        assert indexes == {f'idx_alignment_{col}' for col in alignment.INDEXED_COLUMNS}
+
+        repository = AlignmentRepository(database)
+        table = repository.get(alignment_rules.NDA_TO_FITBIR)
+        assert table.column_mapping['sex'] == 'GenderTyp' and table.column_scaling['sex']['Operator'] == 'dict'
+        assert [row['NDA_Element'] for row in repository.find('NDA_Structure', 'ace01')] == ['sex', 'age']
+
+    def test_rules_from_database(self, tmp_path, monkeypatch):
+        write_csv(tmp_path / 'alignment.csv',
+                  [['ace01', 'ACE', 'sex', 'GenderTyp', '', '', '', 'M=Male;F=Female', '', 'dict', '', ''],
+                   ['ace01', 'ACE', 'age', 'AgeYrs', 'AgeUnit = months', '', '', 'AgeUnit = years', '', '', 'x*12', 'x/12'],
+                   ['tbi01', 'TBI', 'totals', 'Total', 'a,b', '', 'sum', 'a,b', '', 'sum', '', '']])
+        database = str(tmp_path / 'alignment.db')
+        alignment.build_database(str(tmp_path / 'alignment.csv'), database)
+        repository = AlignmentRepository(database)
+
+        # The rules are built from the parsed columns, the conditions aren't parsed again
+        monkeypatch.setattr(alignment_rules, 'parse_mapping', None)
+        monkeypatch.setattr(alignment_rules, 'parse_condition', None)
+        nda = repository.get(alignment_rules.NDA_TO_FITBIR).plan
+        assert nda.rules['sex'].mapping == {'M': 'Male', 'F': 'Female'}
+        assert nda.rules['age'].conditions == [('AgeUnit', 'years')] and nda.rules['age'].formula.formula == 'x/12'
+        assert isinstance(nda.rules['totals'], alignment_rules.SumRule) and nda.rules['totals'].felement == 'Total'
+        fitbir = repository.get(alignment_rules.FITBIR_TO_NDA).plan
+        assert fitbir.rules['AgeYrs'].conditions == [('AgeUnit', 'months')]
+        assert fitbir.rules['Total'].columns == ['a', 'b']
+
+        dataset = {'sex': ['M', 'F', ''], 'age': ['24', '', '36']}
+        nda.apply(dataset)
+        assert dataset['sex'] == ['Male', 'Female', ''] and dataset['AgeUnit'] == ['years', '', 'years']
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the alignment_repository module. This requires the use of pytest to run.
+
+"""
+import os
+import sqlite3
+import pytest
+import alignment_rules
+from alignment_repository import AlignmentRepository
+
+COLUMNS = ['NDA_Element', 'FITBIR_Element', 'NF_Condition1', 'NF_Condition2', 'NF_Operator', 'NF_formula',
+           'FN_Condition1', 'FN_Condition2', 'FN_Operator', 'FN_formula']
+
+
+def write_db(path, rows):
+    con = sqlite3.connect(path)
+    con.execute('DROP TABLE IF EXISTS alignment')
+    con.execute(f"CREATE TABLE alignment ({', '.join(COLUMNS)})")
+    con.executemany(f"INSERT INTO alignment VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+    con.commit()
+    con.close()
+
+class TestAlignmentRepository:
+
+    @pytest.fixture
+    def db(self, tmp_path):
+        path = str(tmp_path / 'alignment.db')
+        write_db(path, [(' sex ', 'GenderTyp', None, None, None, 'M=Male;F=Female', None, None, None, 'Male=M;Female=F'),
+                        ('age', 'AgeYrs', None, None, None, 'x/12', None, None, None, 'x*12'),
+                        ('age', 'AgeVal', None, None, None, 'x', None, None, None, 'x')])
+        return path
+
+    def test_tables(self, db):
+        alignment = AlignmentRepository(db)
+        nda = alignment.get(alignment_rules.NDA_TO_FITBIR)
+        assert nda.column_mapping == {'sex': 'GenderTyp', 'age': 'AgeYrs'}
+        assert nda.column_scaling['age'] == {'FITBIR_Element': 'AgeYrs', 'Condition1': None, 'Condition2': None,
+                                             'Operator': None, 'Formula': 'x/12'}
+
+        fitbir = alignment.get(alignment_rules.FITBIR_TO_NDA)
+        assert fitbir.column_mapping == {'GenderTyp': 'sex', 'AgeYrs': 'age', 'AgeVal': 'age'}
+        assert fitbir.column_scaling['AgeYrs'] == {'Condition1': None, 'Condition2': None,
+                                                   'Operator': None, 'Formula': 'x*12'}
+        assert 'AgeYrs' in fitbir.plan and fitbir.plan is fitbir.plan
+
+    def test_cached(self, db, monkeypatch):
+        alignment = AlignmentRepository(db)
+        table = alignment.get(alignment_rules.NDA_TO_FITBIR)
+        # The database isn't read again while the file is the same
+        monkeypatch.setattr(sqlite3, 'connect', None)
+        assert alignment.get(alignment_rules.NDA_TO_FITBIR) is table
+
+    def test_reload_on_change(self, db):
+        alignment = AlignmentRepository(db)
+        table = alignment.get(alignment_rules.NDA_TO_FITBIR)
+        mtime = os.stat(db).st_mtime_ns
+
+        write_db(db, [('sex', 'SexTyp', None, None, None, None, None, None, None, None)])
+        os.utime(db, ns = (mtime + 10 ** 9, mtime + 10 ** 9))
+        new = alignment.get(alignment_rules.NDA_TO_FITBIR)
+        assert new is not table and new.column_mapping == {'sex': 'SexTyp'}
+
+        alignment.clear()
+        assert alignment.get(alignment_rules.NDA_TO_FITBIR) is not new
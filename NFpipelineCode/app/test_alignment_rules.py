@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the alignment_rules module. This requires the use of pytest to run.
+
+"""
+import copy
+import random
+import pytest
+import alignment_rules as ar
+from preprocessNDA import NDAdataset
+from preprocessFITBIR import FITBIRdataset
+
+
+def rule(cond1 = '', cond2 = '', operator = '', formula = '', felement = None):
+    scaling = {'Condition1': cond1, 'Condition2': cond2, 'Operator': operator, 'Formula': formula}
+    if felement is not None:
+        scaling = {'FITBIR_Element': felement, **scaling}
+
+    return scaling
+
+NDA_SCALING = {'audit1': rule('0=0,6=1;1=1', operator = 'dict', felement = 'AUDITScore'),
+               'flanker2': rule('TrialNumber = 2', 'StimuliTyp = 1', '&', 'x+1', felement = 'Congruency'),
+               'flanker3': rule('TrialNumber = 3', 'StimuliTyp = 0', '&', 'x+1', felement = 'Congruency'),
+               'brief_shift': rule('BRIEFScoreTyp = Shift', felement = 'BRIEFPercentile'),
+               'mmse01': rule('mmse01,mmse02', operator = 'sum', felement = 'MMSEScore'),
+               'months': rule(formula = 'x/12', felement = 'Years'),
+               'AdvrsEvntStartDateTime': rule(felement = 'AdvrsEvntStartDateTime'),
+               'nothing': rule(felement = 'Nothing')}
+
+FITBIR_SCALING = {'AUDITScore': rule('0=0,1=6', operator = 'dict'),
+                  'AdvrsEvntSeverScale': rule('30', operator = '=='),
+                  'Congruency': rule('TrialNumber = 2', 'StimuliTyp = 1', '&', 'x-1'),
+                  'Percentile': rule('ScoreTyp = Shift'),
+                  'Scaled': rule('ScoreTyp = Inhibit', formula = 'x*5'),
+                  'Years': rule(formula = 'x*12'),
+                  'Nothing': rule()}
+
+def make_dataset(columns, n, seed = 0):
+    rng = random.Random(seed)
+    values = ['', '0', '1', '2', '6', '30', '2.5']
+    dataset = {col: [rng.choice(values) for _ in range(n)] for col in columns}
+    dataset['TrialNumber'] = [rng.choice(['2', '3']) for _ in range(n)]
+    dataset['StimuliTyp'] = [rng.choice(['0', '1', '']) for _ in range(n)]
+    dataset['ScoreTyp'] = [rng.choice(['Shift', 'Inhibit']) for _ in range(n)]
+    dataset['AdvrsEvntStartDateTime'] = [rng.choice(['', '2020-01-05', '3/4/2021 10:00']) for _ in range(n)]
+
+    return dataset
+
+def convert_one_at_a_time(cls, dataset, converter):
+    processed = cls()
+    processed.dataset = copy.deepcopy(dataset)
+    for element in list(processed.dataset):
+        if element in converter:
+            processed._convert(element, converter)
+
+    return processed.dataset
+
+class TestAlignmentRules:
+
+    def test_nda_to_fitbir(self):
+        dataset = make_dataset(['audit1', 'flanker2', 'flanker3', 'brief_shift', 'mmse01', 'mmse02', 'months', 'nothing'], 200)
+        expected = convert_one_at_a_time(NDAdataset, dataset, NDA_SCALING)
+
+        pnda = NDAdataset()
+        pnda.dataset = copy.deepcopy(dataset)
+        pnda.convert_scaling_to_fitbir(NDA_SCALING)
+        assert pnda.dataset == expected
+        # The condition and FITBIR columns are added in the same order
+        assert list(pnda.dataset) == list(expected)
+
+    def test_fitbir_to_nda(self):
+        dataset = make_dataset(['AUDITScore', 'AdvrsEvntSeverScale', 'Congruency', 'Percentile', 'Scaled', 'Years', 'Nothing'], 200)
+        expected = convert_one_at_a_time(FITBIRdataset, dataset, FITBIR_SCALING)
+
+        pfitbir = FITBIRdataset()
+        pfitbir.dataset = copy.deepcopy(dataset)
+        plan = ar.AlignmentPlan(FITBIR_SCALING, ar.FITBIR_TO_NDA)
+        pfitbir.convert_scaling_to_nda(plan)
+        assert pfitbir.dataset == expected
+
+    def test_formula(self):
+        formula = ar.compile_formula('x*5')
+        assert formula.array is not None
+        assert [str(v) for v in formula(ar.to_floats(['1', '', '2.5']))] == ['5.0', 'nan', '12.5']
+        assert ar.compile_formula('')(ar.to_floats(['3'])) == [3.0]
+        # Division by zero is an error, like evaluating the formula on each value
+        with pytest.raises(ZeroDivisionError):
+            ar.compile_formula('1/x')(ar.to_floats(['1', '0']))
+
+    @pytest.mark.parametrize('text', ['(x-32)*5/9', '-x+2**3', 'abs(x)%4', 'x//3', 'x**2', 'round(x)',
+                                      'x if x > 1 else 0', '7', 'x*10**-3', '(x+1)**0.5'])
+    def test_formula_same_as_python(self, text):
+        values = [1.0, -2.5, 0.0, 7.25, 1e-300, 1e100]
+        formula = ar.Formula(text)
+        assert formula(ar.to_floats([repr(v) for v in values])) == [eval(text, {}, {'x': v}) for v in values]
+        # Only the operators with the same results as Python are evaluated on arrays
+        assert (formula.array is None) == (text in ['x**2', 'round(x)', 'x if x > 1 else 0', '(x+1)**0.5'])
+
+    @pytest.mark.parametrize('text', ['__import__("os").getcwd()', 'x.real', 'np.log(x)', '[x][0]', 'x + "1"',
+                                      '9**9**9', 'x**x', '2**(3*500)', '(2**50)**50', '1 << 10**10', 'x**101'])
+    def test_unsafe_formula(self, text):
+        with pytest.raises(ValueError):
+            ar.Formula(text)
+        plan = ar.AlignmentPlan({'a': rule(formula = text)}, ar.FITBIR_TO_NDA)
+        with pytest.raises(ValueError):
+            plan.apply({'a': ['1']})
+
+    def test_invalid_rules(self):
+        plan = ar.AlignmentPlan({'a': rule(operator = '>'), 'b': rule('0=1,2', operator = 'dict')}, ar.FITBIR_TO_NDA)
+        assert len(plan) == 2
+        # Only an error for the elements in the dataset
+        plan.apply({'c': ['1']})
+        with pytest.raises(ValueError, match = 'Invalid operator'):
+            plan.apply({'a': ['1']})
+        with pytest.raises(IndexError):
+            plan.apply({'b': ['1']})
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the benchmark script. This requires the use of pytest to run.
+
+"""
+import csv
+import sys
+import subprocess
+import pytest
+import benchmark as bm
+
+SCALE = {'subjects': 5, 'visits': 2, 'columns': 4, 'files': 2, 'sparsity': 0.5, 'repeats': 3}
+
+
+def read_rows(path):
+    with open(path, 'r', newline = '') as fin:
+        return list(csv.reader(fin))
+
+class TestBenchmark:
+
+    def test_nda_files(self, tmp_path):
+        files = bm.make_nda_files(str(tmp_path), **SCALE)
+        assert len(files) == 2
+
+        rows = read_rows(files[0])
+        assert rows[0][:3] == ['subjectkey', 'src_subject_id', 'interview_date']
+        assert len(rows[0]) == 5 + 4
+        # Description row, then one row per subject and visit
+        assert rows[1][0].startswith('The NDAR Global Unique Identifier')
+        assert len(rows) == 2 + 5*2
+        # Same files for the same seed
+        bm.make_nda_files(str(tmp_path / 'again'), **SCALE)
+        assert read_rows(str(tmp_path / 'again' / 'quest0001.csv')) == rows
+
+    def test_fitbir_files(self, tmp_path):
+        rows = read_rows(bm.make_fitbir_files(str(tmp_path), **SCALE)[0])
+        assert rows[0][:2] == ['Form00.Main.GUID', 'Form00.Main.VisitDate']
+        assert all(len(col.split('.')) == 3 for col in rows[0])
+        assert len(rows) == 1 + 5*2*3
+        # Only the first row of a visit has the GUID
+        guids = [row[0] for row in rows[1:]]
+        assert guids[:3] == [guids[0], '', ''] and guids[0] != ''
+
+    def test_results(self, tmp_path):
+        results = bm.run_benchmarks(str(tmp_path / 'work'), SCALE, cases = ['preprocess_fitbir'])
+        assert list(results) == ['preprocess_fitbir']
+        assert 'error' not in results['preprocess_fitbir']
+
+        results_file = tmp_path / 'results.jsonl'
+        bm.save_results(results, SCALE, results_file, label = 'before')
+        bm.save_results(results, SCALE, results_file, label = 'after')
+        records = bm.load_results(results_file)
+        assert [r['label'] for r in records] == ['before', 'after']
+        assert records[0]['scale'] == SCALE
+        assert 'preprocess_fitbir' in bm.compare(records[1], records[0])
+
+    def test_measure(self):
+        _, big = bm.measure(lambda: len(b'x' * 200 * 1024 ** 2))
+        _, small = bm.measure(lambda: None)
+        # Each case has its own peak, not the highest of the cases before
+        if small['peak_rss_reset']:
+            assert small['peak_rss_mb'] < big['peak_rss_mb'] - 100
+
+        # The CPU time of the processes the case started
+        _, timing = bm.measure(subprocess.run, [sys.executable, '-c', 'sum(range(3 * 10 ** 7))'])
+        assert timing['children_cpu_s'] > 0 and timing['cpu_s'] < timing['children_cpu_s']
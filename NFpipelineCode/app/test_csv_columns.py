@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the csv_columns module. This requires the use of pytest to run.
+
+"""
+import os
+import gzip
+import pytest
+import pandas as pd
+import csv_columns
+
+FILES = ['a,b\n1,2\n3,4\n',
+         'a,b\r\n1,2\r\n3,4',
+         # Quoted values, with delimiters, quotes and line ends
+         'a,b\n"x,y","say ""hi"""\n"two\nlines",\n',
+         # Blank lines
+         'a,b\n\n1,2\n\n\n,\n\n',
+         # Missing and extra values
+         'a,b,c\n1\n1,2,3\n',
+         'a,b\n1,2,3,4\n5,6\n',
+         # Lines with only spaces
+         'a,b\n  \n1,2\n',
+         # Repeated and empty column names
+         'a,b,a,\n1,2,3,4\n',
+         # Quotes inside a value
+         'a,b\nx"y,"p"q\n',
+         '﻿a,b\n1,2\n',
+         'a\n1\n\n \n""\n',
+         # Blank lines before the header
+         '\r\n1,""""\r\n2,3\r\n',
+         '\n\na,b\n1,2\n',
+         # A quote that isn't closed
+         'a,b\n1,"open\n2,3\n',
+         'a,b\n',
+         '']
+
+class TestCsvColumns:
+
+    @pytest.mark.parametrize('text', FILES)
+    @pytest.mark.parametrize('block_size', [1, 3, csv_columns.BLOCK_SIZE])
+    def test_same_as_dictreader(self, tmp_path, monkeypatch, text, block_size):
+        monkeypatch.setattr(csv_columns.count_fields, '__defaults__', (block_size,))
+        file = tmp_path / 'data.csv'
+        with open(file, 'w', newline = '') as fout:
+            fout.write(text)
+
+        new = csv_columns.read_columns(str(file), ',')
+        old = csv_columns.read_with_csv(str(file), ',')
+        assert dict(new) == dict(old)
+        assert list(new) == list(old)
+
+    def test_pandas(self, tmp_path, monkeypatch):
+        file = tmp_path / 'data.txt'
+        with open(file, 'w', newline = '') as fout:
+            fout.write('subjectkey\tage\tnote\nNDAR1\t12\t"a\tb"\nNDAR2\t\t\n')
+        monkeypatch.setattr(csv_columns, 'read_with_csv', None)
+
+        data = csv_columns.read_columns(str(file), '\t')
+        assert dict(data) == {'subjectkey': ['NDAR1', 'NDAR2'], 'age': ['12', ''], 'note': ['a\tb', '']}
+        assert csv_columns.count_fields(str(file), '\t') == (3, 6)
+
+    def test_scan(self, tmp_path):
+        file = tmp_path / 'data.csv'
+        for text, expected in [('a,b\n1,2', (2, 2)), ('a,b\n\n"1\n\n,",2\n', (2, 2)),
+                               ('a,b\n"x""y",2\n', (2, 2)), ('a,b\n1,"x"y"\n', None), ('a\r1\r', None),
+                               ('\na,b\n1,2\n', None), ('a,b\n1,"2\n', None)]:
+            with open(file, 'w', newline = '') as fout:
+                fout.write(text)
+            assert csv_columns.count_fields(str(file), ',') == expected
+
+    def test_write_columns(self, tmp_path):
+        data = {'a': ['1', '', 'x,y'], 'b': ['say "hi"', None, 2.5], 'c': ['3', '4', '5', 'extra']}
+        savefile = csv_columns.write_columns(str(tmp_path / 'out.csv'), data)
+        with open(savefile, 'r') as fin:
+            text = fin.read()
+        # The rows end with the shortest column
+        assert text == 'a,b,c\n1,"say ""hi""",3\n,,4\n"x,y",2.5,5\n'
+
+        gz = csv_columns.write_columns(str(tmp_path / 'out.csv'), data, 'gzip')
+        assert gz.endswith('out.csv.gz')
+        with gzip.open(gz, 'rt') as fin:
+            assert fin.read() == text
+
+        # No rows: an empty file
+        empty = csv_columns.write_columns(str(tmp_path / 'empty.csv'), {'a': [], 'b': []})
+        assert os.path.getsize(empty) == 0
+
+        with pytest.raises(ValueError):
+            csv_columns.write_columns(str(tmp_path / 'out.csv'), data, 'xlsx')
+
+    def test_write_zstd(self, tmp_path):
+        zstandard = pytest.importorskip('zstandard')
+        savefile = csv_columns.write_columns(str(tmp_path / 'out.csv'), {'a': ['1', '2']}, 'zstd')
+        with zstandard.open(savefile, 'rt') as fin:
+            assert fin.read() == 'a\n1\n2\n'
+
+    def test_write_parquet(self, tmp_path, monkeypatch):
+        pytest.importorskip('pyarrow')
+        monkeypatch.setattr(csv_columns.write_parquet, '__defaults__', (2,))
+        savefile = csv_columns.write_columns(str(tmp_path / 'out.csv'), {'a': ['1', '2', None], 'b': [1, 2, 3]},
+                                             'parquet')
+        assert savefile.endswith('out.parquet')
+        df = pd.read_parquet(savefile)
+        assert df.to_dict('list') == {'a': ['1', '2', ''], 'b': ['1', '2', '3']}
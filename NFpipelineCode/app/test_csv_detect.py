@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the csv_detect module (format detection and its cache). This requires the use of pytest to run.
+
+"""
+import os
+import json
+import pytest
+import csv_detect
+
+
+@pytest.fixture
+def sniffed(tmp_path, monkeypatch):
+    ''' Uses a cache file in tmp_path and returns the list of the paths sniffed '''
+    monkeypatch.setattr(csv_detect, 'CACHE_FILE', tmp_path / 'cache' / 'csv_detect.json')
+    monkeypatch.setattr(csv_detect, '_cache', None)
+    monkeypatch.setattr(csv_detect, '_detected', set())
+    paths = []
+    sniff = csv_detect.sniff
+
+    def counting_sniff(file, head):
+        paths.append(file)
+        return sniff(file, head)
+
+    monkeypatch.setattr(csv_detect, 'sniff', counting_sniff)
+
+    return paths
+
+def new_process(monkeypatch):
+    ''' Forgets the cache in memory, like another run of the application '''
+    monkeypatch.setattr(csv_detect, '_cache', None)
+    monkeypatch.setattr(csv_detect, '_detected', set())
+
+class TestDetect:
+
+    def test_cache_hit(self, tmp_path, monkeypatch, sniffed):
+        file = tmp_path / 'a.txt'
+        file.write_text('x\ty\n1\t2\n')
+        info = csv_detect.detect(str(file))
+        assert info.delimiter == '\t' and info.headers == ['x', 'y']
+
+        assert csv_detect.detect(str(file)) == info
+        new_process(monkeypatch)
+        assert csv_detect.detect(str(file)) == info
+        assert len(sniffed) == 1
+
+    def test_changes(self, tmp_path, monkeypatch, sniffed):
+        file = tmp_path / 'a.csv'
+        file.write_text('x,y\n1,2\n')
+        csv_detect.detect(str(file))
+
+        # Size
+        file.write_text('x,y\n1,2\n3,4\n')
+        csv_detect.detect(str(file))
+        assert len(sniffed) == 2
+
+        # Modification time only
+        st = os.stat(file)
+        os.utime(file, ns = (st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        csv_detect.detect(str(file))
+        assert len(sniffed) == 3
+
+        # First bytes only (same size and modification time)
+        st = os.stat(file)
+        file.write_text('p;q\n1;2\n3;4\n')
+        os.utime(file, ns = (st.st_atime_ns, st.st_mtime_ns))
+        info = csv_detect.detect(str(file))
+        assert len(sniffed) == 4
+        assert info.headers == ['p', 'q']
+
+    @pytest.mark.parametrize('text', ['not json {', '[1, 2]', '{"%s": {"encoding": "ascii"}}'])
+    def test_corrupt_cache(self, tmp_path, sniffed, text):
+        file = tmp_path / 'a.csv'
+        file.write_text('x,y\n1,2\n')
+        csv_detect.CACHE_FILE.parent.mkdir()
+        csv_detect.CACHE_FILE.write_text(text.replace('%s', str(file)))
+
+        assert csv_detect.detect(str(file)).headers == ['x', 'y']
+        assert len(sniffed) == 1
+        with open(csv_detect.CACHE_FILE, 'r') as fin:
+            assert str(file) in json.load(fin)
+
+    def test_other_processes_entries_kept(self, tmp_path, monkeypatch, sniffed):
+        files = [tmp_path / f"{name}.csv" for name in 'abc']
+        for file in files:
+            file.write_text('x,y\n1,2\n')
+        csv_detect.detect(str(files[0]))
+        ours = csv_detect.load_cache()
+
+        # Another process saves its entry after this one loaded the cache
+        new_process(monkeypatch)
+        csv_detect.detect(str(files[1]))
+        monkeypatch.setattr(csv_detect, '_cache', ours)
+        monkeypatch.setattr(csv_detect, '_detected', {str(files[0])})
+
+        csv_detect.detect(str(files[2]))
+        with open(csv_detect.CACHE_FILE, 'r') as fin:
+            assert set(json.load(fin)) == {str(file) for file in files}
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the flatten module (repeated rows of the FITBIR forms). This requires the use of pytest to run.
+
+"""
+import math
+import numpy as np
+import flatten
+from preprocessFITBIR import FITBIRdataset
+
+
+def make_dataset():
+    # G1 has repeated rows (and a copy of its first row at the end), G2 doesn't
+    return {'GUID': ['G1', '', '', 'G2', '', 'G1'],
+            'Date': ['d1', '', '', 'd2', '', 'd1'],
+            'A': ['a', 'b', '', 'c', '', ''],
+            'B': ['x', '', '', 'y', '', 'x'],
+            'A_indic': np.array([0, 0, 1, 0, 1, 1], dtype = np.uint8)}
+
+class TestFlatten:
+
+    def test_find_repeated_columns(self):
+        cols, use_cols = flatten.find_repeated_columns(make_dataset(), ['GUID', 'Date'])
+        assert use_cols == ['GUID', 'Date']
+        # The values are counted, even if they are the same (B), and the indicators always have a value
+        assert cols == ['A', 'B', 'A_indic']
+
+        # Without the GUIDs filled forward, only G1 and G2 rows are grouped
+        cols, use_cols = flatten.find_repeated_columns(make_dataset(), ['Date'])
+        assert use_cols == ['Date'] and cols == ['GUID', 'A', 'B', 'A_indic']
+
+    def test_join(self):
+        dataset = flatten.flatten_rows(make_dataset(), ['A', 'A_indic'])
+        assert dataset == {'GUID': ['G1', 'G2'], 'Date': ['d1', 'd2'], 'A': ['a;b;nan;nan', 'c;nan'],
+                           'B': ['x', 'y'], 'A_indic': ['0;0;1;1', '0;1']}
+
+    def test_make_list(self, tmp_path):
+        list_file = str(tmp_path / 'list_columns.csv')
+        dataset = flatten.flatten_rows(make_dataset(), ['A'], make_list = True, list_file = list_file)
+        assert dataset == {'GUID': ['G1', 'G2', 'G1'], 'Date': ['d1', 'd2', 'd1'], 'B': ['x', 'y', 'x'],
+                           'A_indic': [0, 0, 1]}
+        with open(list_file, 'r') as fin:
+            assert fin.read() == 'GUID,A\nG1,a\n,b\n,\nG2,c\n,\nG1,\n'
+
+    def test_empty_values(self):
+        dataset = {'GUID': ['G1', '', 'G2'], 'A': ['a', 'b', ''], 'B': [1.5, 2.5, float('nan')]}
+        flat = flatten.flatten_rows(dataset, ['B'])
+        assert flat['A'][0] == 'a' and math.isnan(flat['A'][1])
+        assert flat['B'] == ['1.5;2.5', 'nan']
+
+        # Every row has a GUID: nothing to flatten
+        dataset = {'GUID': ['G1', 'G2'], 'A': ['', 'b']}
+        assert flatten.flatten_rows(dataset, ['A']) is dataset
+
+    def test_fitbir_dataset(self, tmp_path):
+        (tmp_path / 'Outputs').mkdir()
+        pfitbir = FITBIRdataset()
+        pfitbir.dataset = make_dataset()
+        bad_cols, use_cols = pfitbir.find_bad_columns(['GUID', 'Date'])
+        pfitbir.fix_bad_columns(True, bad_cols, use_cols, str(tmp_path))
+        assert list(pfitbir.dataset) == ['GUID', 'Date']
+        assert (tmp_path / 'Outputs' / 'list_columns.csv').exists()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the indicators module (missing data indicator columns). This requires the use of pytest to run.
+
+"""
+import random
+import numpy as np
+import pytest
+import indicators
+from preprocessNDA import NDAdataset
+from preprocessFITBIR import FITBIRdataset
+
+
+def make_dataset(cls, seed, ncols = 6, nrows = 50):
+    rng = random.Random(seed)
+    dataset = cls()
+    for i in range(ncols):
+        dataset.dataset[f"c{i}"] = [rng.choice(['', '1', '-999', 'NA', 'x']) for _ in range(nrows)]
+
+    return dataset
+
+def as_csv(dataset, path):
+    with open(dataset.to_csv(str(path)), 'r') as fin:
+        return fin.read()
+
+class TestIndicators:
+
+    @pytest.mark.parametrize('cls', [NDAdataset, FITBIRdataset])
+    @pytest.mark.parametrize('vals', [[''], ['', '-999'], ['NA', 'nan', '-999', '-999']])
+    def test_same_as_handle_missing_data(self, tmp_path, cls, vals):
+        old, new = make_dataset(cls, 0), make_dataset(cls, 0)
+        cols = list(old.dataset.keys())
+        for col in cols:
+            for val in vals:
+                old.handle_missing_data(col, val)
+        new.handle_missing_values(cols, vals)
+
+        assert list(new.dataset) == list(old.dataset)
+        assert as_csv(new, tmp_path / 'new.csv') == as_csv(old, tmp_path / 'old.csv')
+        assert new.dataset[f"c0_{vals[-1]}_indic"].dtype == np.uint8
+
+    def test_one_at_a_time(self, tmp_path):
+        # The indicator of c0 replaces the column c0_x_indic, whose own indicators are made after
+        old, new = make_dataset(NDAdataset, 1), make_dataset(NDAdataset, 1)
+        for dataset in [old, new]:
+            dataset.dataset['c0_x_indic'] = list(dataset.dataset['c1'])
+        cols = list(old.dataset.keys())
+        for col in cols:
+            for val in ['x', '1']:
+                old.handle_missing_data(col, val)
+        new.handle_missing_values(cols, ['x', '1'])
+
+        assert as_csv(new, tmp_path / 'new.csv') == as_csv(old, tmp_path / 'old.csv')
+
+    def test_missing_indicators(self):
+        dataset = {'a': ['1', '', '1'], 'b': ['', '', '2'], 'short': ['']}
+        found = indicators.missing_indicators(dataset, ['a', 'b'], ['', '1'])
+        assert list(found) == ['a__indic', 'a_1_indic', 'b__indic', 'b_1_indic']
+        assert found['a_1_indic'].tolist() == [1, 0, 1] and found['b__indic'].tolist() == [1, 1, 0]
+
+        # Columns of different lengths are compared one by one
+        found = indicators.missing_indicators(dataset, ['a', 'short'], [''])
+        assert found['short__indic'].tolist() == [1] and found['a__indic'].tolist() == [0, 1, 0]
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the jobs module. This requires the use of pytest to run.
+
+"""
+import os
+import json
+import time
+import pytest
+from jobs import JobQueue, stream_events
+from progress import flash, Tracker
+
+
+def shout(message):
+    flash(message)
+    return message.upper()
+
+def count(n):
+    tracker = Tracker('count', total = n, unit = 'numbers')
+    for i in range(n):
+        tracker.update(evens = int(i % 2 == 0))
+    tracker.finish()
+    return n
+
+def fail(message):
+    flash(message)
+    raise ValueError(message)
+
+class TestJobQueue:
+
+    def test_finished_job(self, tmp_path):
+        queue = JobQueue(folder = tmp_path)
+        job_id = queue.submit("Shout", shout, "hello")
+        job = queue.get(job_id)
+        assert job.future.result(timeout = 60) == "HELLO"
+
+        status = job.status()
+        assert status['state'] == 'finished'
+        assert status['messages'] == ["hello"]
+        assert job.result() == "HELLO"
+        queue.shutdown()
+
+    def test_failed_job(self, tmp_path):
+        queue = JobQueue(folder = tmp_path)
+        job = queue.get(queue.submit("Fail", fail, "oops"))
+        with pytest.raises(ValueError):
+            job.future.result(timeout = 60)
+
+        status = job.status()
+        assert status['state'] == 'failed'
+        assert status['messages'] == ["oops"]
+        assert 'oops' in status['error']
+        assert job.result() is None
+        queue.shutdown()
+
+    def test_progress_events(self, tmp_path):
+        queue = JobQueue(folder = tmp_path)
+        job = queue.get(queue.submit("Count", count, 5))
+        job.future.result(timeout = 60)
+
+        progress = job.status()['progress']['count']
+        assert progress['finished']
+        assert (progress['done'], progress['total'], progress['unit']) == (5, 5, 'numbers')
+        assert progress['evens'] == 3
+        assert progress['eta'] == 0
+        queue.shutdown()
+
+    def test_stream_events(self, tmp_path):
+        queue = JobQueue(folder = tmp_path)
+        job = queue.get(queue.submit("Shout", shout, "hello"))
+        messages = list(stream_events(job, interval = 0.01))
+        queue.shutdown()
+
+        names = [m.split('event: ')[1].split('\n')[0] for m in messages if 'event: ' in m]
+        assert names[0] == 'started'
+        assert 'message' in names
+        assert names[-2:] == ['finished', 'end']
+        end = json.loads(messages[-1].split('data: ')[1])
+        assert end['state'] == 'finished'
+
+        # Starting from the id of the last event only gives the end of the stream
+        last_id = int(messages[-1].split('id: ')[1].split('\n')[0])
+        assert len(list(stream_events(job, last_id))) == 1
+
+    def test_state_without_reading_events(self, tmp_path, monkeypatch):
+        queue = JobQueue(folder = tmp_path)
+        job = queue.get(queue.submit("Count", count, 3))
+        # The state of a running job comes from the size of the events file
+        monkeypatch.setattr(job, 'events', lambda: pytest.fail("events file read"))
+        messages = list(stream_events(job, interval = 0.01))
+        assert 'event: end' in messages[-1]
+        assert job.state() == 'finished'
+        queue.shutdown()
+
+def wait_done(job):
+    job.future.result(timeout = 60)
+    # The done time is set by a callback once the result is set
+    for _ in range(100):
+        if job.done_time is not None:
+            break
+        time.sleep(0.01)
+
+class TestPrune:
+
+    def test_max_finished(self, tmp_path):
+        queue = JobQueue(folder = tmp_path, max_finished = 1)
+        first = queue.get(queue.submit("Shout", shout, "one"))
+        wait_done(first)
+        second = queue.get(queue.submit("Shout", shout, "two"))
+        wait_done(second)
+        assert os.path.exists(first.events_file)
+
+        # Only the newest finished job is kept when the next one is submitted
+        third = queue.submit("Shout", shout, "three")
+        assert queue.get(first.id) is None and not os.path.exists(first.events_file)
+        assert queue.get(second.id) is second and queue.get(third) is not None
+        queue.shutdown()
+
+    def test_retention(self, tmp_path):
+        # Events file of an earlier run of the server
+        old = tmp_path / 'old.jsonl'
+        old.write_text('{}\n')
+        os.utime(old, (time.time() - 3600, time.time() - 3600))
+
+        queue = JobQueue(folder = tmp_path, retention = 60)
+        job = queue.get(queue.submit("Shout", shout, "hello"))
+        wait_done(job)
+        assert not old.exists()
+        queue.prune()
+        assert queue.get(job.id) is job
+
+        queue.retention = 0
+        queue.prune()
+        assert queue.get(job.id) is None and not os.path.exists(job.events_file)
+        queue.shutdown()
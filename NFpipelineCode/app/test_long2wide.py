@@ -36,6 +36,15 @@ class TestLong2Wide(unittest.TestCase):
                                        ('CCC', '08/16/2019'): {'Col1': ['3.2'], 'Col2': ['1']}})
 
 
+    def test_rows_to_dict(self):
+
+        dd = {'ID': ['AAA', 'BBB', 'AAA'], 'Date': ['08/16/2019', '08/16/2019', '08/16/2019'],
+              'Col1': ['2.45', '', None], 'Col2': ['0', '1', '1']}
+        test_dd = l2w.rows_to_dict(dd, ['ID', 'Date', 'Col1', 'Col2'], 'ID', 'Date')
+        self.assertDictEqual(test_dd, {('AAA', '08/16/2019'): {'Col1': ['2.45', ''], 'Col2': ['0', '1']},
+                                       ('BBB', '08/16/2019'): {'Col1': [''], 'Col2': ['1']}})
+
+
     def test_convert_to_date_float_date(self):
         test_date = l2w.convert_to_time('6', False, False)
         self.assertEqual(test_date, 6.0)
@@ -12,8 +12,16 @@ Description: This runs the unit tests for the merge_csvs module. This requires p
 import os
 print(os.getcwd())
 
+import random
+from collections import defaultdict
 import pytest
-from merge_csvs import merge_all, merge_lists, compare_lists
+from merge_csvs import merge_all, merge_lists, compare_lists, compare_table_rows, remove_empty_columns, \
+                       stream_row_bind, write_to_csv, plan_merge, find_empty_columns, table_columns
+from merge_index import RowIndex
+from column_registry import ColumnRegistry
+from columnar import ColumnarTable
+import stats_pipeline as statsp
+from merge_cache import MergeCache
 
 class TestMergeLists:
 
@@ -45,6 +53,220 @@ class TestMergeLists:
         merged_row = merge_lists(l1, l2)
         assert merged_row == [l1, l2]
 
+class TestCompareTableRows:
+
+    def merge_rows(self, rows, indexed):
+        table = ColumnarTable([f'c{j}' for j in range(len(rows[0]))])
+        index = None
+        for row in rows:
+            if 'A' not in table:
+                get_row = True
+            else:
+                get_row = compare_table_rows(table, 'A', list(row), index if indexed else None)
+            if get_row:
+                table.append('A', list(row))
+                if index is not None:
+                    index.add(list(row))
+                elif len(table.rows('A')) > 1:
+                    index = RowIndex([table.row(r) for r in table.rows('A')])
+        return table.key_dict('A')
+
+    def reference(self, rows):
+        dd = defaultdict(list)
+        for row in rows:
+            if dd:
+                dd, get_row = compare_lists(dd, list(row))
+            else:
+                get_row = True
+            if get_row:
+                for j, v in enumerate(row):
+                    dd[f'c{j}'].append(v)
+        return dict(dd)
+
+    def test_matches_compare_lists(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            ncols = rng.randint(1, 6)
+            rows = [[rng.choice(['', '', 'a', 'b', 'c']) for _ in range(ncols)]
+                    for _ in range(rng.randint(1, 12))]
+            assert self.merge_rows(rows, True) == self.reference(rows)
+            assert self.merge_rows(rows, False) == self.reference(rows)
+
+    def test_merges_first_match(self):
+        rows = [['1', '', ''], ['2', '', ''], ['', 'x', ''], ['2', '', 'y']]
+        assert self.merge_rows(rows, True) == {'c0': ['1', '2'], 'c1': ['x', ''], 'c2': ['', 'y']}
+
+    def test_candidates(self):
+        index = RowIndex([['1', '', 'x'], ['2', 'a', ''], ['', 'a', 'y'], ['1']])
+        # Rows with the same value or '' at every position (or too short to have one)
+        assert index.candidates(['1', 'a', '']) == [0, 2, 3]
+        assert index.candidates(['', 'a', 'y']) == [1, 2, 3]
+        assert index.candidates(['3', '', '']) == [2]
+        index.update(2, ['', 'a', 'y'], ['3', 'a', 'y'])
+        assert index.candidates(['3', '', '']) == [2]
+        assert index.candidates(['', '', '']) == [0, 1, 2, 3]
+
+
+class TestColumnarTable:
+
+    def test_round_trip(self):
+        table = ColumnarTable(['a', 'b'])
+        table.append(('S1', 'd1'), ['1', ''])
+        table.append(('S2', 'd1'), ['', ''])
+        table.append(('S1', 'd1'), ['2', 'x'])
+        assert table.key_dict(('S1', 'd1')) == {'a': ['1', '2'], 'b': ['', 'x']}
+        assert table.column_values('a') == ['1', '2', '']
+
+    def test_remove_empty_columns(self):
+        table = ColumnarTable(['a', 'b', 'c'])
+        table.append('S1', ['1', '', ''])
+        table.append('S2', ['', '', 'y'])
+        table, cols = remove_empty_columns(table, 'column')
+        assert cols == ['a', 'c']
+        assert table.to_dict() == {'S1': {'a': ['1'], 'c': ['']}, 'S2': {'a': [''], 'c': ['y']}}
+
+    def test_find_empty_columns_in_chunks(self):
+        table = ColumnarTable(['a', 'b', 'c'])
+        for i in range(10):
+            table.append(f'S{i}', ['', 'x' if i == 9 else '', ''])
+        # 'b' was emptied by a merge, so its pool holds a value no row uses
+        table.set_row(0, ['', 'z', ''])
+        table.set_row(0, ['', '', ''])
+        assert find_empty_columns(table, 'column', chunk_size = 3) == (['a', 'b', 'c'], ['a', 'c'])
+
+        dd = {'a': ['', ''], 'b': ['', '1'], 'c': []}
+        assert find_empty_columns(dd, 'row', chunk_size = 1) == (['a', 'b', 'c'], ['a'])
+
+        dd = {'S1': {'a': [''], 'b': ['']}, 'S2': {'a': ['', ''], 'b': ['', '2']}}
+        assert find_empty_columns(dd, 'column', chunk_size = 1) == (['a', 'b'], ['a'])
+
+class TestStreamRowBind:
+
+    def test_matches_in_memory_row_bind(self, tmp_path):
+        f1 = tmp_path / 'a.csv'
+        f2 = tmp_path / 'b.csv'
+        f1.write_text('ID,Date,x,empty\nAAA,1,2,\nBBB,1,,\n')
+        f2.write_text('ID,y,Date\nAAA,7,2\nCCC\n')
+        files = [str(f1), str(f2)]
+
+        dd = merge_all(files, 'ID', 'Date', 'row', None)
+        dd, cols = remove_empty_columns(dd, 'row')
+        write_to_csv(dd, ['ID', 'Date'] + cols, str(tmp_path / 'memory.csv'), 'ID', 'Date', False, 'row')
+
+        streamed_cols = stream_row_bind(files, str(tmp_path / 'streamed.csv'), None, ['ID', 'Date'])
+
+        assert streamed_cols == cols == ['ID', 'Date', 'x', 'y']
+        assert (tmp_path / 'streamed.csv').read_text() == (tmp_path / 'memory.csv').read_text()
+        assert not (tmp_path / 'streamed.csv.tmp').exists()
+
+    def test_header_only(self, tmp_path):
+        f1 = tmp_path / 'a.csv'
+        f2 = tmp_path / 'b.csv'
+        f1.write_text('ID,Date,x\n')
+        f2.write_text('ID,y\n')
+        files = [str(f1), str(f2)]
+
+        dd = merge_all(files, 'ID', 'Date', 'row', None)
+        dd, cols = remove_empty_columns(dd, 'row')
+        write_to_csv(dd, ['ID', 'Date'] + cols, str(tmp_path / 'memory.csv'), 'ID', 'Date', False, 'row')
+
+        streamed_cols = stream_row_bind(files, str(tmp_path / 'streamed.csv'), None, ['ID', 'Date'])
+
+        # No columns with values: only the lead columns are written
+        assert streamed_cols == cols == []
+        assert (tmp_path / 'streamed.csv').read_text() == (tmp_path / 'memory.csv').read_text() == 'ID,Date\n'
+
+class TestHandoff:
+
+    def test_table_columns_match_file(self, tmp_path):
+        table = ColumnarTable(['x', 'y'])
+        table.append(('AAA', '1'), ['2', None])
+        table.append(('BBB', '1'), ['', 'z'])
+        table.append(('AAA', '1'), ['3', ''])
+        cols = ['ID', 'Date', 'x', 'y']
+        write_to_csv(table, cols, str(tmp_path / 'out.csv'), 'ID', 'Date', False, 'column')
+
+        assert dict(table_columns(table, cols, 'ID', 'Date')) == dict(statsp.read_csv(str(tmp_path / 'out.csv')))
+
+class TestParallelMerge:
+
+    def test_matches_serial_merge(self, tmp_path):
+        f1 = tmp_path / 'a.csv'
+        f2 = tmp_path / 'b.csv'
+        f3 = tmp_path / 'c.csv'
+        f1.write_text('ID,Date,x\nAAA,1,2\nBBB,1,3\nAAA,1,\n')
+        f2.write_text('ID,Date,y\nAAA,1,7\nAAA,1,8\nCCC,2,\n')
+        f3.write_text('ID,Date,x,y\nBBB,1,3,9\nAAA,1,4,\n')
+        files = [str(f1), str(f2), str(f3)]
+
+        serial = merge_all(files, 'ID', 'Date', 'column', None)
+        parallel = merge_all(files, 'ID', 'Date', 'column', None, workers = 2)
+        assert parallel.to_dict() == serial.to_dict()
+        assert list(parallel.keys()) == list(serial.keys())
+
+        assert merge_all(files, 'ID', 'Date', 'row', None, workers = 2) == merge_all(files, 'ID', 'Date', 'row', None)
+
+        # Row binding straight to the file keeps the order of the files
+        stream_row_bind(files, str(tmp_path / 'parallel.csv'), None, ['ID'], workers = 2)
+        stream_row_bind(files, str(tmp_path / 'serial.csv'), None, ['ID'])
+        assert (tmp_path / 'parallel.csv').read_text() == (tmp_path / 'serial.csv').read_text()
+
+class TestPlanMerge:
+
+    def test_column_registry(self):
+        reg = ColumnRegistry(['b', 'a', 'b'], mapping = {'a': 'A'})
+        assert not reg.add('a')
+        assert reg.add('c')
+        assert 'a' in reg and 'A' not in reg
+        assert reg.names() == ['b', 'a', 'c']
+        assert reg.mapped_names() == ['b', 'A', 'c']
+
+    def test_plan_matches_merge(self, tmp_path):
+        f1 = tmp_path / 'a.csv'
+        f2 = tmp_path / 'b.csv'
+        f3 = tmp_path / 'c.csv'
+        f1.write_text('ID,Date,x\nAAA,1,2\n')
+        f2.write_text('ID,y\nAAA,7\n')
+        f3.write_text('Date,ID,y,z\nBBB,1,3,9\n')
+        files = [str(f1), str(f2), str(f3)]
+
+        plan = plan_merge(files, 'ID', 'Date', 'column', {'z': 'Z'})
+        assert plan.columns == ['x', 'y', 'z']
+        assert plan.out_columns == ['x', 'y', 'Z']
+        assert plan.missing_files == [str(f2)]
+        assert plan.merge_files == [str(f1), str(f3)]
+        assert merge_all(files, 'ID', 'Date', 'column', {'z': 'Z'}).columns == plan.out_columns
+
+        plan = plan_merge(files, 'ID', 'Date', 'row')
+        assert plan.out_columns == ['ID', 'Date', 'x', 'y', 'z']
+        assert plan.missing_files == []
+
+class TestIncrementalMerge:
+
+    def test_only_changed_files_are_read(self, tmp_path):
+        f1 = tmp_path / 'a.csv'
+        f2 = tmp_path / 'b.csv'
+        f1.write_text('ID,Date,x\nAAA,1,2\nBBB,1,3\n')
+        f2.write_text('ID,Date,y\nAAA,1,7\n')
+        files = [str(f1), str(f2)]
+
+        cache = MergeCache(tmp_path / 'cache')
+        merge_all(files, 'ID', 'Date', 'column', None, cache = cache)
+        cache.save()
+        assert (cache.reused, cache.parsed) == (0, 2)
+
+        f2.write_text('ID,Date,y\nAAA,1,8\nCCC,2,9\n')
+        cache = MergeCache(tmp_path / 'cache')
+        table = merge_all(files, 'ID', 'Date', 'column', None, cache = cache)
+        cache.save()
+        assert (cache.reused, cache.parsed) == (1, 1)
+        assert table.to_dict() == merge_all(files, 'ID', 'Date', 'column', None).to_dict()
+
+        cache = MergeCache(tmp_path / 'cache')
+        stream_row_bind(files, str(tmp_path / 'streamed.csv'), None, ['ID'], cache = cache)
+        stream_row_bind(files, str(tmp_path / 'fresh.csv'), None, ['ID'])
+        assert (tmp_path / 'streamed.csv').read_text() == (tmp_path / 'fresh.csv').read_text()
+
 # class TestCompareLists:
 
 #     def test_
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the preprocessing tasks of the pipeline_tasks module. This requires the use of pytest to run.
+
+"""
+import os
+import json
+import pytest
+import benchmark as bm
+import progress
+import pipeline_tasks as tasks
+from profiling import profile_run
+
+SCALE = {'subjects': 5, 'visits': 2, 'columns': 4, 'files': 3, 'sparsity': 0.5, 'repeats': 2}
+
+
+def read_outputs(outputs):
+    texts = {}
+    for output in outputs:
+        with open(output, 'r') as fin:
+            texts[os.path.basename(output)] = fin.read()
+
+    return texts
+
+def flash_file(file, column_mapping, column_scaling, **options):
+    progress.flash(f"read {os.path.basename(file)}")
+    return file, 1
+
+class TestPreprocess:
+
+    @pytest.mark.parametrize('source', ['nda', 'fitbir'])
+    def test_same_with_workers(self, tmp_path, source):
+        make_files = bm.make_nda_files if source == 'nda' else bm.make_fitbir_files
+        preprocess = tasks.preprocess_nda if source == 'nda' else tasks.preprocess_fitbir
+        files = make_files(str(tmp_path / 'inputs'), **SCALE)
+
+        outputs = {}
+        for workers in [None, 2]:
+            folder = tmp_path / f"out{workers}"
+            folder.mkdir()
+            outputs[workers] = preprocess(files, str(folder), {}, {}, miss_val = '', workers = workers)
+        # Same files, in the order of the inputs
+        assert len(outputs[2]) == 3
+        assert read_outputs(outputs[2]) == read_outputs(outputs[None])
+
+    @pytest.mark.parametrize('workers', [None, 2])
+    def test_bad_file(self, tmp_path, workers):
+        files = bm.make_nda_files(str(tmp_path / 'inputs'), **SCALE)
+        files.insert(1, str(tmp_path / 'missing.csv'))
+
+        outputs = tasks.preprocess_nda(files, str(tmp_path), {}, {}, workers = workers)
+        # The other files are still processed
+        assert [os.path.basename(output) for output in outputs] == \
+            [f"processed_{os.path.basename(file)}" for file in files if 'missing' not in file]
+
+        with pytest.raises(RuntimeError):
+            tasks.preprocess_nda(files[1:2], str(tmp_path), {}, {}, workers = workers)
+
+    def test_main(self, tmp_path, capsys):
+        files = bm.make_nda_files(str(tmp_path / 'inputs'), **SCALE)
+        outputs = tasks.main(['nda', *files, '--output', str(tmp_path / 'out'), '--workers', '1'])
+        assert len(outputs) == 3 and all(os.path.exists(output) for output in outputs)
+        assert 'processed' in capsys.readouterr().out
+
+    def test_worker_messages_and_stages(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(tasks, 'available_memory', lambda: 1024 ** 4)
+        files = bm.make_nda_files(str(tmp_path / 'inputs'), **SCALE)
+        messages = []
+        progress.set_listener(lambda event, **fields: messages.append(fields['message']) if event == 'message' else None)
+        try:
+            with profile_run('test') as profile:
+                results = list(tasks.preprocess_files(flash_file, files, {}, {}, None, workers = 2))
+        finally:
+            progress.set_listener(None)
+        # The messages of the worker processes are sent by this process
+        assert sorted(messages) == sorted(f"read {os.path.basename(file)}" for file in files)
+        assert profile.stages['preprocess file']['files'] == 3
+        assert all(result.error is None for result in results)
+
+        # The run report has the time of the files preprocessed by the workers
+        tasks.preprocess_nda(files, str(tmp_path), {}, {}, workers = 2)
+        with open(tmp_path / 'preprocess_nda_profile.json', 'r') as fin:
+            stages = json.load(fin)['stages']
+        assert stages['preprocess file']['files'] == 3 and stages['preprocess file']['cpu_s'] > 0
+
+    def test_preprocess_workers(self, tmp_path, monkeypatch):
+        files = bm.make_nda_files(str(tmp_path / 'inputs'), **SCALE)
+        size = max(os.path.getsize(file) for file in files)
+        # Memory for two processes
+        monkeypatch.setattr(tasks, 'available_memory', lambda: 2 * (size * tasks.PREPROCESS_MEMORY_FACTOR
+                                                                       + tasks.PROCESS_MEMORY))
+        assert tasks.preprocess_workers(files, 4) == 2
+        monkeypatch.setattr(tasks, 'available_memory', lambda: 0)
+        assert tasks.preprocess_workers(files, 4) == 1
+        monkeypatch.setattr(tasks, 'available_memory', lambda: None)
+        assert tasks.preprocess_workers(files, 4) == 4
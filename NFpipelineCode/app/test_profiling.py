@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the profiling module. This requires the use of pytest to run.
+
+"""
+import json
+import pytest
+import profiling
+from profiling import profile_run, timed, report_name
+from progress import Tracker
+
+
+class TestProfiling:
+
+    def test_report_name(self):
+        assert report_name('Outputs/merged.csv') == 'Outputs/merged_profile.json'
+
+    def test_stages(self, tmp_path):
+        report_file = tmp_path / 'run_profile.json'
+        with profile_run('test', report_file, bind = 'row'):
+            for _ in range(2):
+                tracker = Tracker('write', unit = 'rows')
+                tracker.update(3)
+                tracker.finish(bytes = 10)
+            assert list(timed('parse', range(4))) == [0, 1, 2, 3]
+
+        report = json.loads(report_file.read_text())
+        assert report['name'] == 'test'
+        assert report['settings'] == {'bind': 'row'}
+        assert list(report['stages']) == ['write', 'parse']
+
+        write = report['stages']['write']
+        assert (write['calls'], write['rows'], write['bytes']) == (2, 6, 20)
+        assert write['wall_s'] >= 0 and write['cpu_s'] >= 0
+        assert report['stages']['parse']['items'] == 4
+
+    def test_saved_on_error(self, tmp_path):
+        report_file = tmp_path / 'run_profile.json'
+        with pytest.raises(ValueError):
+            with profile_run('test', report_file):
+                Tracker('merge').finish(2)
+                raise ValueError("failed")
+
+        assert json.loads(report_file.read_text())['stages']['merge']['items'] == 2
+        # Stages outside of a run are not recorded
+        assert profiling._profile is None
+
+    def test_stage_peaks(self, monkeypatch):
+        # Peak memory of the process, reset to the current memory (10)
+        memory = {'peak': 500}
+        monkeypatch.setattr(profiling, 'peak_rss_mb', lambda: memory['peak'])
+        monkeypatch.setattr(profiling, 'reset_peak_rss', lambda: memory.update(peak = 10) or True)
+
+        with profile_run('test') as profile:
+            outer = Tracker('merge')
+            for _ in timed('parse', range(2)):
+                memory['peak'] = 300
+            Tracker('write').finish()
+            memory['peak'] = max(memory['peak'], 50)
+            outer.finish()
+            report = profile.report()
+
+        stages = report['stages']
+        # Each stage has its own peak, and the peaks of the stages inside it
+        assert (stages['parse']['peak_rss_mb'], stages['write']['peak_rss_mb']) == (300, 10)
+        assert stages['merge']['peak_rss_mb'] == 300
+        # The run has the highest peak since it started
+        assert report['peak_rss_mb'] == 300
+
+    def test_cumulative_peaks(self, monkeypatch):
+        memory = {'peak': 500}
+        monkeypatch.setattr(profiling, 'peak_rss_mb', lambda: memory['peak'])
+        monkeypatch.setattr(profiling, 'reset_peak_rss', lambda: False)
+
+        with profile_run('test') as profile:
+            Tracker('write').finish()
+            report = profile.report()
+
+        # Without a reset, the stages have the peak of the process so far
+        assert report['stages']['write']['rss_high_water_mb'] == 500
+        assert 'peak_rss_mb' not in report['stages']['write']
+        assert not report['peak_rss_reset']
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the stats_engine module. This requires the use of pytest to run.
+
+"""
+import random
+import numpy as np
+import pandas as pd
+import pytest
+import stats_pipeline as sp
+import stats_engine
+
+
+def numeric_or_text_mode(array):
+    ''' get_mode with the behavior of pd.to_numeric(errors='ignore') (removed from newer pandas) '''
+    series = pd.Series(array)
+    try:
+        series = pd.to_numeric(series)
+    except (ValueError, TypeError):
+        pass
+    mode = series.mode()
+
+    return mode[0] if len(mode) != 0 else np.nan
+
+def make_column(rng, kind, n):
+    values = []
+    for _ in range(n):
+        if rng.random() < 0.2:
+            values.append('')
+        elif kind == 'int':
+            values.append(str(rng.randint(-5, 5)))
+        elif kind == 'float':
+            values.append(repr(rng.gauss(100, 20)))
+        elif kind == 'mixed':
+            values.append(rng.choice(['1', '2.5', 'x', '3', 'y']))
+        else:
+            values.append(rng.choice(['b', 'a', 'c']))
+
+    return values
+
+def as_csv(stats, path):
+    sp.dict_to_csv(stats, path)
+    with open(path, 'r') as fin:
+        return fin.read()
+
+class TestStatsEngine:
+
+    @pytest.fixture(autouse = True)
+    def mode(self, monkeypatch):
+        monkeypatch.setattr(sp, 'get_mode', numeric_or_text_mode)
+
+    def test_same_as_try_stats(self, tmp_path):
+        rng = random.Random(0)
+        for n in [1, 2, 3, 4, 7, 250]:
+            dd = {f"{kind}{k}": make_column(rng, kind, n) for k in range(3) for kind in ['int', 'float', 'mixed', 'text']}
+            dd['no_missing'] = [str(rng.randint(0, 3)) for _ in range(n)]
+            dd['empty'] = [''] * n
+
+            old = as_csv(sp.make_stats_dict_from_file(dd, vectorized = False), tmp_path / 'old.csv')
+            new = as_csv(sp.make_stats_dict_from_file(dd), tmp_path / 'new.csv')
+            assert new == old
+
+    def test_blocks(self, tmp_path):
+        # Columns of different lengths, split over several blocks
+        rng = random.Random(1)
+        columns = [(f"c{i}", make_column(rng, rng.choice(['int', 'float', 'mixed']), rng.choice([5, 40])))
+                   for i in range(30)]
+        new = dict(stats_engine.column_stats(iter(columns), sp.column_try_stats, block_cells = 100))
+        assert list(new) == [name for name, _ in columns]
+
+        old = {name: sp.column_try_stats(name, values) for name, values in columns}
+        assert as_csv(new, tmp_path / 'new.csv') == as_csv(old, tmp_path / 'old.csv')
+
+    def test_workers(self, tmp_path, monkeypatch):
+        # Groups of a few columns are sent to the processes
+        monkeypatch.setattr(stats_engine, 'PARALLEL_SHARD_CELLS', 60)
+        monkeypatch.setattr(stats_engine, 'PARALLEL_MIN_CELLS', 100)
+        rng = random.Random(2)
+        columns = [(f"c{i}", make_column(rng, rng.choice(['int', 'float', 'mixed', 'text']), rng.choice([0, 5, 40])))
+                   for i in range(30)]
+        new = dict(stats_engine.column_stats(iter(columns), sp.column_try_stats, block_cells = 100, workers = 2))
+        assert list(new) == [name for name, _ in columns]
+
+        old = dict(stats_engine.column_stats(iter(columns), sp.column_try_stats))
+        assert as_csv(new, tmp_path / 'new.csv') == as_csv(old, tmp_path / 'old.csv')
+
+    def test_few_values_in_process(self, tmp_path, monkeypatch):
+        # No worker processes are started for a small file
+        monkeypatch.setattr(stats_engine, 'parallel_column_stats', None)
+        columns = [('a', ['1', '2', '3']), ('b', ['x', '', 'y'])]
+        new = dict(stats_engine.column_stats(iter(columns), sp.column_try_stats, workers = 4))
+        assert list(new) == ['a', 'b']
+
+        old = dict(stats_engine.column_stats(iter(columns), sp.column_try_stats))
+        assert as_csv(new, tmp_path / 'new.csv') == as_csv(old, tmp_path / 'old.csv')
+
+    def test_types(self):
+        stats = sp.make_stats_dict_from_file({'i': ['3', '1', '3'], 'f': ['3', '', '1.5'], 't': ['b', 'a', 'b']})
+        # Integer columns keep integer min, max and mode
+        assert str(stats['i']['Min']) == '1' and str(stats['i']['Mode']) == '3'
+        assert str(stats['f']['Max']) == '3.0' and stats['f']['% Missing'] == pytest.approx(100/3)
+        assert stats['t']['Mode'] == 'b' and np.isnan(stats['t']['Mean'])
+        assert stats['t']['Value Range'] == "['a', 'b']"
+
+    def test_large_integers(self, tmp_path):
+        # Integers above 2**53 can't be told apart as floats, so the mode comes from the integers
+        dd = {'big': ['-4540192823650009127', '-4540192823650009127', '-4540192823650009128', '9007199254740993']}
+        stats = sp.make_stats_dict_from_file(dd)
+        assert str(stats['big']['Mode']) == '-4540192823650009127'
+
+        old = sp.make_stats_dict_from_file(dd, vectorized = False)
+        assert stats['big']['Mode'] == old['big']['Mode']
+        assert as_csv(stats, tmp_path / 'new.csv') == as_csv(old, tmp_path / 'old.csv')
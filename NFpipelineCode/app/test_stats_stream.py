@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+# This repository was developed with funding from the National Institute of Mental Health (NIMH),
+# grant # 1R01MH116156 awarded to Dr. Jessica L. Nielson, PhD at the University of Minnesota.
+# ©2024 Regents of the University of Minnesota. All rights reserved.
+
+# This repository is open source and available under Attribution-NonCommercial-NoDerivatives (CC BY-NC-SA):
+# (https://creativecommons.org/licenses/by-nc-sa/4.0/deed.en)
+
+Description: Unit tests for the stats_stream module. This requires the use of pytest to run.
+
+"""
+import csv
+import random
+import numpy as np
+import pytest
+import stats_pipeline as sp
+import stats_stream as ss
+
+
+def write_file(path, n, seed = 0):
+    rng = random.Random(seed)
+    with open(path, 'w', newline = '') as fout:
+        writer = csv.writer(fout)
+        writer.writerow(['small', 'gauss', 'text', 'skewed'])
+        for _ in range(n):
+            writer.writerow([str(rng.randint(0, 5)),
+                             '' if rng.random() < 0.2 else repr(rng.gauss(10, 3)),
+                             rng.choice(['a', 'b', 'c', '']),
+                             repr(rng.expovariate(1))])
+
+    return path
+
+class TestStatsStream:
+
+    @pytest.fixture
+    def stats(self, tmp_path):
+        path = write_file(tmp_path / 'data.csv', 2000)
+        exact = sp.make_stats_dict_from_file(sp.read_csv(path))
+
+        return path, exact
+
+    def test_chunks_match_exact(self, stats):
+        # Columns with few numbers keep them, so only the rounding of the moments differs
+        path, exact = stats
+        streamed = ss.stream_stats(path, chunk_cells = 1200, exact_values = 10000)
+        for col in ['small', 'gauss', 'skewed']:
+            for key in ['Mean', 'Median', 'Min', 'Max', 'Variance', 'Standard Deviation',
+                        '5th Percentile', '95th Percentile', 'Skewness', 'Kurtosis', '% Missing']:
+                assert streamed[col][key] == pytest.approx(exact[col][key], rel = 1e-9)
+        for key in ['Value Range', '# Unique Values', '% Missing']:
+            assert streamed['text'][key] == exact['text'][key]
+            assert streamed['small'][key] == exact['small'][key]
+        assert streamed['small']['Mode'] == exact['small']['Mode']
+        assert isinstance(streamed['small']['Min'], np.integer)
+
+    def test_sketches(self, stats):
+        path, exact = stats
+        streamed = ss.stream_stats(path, chunk_cells = 1200, exact_values = 100, max_distinct = 50)
+        for key in ['Median', '5th Percentile', '95th Percentile']:
+            assert streamed['gauss'][key] == pytest.approx(exact['gauss'][key], rel = 0.05)
+        assert streamed['gauss']['# Unique Values'] == pytest.approx(exact['gauss']['# Unique Values'], rel = 0.1)
+        assert streamed['gauss']['Value Range'] == "Element has more than 10 unique values"
+        assert streamed['gauss']['Mean'] == pytest.approx(exact['gauss']['Mean'], rel = 1e-9)
+
+    def test_small_file_is_exact(self, tmp_path):
+        path = write_file(tmp_path / 'data.csv', 100)
+        exact = sp.make_stats_dict_from_file(sp.read_csv(path))
+        streamed = ss.stream_stats(path)
+        sp.dict_to_csv(exact, tmp_path / 'exact.csv')
+        sp.dict_to_csv(streamed, tmp_path / 'streamed.csv')
+        assert (tmp_path / 'streamed.csv').read_text() == (tmp_path / 'exact.csv').read_text()
+
+    def test_frequent_values(self):
+        values = ss.FrequentValues(capacity = 3)
+        values.update({'a': 50})
+        for i in range(100):
+            values.update({i: 1, 'b': 1})
+        assert not values.exact
+        assert values.mode() == 'b'
+
+    def test_distinct_sketch(self):
+        sketch = ss.DistinctSketch(size = 256)
+        sketch.update([str(i) for i in range(100)])
+        assert sketch.count() == 100
+        for start in range(0, 20000, 1000):
+            sketch.update([str(i) for i in range(start, start + 1000)])
+        assert sketch.count() == pytest.approx(20000, rel = 0.2)
+
+    def test_quantile_sketch(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(0, 100, 10000)
+        sketch = ss.QuantileSketch(accuracy = 0.01)
+        for part in np.array_split(values, 7):
+            sketch.update(part)
+        for q in [0.05, 0.5, 0.95]:
+            rank = q * (len(values) - 1)
+            ordered = np.sort(values)
+            # Within 1% of a value with about the same rank
+            near = ordered[int(rank) - 2:int(rank) + 3]
+            assert np.min(np.abs(near - sketch.quantile(q)) / np.abs(near)) <= 0.01